@@ -1,15 +1,29 @@
-from flask import Flask, request, jsonify, send_from_directory, Response, make_response
+from flask import Flask, request, jsonify, send_from_directory, Response, make_response, g, stream_with_context
 from flask_cors import CORS
-from datetime import datetime, timezone
-from models import init_db, get_db, NotifyTask, NotifyChannel, NotifyStatus, User, UserChannel, ExternalCalendar
-from scheduler import scheduler, get_cron_trigger, event_manager
-from auth import login_required, admin_required, user_login, user_register, update_user_profile
-from encryption import encrypt_sensitive_fields, decrypt_sensitive_fields
+from datetime import datetime, timedelta, timezone
+from models import (
+    init_db, get_db, NotifyTask, NotifyChannel, NotifyStatus, User, UserChannel, ExternalCalendar, TaskDelivery, TaskExecution,
+    TaskTombstone
+)
+from scheduler import scheduler, cancel_task_retries, get_cron_trigger, event_manager, EVENT_POLL_INTERVAL, TOMBSTONE_RETENTION_DAYS
+from auth import (
+    login_required, admin_required, user_login, user_register, update_user_profile, load_user, invalidate_user,
+    PasswordHashBusy
+)
+from delivery import delivery_engine
+from encryption import (
+    encrypt_sensitive_fields, decrypt_sensitive_fields, encrypt_sensitive_fields_batch, decrypt_sensitive_fields_batch
+)
+from sqlalchemy import and_, func, insert, or_
+import base64
 import json
+import metrics
 import os
 import jwt
+import queue
 import secrets
-import uuid
+import tracing
+import zlib
 
 app = Flask(__name__, static_folder='static')
 CORS(app)  # 启用跨域支持
@@ -17,13 +31,38 @@ CORS(app)  # 启用跨域支持
 # 配置JWT密钥
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
 
-# 初始化数据库
-init_db()
+# /metrics 接口的访问令牌（Bearer），未设置时接口关闭（返回 404），避免指标被公开访问
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
 
-# 加载待发送任务
-scheduler.load_pending_tasks()
-# 启动外部日历同步任务 (每15分钟)
-scheduler.add_external_calendar_sync_job()
+# 测试通知的发送超时（秒，含限流排队），需小于 Gunicorn 的 worker 超时
+TEST_NOTIFICATION_TIMEOUT = float(os.getenv('TEST_NOTIFICATION_TIMEOUT', '30'))
+
+# 调度角色：embedded（默认，Web 进程参与调度选主）或 web（仅提供 API，调度由 `python -m dispatcher` 负责）
+SCHEDULER_ROLE = os.getenv('SCHEDULER_ROLE', 'embedded')
+
+if SCHEDULER_ROLE != 'web':
+    # 初始化数据库
+    init_db()
+
+    # 启动调度器：多进程部署时通过数据库租约选出唯一主节点负责加载任务与发送
+    scheduler.start()
+
+
+if tracing.ENABLED:
+    # 按采样比例追踪请求耗时（未开启追踪时不注册钩子）
+    @app.before_request
+    def start_request_trace():
+        rule = request.url_rule.rule if request.url_rule else request.path
+        g.trace = tracing.start(f'{request.method} {rule}')
+
+    @app.after_request
+    def record_trace_status(response):
+        g.trace_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_trace(exc):
+        tracing.finish(g.pop('trace', None), status=g.pop('trace_status', 500))
 
 
 # 认证相关API
@@ -47,6 +86,10 @@ def login():
             'data': result
         }), 200
 
+    except PasswordHashBusy as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -75,6 +118,10 @@ def register():
             'data': result
         }), 201
 
+    except PasswordHashBusy as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -84,8 +131,12 @@ def register():
 def get_profile():
     """获取当前用户信息"""
     try:
+        # 无状态模式下 token 只包含部分字段，从缓存或数据库读取完整资料
+        user = load_user(request.current_user.id)
+        if not user:
+            return jsonify({'error': '用户不存在'}), 404
         return jsonify({
-            'user': request.current_user.to_dict()
+            'user': user.to_dict()
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -108,6 +159,10 @@ def update_profile():
             'data': result
         })
 
+    except PasswordHashBusy as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -323,6 +378,60 @@ def preview_cron():
         }), 500
 
 
+def _encode_cursor(sort_by, sort_order, task):
+    """生成任务列表的游标（最后一条记录的排序值与 ID）"""
+    value = getattr(task, sort_by)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, NotifyStatus):
+        value = value.value
+    payload = json.dumps([sort_by, sort_order, value, task.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor, sort_by, sort_order, nullable):
+    """
+    解析游标，返回 (排序值, ID)；排序值为 None 表示最后一条记录的排序字段为 NULL（仅 nullable 字段允许）
+
+    游标无效或与当前排序方式不一致时抛出 ValueError
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort_by, cursor_order, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError('无效的游标')
+    if (cursor_sort_by, cursor_order) != (sort_by, sort_order):
+        raise ValueError('游标与排序方式不匹配')
+    if value is None and not nullable:
+        raise ValueError('无效的游标')
+    try:
+        if value is not None and sort_by in ('scheduled_time', 'created_at'):
+            value = datetime.fromisoformat(value)
+        elif value is not None and sort_by == 'status':
+            value = NotifyStatus(value)
+        elif sort_by == 'id' and not isinstance(value, int):
+            raise ValueError
+        if not isinstance(last_id, int):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError('无效的游标')
+    return value, last_id
+
+
+def _after_cursor(sort_column, sort_order, value, last_id):
+    """
+    游标之后的记录，与 (sort_column IS NULL, sort_column, id) 的排序一致：
+    升序时 NULL 排在最后，降序时 NULL 排在最前
+    """
+    if sort_order == 'asc':
+        if value is None:
+            return and_(sort_column.is_(None), NotifyTask.id > last_id)
+        return or_(sort_column > value, and_(sort_column == value, NotifyTask.id > last_id), sort_column.is_(None))
+    if value is None:
+        return or_(and_(sort_column.is_(None), NotifyTask.id < last_id), sort_column.isnot(None))
+    return or_(sort_column < value, and_(sort_column == value, NotifyTask.id < last_id))
+
+
 @app.route('/api/tasks', methods=['GET'])
 @login_required
 def list_tasks():
@@ -335,6 +444,8 @@ def list_tasks():
     - page_size: 每页数量，默认 20
     - sort_by: 排序字段 (scheduled_time/id/status/created_at)，默认 scheduled_time
     - sort_order: 排序方向 (asc/desc)，默认 asc
+    - cursor: 游标分页，首页传空值，后续传上一页返回的 next_cursor（传入时忽略 page）
+    - with_total: 是否返回总数，默认 true；传 false 可省去计数查询
     """
     try:
         with get_db() as db:
@@ -366,14 +477,46 @@ def list_tasks():
             if sort_order not in ('asc', 'desc'):
                 return jsonify({'error': f'无效的排序方向: {sort_order}，可选 asc 或 desc'}), 400
 
-            sort_clause = sort_fields[sort_by].asc() if sort_order == 'asc' else sort_fields[sort_by].desc()
+            sort_column = sort_fields[sort_by]
+            nullable = NotifyTask.__table__.c[sort_by].nullable
+            # 可为空的字段按 (IS NULL, 字段, id) 排序，游标翻页能越过 NULL 记录
+            sort_clauses = [sort_column, NotifyTask.id]
+            if nullable:
+                sort_clauses.insert(0, sort_column.is_(None))
+            if sort_order == 'asc':
+                sort_clauses = [clause.asc() for clause in sort_clauses]
+            else:
+                sort_clauses = [clause.desc() for clause in sort_clauses]
 
             # 分页
-            page = int(request.args.get('page', 1))
-            page_size = int(request.args.get('page_size', 20))
+            page_size = max(int(request.args.get('page_size', 20)), 1)
+            with_total = request.args.get('with_total', 'true').lower() not in ('0', 'false', 'no')
+            total = query.count() if with_total else None
+
+            if 'cursor' in request.args:
+                # 游标分页：按 (排序字段, id) 定位，耗时与翻页深度无关
+                cursor = request.args.get('cursor')
+                if cursor:
+                    try:
+                        value, last_id = _decode_cursor(cursor, sort_by, sort_order, nullable)
+                    except ValueError as e:
+                        return jsonify({'error': str(e)}), 400
+                    if sort_by == 'id':
+                        query = query.filter(NotifyTask.id > last_id if sort_order == 'asc' else NotifyTask.id < last_id)
+                    else:
+                        query = query.filter(_after_cursor(sort_column, sort_order, value, last_id))
 
-            total = query.count()
-            tasks = query.order_by(sort_clause).offset((page - 1) * page_size).limit(page_size).all()
+                tasks = query.order_by(*sort_clauses).limit(page_size + 1).all()
+                next_cursor = _encode_cursor(sort_by, sort_order, tasks[page_size - 1]) if len(tasks) > page_size else None
+                return jsonify({
+                    'total': total,
+                    'page_size': page_size,
+                    'next_cursor': next_cursor,
+                    'tasks': [task.to_dict() for task in tasks[:page_size]]
+                })
+
+            page = int(request.args.get('page', 1))
+            tasks = query.order_by(*sort_clauses).offset((page - 1) * page_size).limit(page_size).all()
 
             return jsonify({
                 'total': total,
@@ -386,6 +529,73 @@ def list_tasks():
         return jsonify({'error': str(e)}), 500
 
 
+# 增量同步的回看时间（秒）：覆盖计算 updated_at 后稍晚提交的事务，前端按 ID 去重
+CHANGES_OVERLAP_SECONDS = 5
+
+
+@app.route('/api/tasks/changes', methods=['GET'])
+@login_required
+def list_task_changes():
+    """
+    获取任务增量变更（新增、修改与删除）
+
+    查询参数:
+    - since: 上次返回的 cursor；不传时返回全部任务，作为首次同步
+    - limit: 每次最多返回的任务数，默认 500；传 0 时只返回当前游标
+
+    返回的 has_more 为 true 时应立即用新的 cursor 继续拉取；reset 为 true 表示 cursor 已过期，需要重新全量加载
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 500)), 0), 2000)
+        started_at = datetime.now()
+        since_ts, since_id = None, 0
+        since = request.args.get('since')
+        if since:
+            try:
+                padded = since + '=' * (-len(since) % 4)
+                ts, since_id = json.loads(base64.urlsafe_b64decode(padded))
+                since_ts = datetime.fromisoformat(ts)
+            except Exception:
+                return jsonify({'error': '无效的游标'}), 400
+            if since_ts < started_at - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+                return jsonify({'reset': True, 'tasks': [], 'deleted': [], 'has_more': False, 'cursor': None})
+
+        with get_db() as db:
+            query = db.query(NotifyTask).filter(NotifyTask.user_id == request.current_user.id)
+            deleted = []
+            if since_ts is not None:
+                query = query.filter(or_(
+                    NotifyTask.updated_at > since_ts,
+                    and_(NotifyTask.updated_at == since_ts, NotifyTask.id > since_id)
+                ))
+                deleted = [row.task_id for row in db.query(TaskTombstone.task_id).filter(
+                    TaskTombstone.user_id == request.current_user.id,
+                    TaskTombstone.deleted_at >= since_ts
+                )]
+
+            tasks = query.order_by(NotifyTask.updated_at, NotifyTask.id).limit(limit + 1).all() if limit else []
+            has_more = len(tasks) > limit
+            tasks = tasks[:limit]
+
+            if has_more:
+                cursor_ts, cursor_id = tasks[-1].updated_at, tasks[-1].id
+            else:
+                # 已追上最新变更：游标回退一小段时间，下次同步重新检查可能晚提交的变更
+                cursor_ts, cursor_id = started_at - timedelta(seconds=CHANGES_OVERLAP_SECONDS), 0
+            payload = json.dumps([cursor_ts.isoformat(), cursor_id], separators=(',', ':'))
+
+            return jsonify({
+                'reset': False,
+                'tasks': [task.to_dict() for task in tasks],
+                'deleted': deleted,
+                'has_more': has_more,
+                'cursor': base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+            })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/tasks/<int:task_id>', methods=['GET'])
 @login_required
 def get_task(task_id):
@@ -418,13 +628,17 @@ def delete_task(task_id):
             if not task:
                 return jsonify({'error': '任务不存在'}), 404
 
-            # 从调度器移除
-            scheduler.remove_task(task_id, task.is_recurring)
+            is_recurring = task.is_recurring
 
-            # 彻底删除
+            # 彻底删除，并留下删除记录供增量同步
+            cancel_task_retries(db, task_id)
             db.delete(task)
+            db.add(TaskTombstone(task_id=task_id, user_id=task.user_id))
             db.commit()
 
+            # 从调度器移除（提交后再通知，主节点读取到的是最新状态）
+            scheduler.remove_task(task_id, is_recurring)
+
             return jsonify({'message': '任务已彻底删除'})
 
     except Exception as e:
@@ -454,6 +668,9 @@ def update_task(task_id):
             # 记录原始状态
             original_status = task.status
 
+            # 修改、暂停、取消或重新启用后，之前登记的重试不再发送（出错返回时随事务回滚）
+            cancel_task_retries(db, task_id)
+
             # 处理状态变更（暂停/恢复/取消）
             if 'status' in data:
                 try:
@@ -462,8 +679,8 @@ def update_task(task_id):
                     # 取消任务 (软删除)
                     if target_status_str == 'cancelled':
                         task.status = NotifyStatus.CANCELLED
-                        scheduler.remove_task(task_id, task.is_recurring)
                         db.commit()
+                        scheduler.remove_task(task_id, task.is_recurring)
                         return jsonify({
                             'message': '任务已取消',
                             'task': task.to_dict()
@@ -472,9 +689,9 @@ def update_task(task_id):
                     # 暂停任务
                     if target_status_str == 'paused':
                         task.status = NotifyStatus.PAUSED
+                        db.commit()
                         # 从调度器移除
                         scheduler.remove_task(task_id, task.is_recurring)
-                        db.commit()
                         return jsonify({
                             'message': '任务已暂停',
                             'task': task.to_dict()
@@ -493,8 +710,8 @@ def update_task(task_id):
                             except Exception as e:
                                 return jsonify({'error': f'计算下一次执行时间失败: {str(e)}'}), 400
                         
-                        scheduler.add_task(task)
                         db.commit()
+                        scheduler.add_task(task)
                         return jsonify({
                             'message': '任务已恢复',
                             'task': task.to_dict()
@@ -581,6 +798,129 @@ def update_task(task_id):
         return jsonify({'error': str(e)}), 500
 
 
+def _since_minutes(default=60):
+    """解析 minutes 查询参数（1 分钟至 30 天），返回统计起始时间"""
+    minutes = min(max(int(request.args.get('minutes', default)), 1), 30 * 24 * 60)
+    return datetime.now() - timedelta(minutes=minutes)
+
+
+@app.route('/api/tasks/<int:task_id>/deliveries', methods=['GET'])
+@login_required
+def list_task_deliveries(task_id):
+    """
+    获取任务的渠道投递历史（按时间倒序）
+
+    查询参数:
+    - limit: 每页数量，默认 50，最大 200
+    - before: 上一页返回的 next_before，不传时从最新记录开始
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        before = request.args.get('before', type=int)
+
+        with get_db() as db:
+            query = db.query(TaskDelivery).filter(
+                TaskDelivery.task_id == task_id,
+                TaskDelivery.user_id == request.current_user.id
+            )
+            if before:
+                query = query.filter(TaskDelivery.id < before)
+            deliveries = query.order_by(TaskDelivery.id.desc()).limit(limit + 1).all()
+            has_more = len(deliveries) > limit
+            deliveries = deliveries[:limit]
+
+            return jsonify({
+                'deliveries': [d.to_dict() for d in deliveries],
+                'next_before': deliveries[-1].id if has_more else None
+            })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/tasks/<int:task_id>/executions', methods=['GET'])
+@login_required
+def list_task_executions(task_id):
+    """
+    获取任务的执行历史（按时间倒序），包含计划时间、实际开始时间、调度延迟、耗时与结果
+
+    查询参数:
+    - limit: 每页数量，默认 50，最大 200
+    - before: 上一页返回的 next_before，不传时从最新记录开始
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        before = request.args.get('before', type=int)
+
+        with get_db() as db:
+            query = db.query(TaskExecution).filter(
+                TaskExecution.task_id == task_id,
+                TaskExecution.user_id == request.current_user.id
+            )
+            if before:
+                query = query.filter(TaskExecution.id < before)
+            executions = query.order_by(TaskExecution.id.desc()).limit(limit + 1).all()
+            has_more = len(executions) > limit
+            executions = executions[:limit]
+
+            return jsonify({
+                'executions': [e.to_dict() for e in executions],
+                'next_before': executions[-1].id if has_more else None
+            })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/deliveries/stats', methods=['GET'])
+@login_required
+def delivery_stats():
+    """
+    统计当前用户最近一段时间内各渠道的投递成功与失败次数
+
+    查询参数:
+    - minutes: 统计最近多少分钟，默认 60
+    """
+    try:
+        since = _since_minutes()
+        with get_db() as db:
+            rows = db.query(TaskDelivery.channel, TaskDelivery.status, func.count()).filter(
+                TaskDelivery.user_id == request.current_user.id,
+                TaskDelivery.created_at >= since
+            ).group_by(TaskDelivery.channel, TaskDelivery.status).all()
+
+        channels = {}
+        for channel, status, count in rows:
+            channels.setdefault(channel, {'sent': 0, 'failed': 0})[status] = count
+        return jsonify({'since': since.isoformat(), 'channels': channels})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/deliveries/failures', methods=['GET'])
+@admin_required
+def delivery_failures():
+    """
+    统计全部用户最近一段时间内各渠道的投递失败次数（管理员）
+
+    查询参数:
+    - minutes: 统计最近多少分钟，默认 60
+    """
+    try:
+        since = _since_minutes()
+        with get_db() as db:
+            rows = db.query(TaskDelivery.channel, func.count()).filter(
+                TaskDelivery.status == 'failed',
+                TaskDelivery.created_at >= since
+            ).group_by(TaskDelivery.channel).all()
+
+        return jsonify({'since': since.isoformat(), 'failures': {channel: count for channel, count in rows}})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/scheduler/jobs', methods=['GET'])
 def get_scheduled_jobs():
     """获取调度器中的所有任务"""
@@ -826,7 +1166,8 @@ def test_notification():
                 channel=channel,
                 config=config,
                 title=title,
-                content=content
+                content=content,
+                timeout=TEST_NOTIFICATION_TIMEOUT
             )
 
             return jsonify({
@@ -849,10 +1190,46 @@ def health_check():
     """健康检查"""
     return jsonify({
         'status': 'ok',
-        'scheduler_running': scheduler.scheduler.running
+        'scheduler_role': SCHEDULER_ROLE,
+        'scheduler_running': scheduler.scheduler.running,
+        'scheduler_leader': scheduler.is_leader,
+        'delivery_queue': delivery_engine.queue_stats()
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 指标（文本格式，每个进程分别统计，需设置 METRICS_TOKEN 开启）"""
+    if not METRICS_TOKEN:
+        return jsonify({'error': '指标接口未启用（未设置 METRICS_TOKEN）'}), 404
+    if not secrets.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'
+    ):
+        return jsonify({'error': '无效的指标访问令牌'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/admin/traces', methods=['GET'])
+@admin_required
+def list_traces():
+    """
+    查看本进程最近的耗时追踪（需设置 TRACE_SAMPLE_RATE 开启）
+
+    查询参数:
+    - limit: 返回条数，默认 50
+    - name: 只返回指定名称的追踪，如 execute_task、sync_calendar、GET /api/tasks
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), tracing.TRACE_BUFFER_SIZE)
+        return jsonify({
+            'enabled': tracing.ENABLED,
+            'sample_rate': tracing.TRACE_SAMPLE_RATE,
+            'traces': tracing.recent(limit, request.args.get('name'))
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/events')
 def sse_events():
     """服务器发送事件 (SSE) 端点"""
@@ -873,10 +1250,17 @@ def sse_events():
         messages = event_manager.listen(user_id)
         try:
             while True:
-                msg = messages.get()
+                # 事件由调度主节点写入数据库，这里定期拉取并分发
+                event_manager.poll()
+                try:
+                    msg = messages.get(timeout=EVENT_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
                 yield f"data: {json.dumps(msg, ensure_ascii=False)}\n\n"
         except GeneratorExit:
             pass
+        finally:
+            event_manager.unlisten(messages)
 
     return Response(stream(), mimetype='text/event-stream')
 
@@ -895,6 +1279,7 @@ def manage_calendar_token():
                 # 生成新Token
                 user.calendar_token = secrets.token_urlsafe(32)
                 db.commit()
+                invalidate_user(user.id)
             
             # 智能检测协议，解决反向代理下的 Mixed Content 问题导致浏览器提示"无法安全下载"
             scheme = request.headers.get('X-Forwarded-Proto', request.scheme)
@@ -1012,13 +1397,7 @@ def add_external_calendar():
             db.commit()
             
             # 立即触发一次同步
-            from scheduler import sync_single_calendar
-            scheduler.scheduler.add_job(
-                sync_single_calendar, 
-                args=[cal.id], 
-                id=f"sync_cal_{cal.id}_init",
-                misfire_grace_time=300
-            )
+            scheduler.request_calendar_sync(cal.id)
             
             return jsonify({'message': '日历添加成功，正在后台同步', 'calendar': cal.to_dict()})
     except Exception as e:
@@ -1059,14 +1438,8 @@ def sync_external_calendar_endpoint(cal_id):
             if not cal:
                 return jsonify({'error': '日历不存在'}), 404
         
-        from scheduler import sync_single_calendar
         # 异步执行
-        scheduler.scheduler.add_job(
-            sync_single_calendar, 
-            args=[cal_id], 
-            id=f"sync_cal_{cal_id}_manual_{uuid.uuid4().hex[:8]}",
-            misfire_grace_time=300
-        )
+        scheduler.request_calendar_sync(cal_id)
         return jsonify({'message': '同步任务已提交'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1150,118 +1523,127 @@ def check_version_update():
         return jsonify({'error': str(e)}), 500
 
 
+# 流式导出：每批从数据库读取的行数，以及累计到多少字节后向客户端输出一次
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _encrypt_config_json(raw, secret_key, multi=False):
+    """加密 JSON 格式的渠道配置（多渠道为 {渠道: 配置}），无法解析时原样返回"""
+    if not raw:
+        return raw
+    try:
+        config = json.loads(raw)
+        if multi:
+            return json.dumps(dict(zip(config, encrypt_sensitive_fields_batch(config.values(), secret_key))))
+        return json.dumps(encrypt_sensitive_fields(config, secret_key))
+    except Exception:
+        return raw
+
+
+def _export_records(user_id, secret_key):
+    """逐条生成导出文件的 JSON 片段，数据库按批读取，内存占用与数据量无关"""
+    yield '{"version": "1.0", "export_date": %s, "tasks": [' % json.dumps(datetime.now().isoformat())
+
+    with get_db() as db:
+        # 只读取需要的列，yield_per 分批获取（PostgreSQL 使用服务端游标）
+        rows = db.query(
+            NotifyTask.title, NotifyTask.content, NotifyTask.channel, NotifyTask.scheduled_time,
+            NotifyTask.channel_config, NotifyTask.channels_json, NotifyTask.channels_config_json,
+            NotifyTask.status, NotifyTask.is_recurring, NotifyTask.cron_expression,
+            NotifyTask.created_at, NotifyTask.updated_at
+        ).filter(NotifyTask.user_id == user_id).order_by(NotifyTask.id).yield_per(EXPORT_BATCH_SIZE)
+        for i, task in enumerate(rows):
+            yield (',' if i else '') + json.dumps({
+                'title': task.title,
+                'content': task.content,
+                'channel': task.channel.value if task.channel else None,
+                'scheduled_time': task.scheduled_time.isoformat() if task.scheduled_time else None,
+                'channel_config': _encrypt_config_json(task.channel_config, secret_key),
+                'channels': task.channels_json,
+                'channel_configs': _encrypt_config_json(task.channels_config_json, secret_key, multi=True),
+                'status': task.status.value,
+                'is_recurring': task.is_recurring,
+                'cron_expression': task.cron_expression,
+                'created_at': task.created_at.isoformat() if task.created_at else None,
+                'updated_at': task.updated_at.isoformat() if task.updated_at else None,
+            }, ensure_ascii=False)
+
+        yield '], "user_channels": ['
+        channel_names = {}
+        channels = db.query(UserChannel).filter(UserChannel.user_id == user_id).order_by(UserChannel.id)
+        for i, channel in enumerate(channels.yield_per(EXPORT_BATCH_SIZE)):
+            channel_names[channel.id] = channel.channel_name
+            yield (',' if i else '') + json.dumps({
+                'channel_name': channel.channel_name,
+                'channel_type': channel.channel_type.value,
+                'channel_config': _encrypt_config_json(channel.channel_config, secret_key),
+                'is_default': channel.is_default,
+                'created_at': channel.created_at.isoformat() if channel.created_at else None,
+            }, ensure_ascii=False)
+
+        yield '], "external_calendars": ['
+        calendars = db.query(ExternalCalendar).filter(ExternalCalendar.user_id == user_id).order_by(ExternalCalendar.id)
+        for i, calendar in enumerate(calendars.yield_per(EXPORT_BATCH_SIZE)):
+            calendar_dict = {
+                'name': calendar.name,
+                'url': calendar.url,
+                'is_active': calendar.is_active,
+                'default_channel_id': None,  # 不导出内部 ID
+            }
+            # 通过通道名称关联默认通道
+            if calendar.channel_id in channel_names:
+                calendar_dict['default_channel_name'] = channel_names[calendar.channel_id]
+            yield (',' if i else '') + json.dumps(calendar_dict, ensure_ascii=False)
+
+    yield ']}'
+
+
+def _export_stream(user_id, secret_key, compress=False):
+    """合并小片段后输出，可选 gzip 压缩"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer, size = [], 0
+    try:
+        for part in _export_records(user_id, secret_key):
+            data = part.encode('utf-8')
+            if compressor:
+                data = compressor.compress(data)
+            buffer.append(data)
+            size += len(data)
+            if size >= EXPORT_CHUNK_BYTES:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+        if compressor:
+            buffer.append(compressor.flush())
+        yield b''.join(buffer)
+    except Exception as e:
+        # 响应头已发送，只能中断输出（导入时会因 JSON 不完整而失败）
+        import traceback
+        app.logger.error(f'Export failed: {str(e)}\n{traceback.format_exc()}')
+        raise
+
+
 @app.route('/api/export', methods=['GET'])
 @login_required
 def export_data():
     """
-    导出用户数据为 JSON 格式
-    Export user data as JSON with encrypted sensitive fields
+    导出用户数据为 JSON 格式（流式输出）
+    Export user data as streamed JSON with encrypted sensitive fields
+
+    查询参数:
+    - gzip: 为 1 且客户端支持时以 gzip 压缩传输（Content-Encoding: gzip）
     """
     try:
-        current_user = request.current_user
-        secret_key = app.config['SECRET_KEY']
-        
-        with get_db() as db:
-            # 导出任务
-            tasks = db.query(NotifyTask).filter_by(user_id=current_user.id).all()
-            tasks_data = []
-            for task in tasks:
-                task_dict = {
-                    'title': task.title,
-                    'content': task.content,
-                    'channel': task.channel.value if task.channel else None,
-                    'scheduled_time': task.scheduled_time.isoformat() if task.scheduled_time else None,
-                    'channel_config': task.channel_config,
-                    'channels': task.channels_json,
-                    'channel_configs': task.channels_config_json,
-                    'status': task.status.value,
-                    'is_recurring': task.is_recurring,
-                    'cron_expression': task.cron_expression,
-                    'created_at': task.created_at.isoformat() if task.created_at else None,
-                    'updated_at': task.updated_at.isoformat() if task.updated_at else None,
-                }
-                
-                # 加密单通道配置
-                if task_dict['channel_config']:
-                    try:
-                        config_dict = json.loads(task_dict['channel_config'])
-                        encrypted_config = encrypt_sensitive_fields(config_dict, secret_key)
-                        task_dict['channel_config'] = json.dumps(encrypted_config)
-                    except:
-                        pass
-                
-                # 加密多通道配置
-                if task_dict['channel_configs']:
-                    try:
-                        configs_dict = json.loads(task_dict['channel_configs'])
-                        encrypted_configs = {}
-                        for channel, config in configs_dict.items():
-                            encrypted_configs[channel] = encrypt_sensitive_fields(config, secret_key)
-                        task_dict['channel_configs'] = json.dumps(encrypted_configs)
-                    except:
-                        pass
-                
-                tasks_data.append(task_dict)
-            
-            # 导出通道配置
-            user_channels = db.query(UserChannel).filter_by(user_id=current_user.id).all()
-            channels_data = []
-            for channel in user_channels:
-                channel_dict = {
-                    'channel_name': channel.channel_name,
-                    'channel_type': channel.channel_type.value,
-                    'channel_config': channel.channel_config,
-                    'is_default': channel.is_default,
-                    'created_at': channel.created_at.isoformat() if channel.created_at else None,
-                }
-                
-                # 加密通道配置
-                if channel_dict['channel_config']:
-                    try:
-                        config_dict = json.loads(channel_dict['channel_config'])
-                        encrypted_config = encrypt_sensitive_fields(config_dict, secret_key)
-                        channel_dict['channel_config'] = json.dumps(encrypted_config)
-                    except:
-                        pass
-                
-                channels_data.append(channel_dict)
-            
-            # 导出外部日历
-            external_calendars = db.query(ExternalCalendar).filter_by(user_id=current_user.id).all()
-            calendars_data = []
-            for calendar in external_calendars:
-                calendar_dict = {
-                    'name': calendar.name,
-                    'url': calendar.url,
-                    'is_active': calendar.is_active,
-                    'default_channel_id': None,  # 不导出内部 ID
-                }
-                
-                # 如果有默认通道，尝试找到对应的通道名称
-                if calendar.default_channel_id:
-                    default_channel = db.query(UserChannel).filter_by(
-                        id=calendar.default_channel_id,
-                        user_id=current_user.id
-                    ).first()
-                    if default_channel:
-                        calendar_dict['default_channel_name'] = default_channel.channel_name
-                
-                calendars_data.append(calendar_dict)
-        
-        # 构建导出数据（在 with 块外，使用已收集的数据）
-        export_payload = {
-            'version': '1.0',
-            'export_date': datetime.now().isoformat(),
-            'tasks': tasks_data,
-            'user_channels': channels_data,
-            'external_calendars': calendars_data,
-        }
-        
+        compress = request.args.get('gzip') in ('1', 'true') and 'gzip' in request.headers.get('Accept-Encoding', '')
+        stream = _export_stream(request.current_user.id, app.config['SECRET_KEY'], compress)
+
         # 设置响应头，触发下载
         filename = f'notify-scheduler-export-{datetime.now().strftime("%Y%m%d-%H%M%S")}.json'
-        response = make_response(jsonify(export_payload))
+        response = Response(stream_with_context(stream), mimetype='application/json')
         response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-        response.headers['Content-Type'] = 'application/json'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
         
         return response
         
@@ -1272,12 +1654,116 @@ def export_data():
         return jsonify({'error': f'导出失败: {str(e)}'}), 500
 
 
+# 批量导入：每批插入（executemany）的行数
+IMPORT_BATCH_SIZE = 1000
+# 导入结果中最多返回的无效记录数
+IMPORT_MAX_ERRORS = 100
+
+
+def _decrypt_config_json(raw, secret_key, multi=False):
+    """
+    解密 JSON 格式的渠道配置（多渠道为 {渠道: 配置}），无法解析时原样返回
+
+    手工编辑的导入文件中配置可能直接写成 JSON 对象，同样解密后按 JSON 字符串返回
+    """
+    if not raw:
+        return raw
+    try:
+        config = json.loads(raw) if isinstance(raw, str) else raw
+        if multi:
+            return json.dumps(dict(zip(config, decrypt_sensitive_fields_batch(config.values(), secret_key))))
+        return json.dumps(decrypt_sensitive_fields(config, secret_key))
+    except Exception:
+        return raw if isinstance(raw, str) else json.dumps(raw)
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _import_task_row(task_data, user_id, secret_key):
+    """将导入文件中的一条任务转换为插入行，数据无效时抛出 ValueError"""
+    title = task_data.get('title')
+    if not title or not isinstance(title, str):
+        raise ValueError('缺少任务标题')
+    if not task_data.get('channel') and not task_data.get('channels'):
+        raise ValueError('缺少通知渠道')
+
+    is_recurring = bool(task_data.get('is_recurring'))
+    cron_expression = task_data.get('cron_expression')
+    scheduled_time = _parse_datetime(task_data.get('scheduled_time'))
+    if is_recurring:
+        if not cron_expression:
+            raise ValueError('重复任务必须提供 cron_expression')
+        try:
+            trigger = get_cron_trigger(cron_expression)
+        except Exception as e:
+            raise ValueError(f'Cron 表达式无效: {e}')
+        if scheduled_time is None:
+            # 与创建任务一致，由 cron 计算下一次执行时间
+            scheduled_time = trigger.get_next_fire_time(None, datetime.now())
+            if not scheduled_time:
+                raise ValueError('无法根据 cron_expression 计算下一次执行时间')
+    elif scheduled_time is None:
+        raise ValueError('缺少计划时间或时间格式错误')
+
+    try:
+        channel = NotifyChannel(task_data['channel']) if task_data.get('channel') else None
+        status = NotifyStatus(task_data.get('status', 'pending'))
+    except ValueError as e:
+        raise ValueError(f'渠道或状态无效: {e}')
+
+    return dict(
+        user_id=user_id,
+        title=title,
+        content=task_data.get('content', ''),
+        channel=channel,
+        scheduled_time=scheduled_time,
+        channel_config=_decrypt_config_json(task_data.get('channel_config'), secret_key),
+        channels_json=task_data.get('channels'),
+        channels_config_json=_decrypt_config_json(task_data.get('channel_configs'), secret_key, multi=True),
+        status=status,
+        is_recurring=is_recurring,
+        cron_expression=cron_expression,
+    )
+
+
+def _bulk_insert(db, model, rows, *returning):
+    """
+    按批插入多行（每批一条 executemany 语句，不创建 ORM 对象）
+
+    指定 returning 列时返回插入行的这些列（顺序与 rows 无关）
+    """
+    # None 也按 NULL 写入，各行的列集合一致时才能合并为一条语句
+    statement = insert(model).execution_options(render_nulls=True)
+    if returning:
+        statement = statement.returning(*returning)
+    result = []
+    for i in range(0, len(rows), IMPORT_BATCH_SIZE):
+        chunk = rows[i:i + IMPORT_BATCH_SIZE]
+        if returning:
+            result.extend(db.execute(statement, chunk).all())
+        else:
+            db.execute(statement, chunk)
+    return result
+
+
 @app.route('/api/import', methods=['POST'])
 @login_required
 def import_data():
     """
     导入用户数据（合并模式 - 跳过重复）
     Import user data with merge mode (skip duplicates)
+
+    已有数据的去重键每类只查询一次，新数据按批插入，整个导入在一个事务中提交，
+    提交后再一次性把待发送的任务交给调度器。
+
+    缺少必填字段或字段无效的记录在插入前跳过，计入 *_invalid，errors 中返回前 IMPORT_MAX_ERRORS 条的原因。
     """
     try:
         current_user = request.current_user
@@ -1290,6 +1776,7 @@ def import_data():
             return jsonify({'error': '不支持的数据版本'}), 400
         
         secret_key = app.config['SECRET_KEY']
+        user_id = current_user.id
         
         stats = {
             'tasks_imported': 0,
@@ -1298,160 +1785,120 @@ def import_data():
             'channels_skipped': 0,
             'calendars_imported': 0,
             'calendars_skipped': 0,
+            'tasks_invalid': 0,
+            'channels_invalid': 0,
+            'calendars_invalid': 0,
         }
+        errors = []
+
+        def reject(kind, index, reason):
+            stats[f'{kind}_invalid'] += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({'type': kind, 'index': index, 'error': reason})
         
         with get_db() as db:
-            # 导入通道配置（先导入，因为任务可能依赖它们）
-            if 'user_channels' in data:
-                for channel_data in data['user_channels']:
-                    # 检查是否已存在同名通道
-                    existing = db.query(UserChannel).filter_by(
-                        user_id=current_user.id,
-                        channel_name=channel_data['channel_name']
-                    ).first()
-                    
-                    if existing:
-                        stats['channels_skipped'] += 1
-                        continue
-                    
-                    # 解密配置
-                    channel_config = channel_data.get('channel_config')
-                    if channel_config:
-                        try:
-                            config_dict = json.loads(channel_config)
-                            decrypted_config = decrypt_sensitive_fields(config_dict, secret_key)
-                            channel_config = json.dumps(decrypted_config)
-                        except:
-                            pass
-                    
-                    # 创建新通道
-                    new_channel = UserChannel(
-                        user_id=current_user.id,
-                        channel_name=channel_data['channel_name'],
-                        channel_type=NotifyChannel(channel_data['channel_type']),
-                        channel_config=channel_config,
-                        is_default=channel_data.get('is_default', False),
-                    )
-                    db.add(new_channel)
-                    stats['channels_imported'] += 1
-            
-            db.commit()
+            # 导入通道配置（先导入，因为日历的默认通道依赖它们）
+            channel_names = {
+                name for name, in db.query(UserChannel.channel_name).filter(UserChannel.user_id == user_id)
+            }
+            new_channels = []
+            for index, channel_data in enumerate(data.get('user_channels') or []):
+                if not channel_data.get('channel_name'):
+                    reject('channels', index, '缺少通道名称')
+                    continue
+                try:
+                    channel_type = NotifyChannel(channel_data.get('channel_type'))
+                except ValueError:
+                    reject('channels', index, f"不支持的渠道类型: {channel_data.get('channel_type')}")
+                    continue
+                # 跳过已存在（或导入文件中重复）的同名通道
+                if channel_data['channel_name'] in channel_names:
+                    stats['channels_skipped'] += 1
+                    continue
+                channel_names.add(channel_data['channel_name'])
+                new_channels.append(dict(
+                    user_id=user_id,
+                    channel_name=channel_data['channel_name'],
+                    channel_type=channel_type,
+                    channel_config=_decrypt_config_json(channel_data.get('channel_config'), secret_key),
+                    is_default=channel_data.get('is_default', False),
+                ))
+            _bulk_insert(db, UserChannel, new_channels)
+            stats['channels_imported'] = len(new_channels)
             
-            # 导入任务
-            if 'tasks' in data:
-                for task_data in data['tasks']:
-                    # 检查重复：相同标题和计划时间
-                    scheduled_time = None
-                    if task_data.get('scheduled_time'):
-                        try:
-                            scheduled_time = datetime.fromisoformat(task_data['scheduled_time'])
-                        except:
-                            pass
-                    
-                    # 对于定时任务，检查标题+时间；对于周期任务，只检查标题+cron
-                    if task_data.get('is_recurring'):
-                        existing = db.query(NotifyTask).filter_by(
-                            user_id=current_user.id,
-                            title=task_data['title'],
-                            cron_expression=task_data.get('cron_expression')
-                        ).first()
-                    else:
-                        existing = db.query(NotifyTask).filter_by(
-                            user_id=current_user.id,
-                            title=task_data['title'],
-                            scheduled_time=scheduled_time
-                        ).first()
-                    
-                    if existing:
-                        stats['tasks_skipped'] += 1
-                        continue
-                    
-                    # 解密通道配置
-                    channel_config = task_data.get('channel_config')
-                    if channel_config:
-                        try:
-                            config_dict = json.loads(channel_config)
-                            decrypted_config = decrypt_sensitive_fields(config_dict, secret_key)
-                            channel_config = json.dumps(decrypted_config)
-                        except:
-                            pass
-                    
-                    # 解密多通道配置
-                    channel_configs = task_data.get('channel_configs')
-                    if channel_configs:
-                        try:
-                            configs_dict = json.loads(channel_configs)
-                            decrypted_configs = {}
-                            for channel, config in configs_dict.items():
-                                decrypted_configs[channel] = decrypt_sensitive_fields(config, secret_key)
-                            channel_configs = json.dumps(decrypted_configs)
-                        except:
-                            pass
-                    
-                    # 创建新任务
-                    new_task = NotifyTask(
-                        user_id=current_user.id,
-                        title=task_data['title'],
-                        content=task_data.get('content', ''),
-                        channel=NotifyChannel(task_data['channel']) if task_data.get('channel') else None,
-                        scheduled_time=scheduled_time,
-                        channel_config=channel_config,
-                        channels_json=task_data.get('channels'),
-                        channels_config_json=channel_configs,
-                        status=NotifyStatus(task_data.get('status', 'pending')),
-                        is_recurring=task_data.get('is_recurring', False),
-                        cron_expression=task_data.get('cron_expression'),
-                    )
-                    db.add(new_task)
-                    stats['tasks_imported'] += 1
-                    
-                    # 如果是待发送的任务，加入调度器
-                    if new_task.status == NotifyStatus.PENDING:
-                        db.commit()  # 先提交获取 ID
-                        db.refresh(new_task)  # 刷新对象获取最新数据
-                        scheduler.add_task(new_task)
+            # 导入任务：周期任务按 标题+cron 去重，定时任务按 标题+计划时间 去重
+            cron_keys = set()
+            time_keys = set()
+            for title, cron_expression, scheduled_time in db.query(
+                NotifyTask.title, NotifyTask.cron_expression, NotifyTask.scheduled_time
+            ).filter(NotifyTask.user_id == user_id):
+                cron_keys.add((title, cron_expression))
+                time_keys.add((title, scheduled_time))
             
-            db.commit()
+            new_tasks = []
+            for index, task_data in enumerate(data.get('tasks') or []):
+                try:
+                    row = _import_task_row(task_data, user_id, secret_key)
+                except ValueError as e:
+                    reject('tasks', index, str(e))
+                    continue
+                if row['is_recurring']:
+                    key, keys = (row['title'], row['cron_expression']), cron_keys
+                else:
+                    key, keys = (row['title'], row['scheduled_time']), time_keys
+                if key in keys:
+                    stats['tasks_skipped'] += 1
+                    continue
+                keys.add(key)
+                new_tasks.append(row)
+            # 插入时取回调度需要的列，待发送的任务在提交后加入调度器
+            inserted = _bulk_insert(
+                db, NotifyTask, new_tasks,
+                NotifyTask.id, NotifyTask.status, NotifyTask.is_recurring, NotifyTask.cron_expression,
+                NotifyTask.scheduled_time
+            )
+            pending_tasks = [task for task in inserted if task.status == NotifyStatus.PENDING]
+            stats['tasks_imported'] = len(new_tasks)
             
             # 导入外部日历
-            if 'external_calendars' in data:
-                for calendar_data in data['external_calendars']:
-                    # 检查是否已存在同名日历
-                    existing = db.query(ExternalCalendar).filter_by(
-                        user_id=current_user.id,
-                        name=calendar_data['name']
-                    ).first()
-                    
-                    if existing:
+            calendars = data.get('external_calendars') or []
+            if calendars:
+                calendar_names = {
+                    name for name, in db.query(ExternalCalendar.name).filter(ExternalCalendar.user_id == user_id)
+                }
+                channel_ids = dict(
+                    db.query(UserChannel.channel_name, UserChannel.id).filter(UserChannel.user_id == user_id)
+                )
+                new_calendars = []
+                for index, calendar_data in enumerate(calendars):
+                    if not calendar_data.get('name') or not calendar_data.get('url'):
+                        reject('calendars', index, '缺少日历名称或 ICS 链接')
+                        continue
+                    # 跳过已存在（或导入文件中重复）的同名日历
+                    if calendar_data['name'] in calendar_names:
                         stats['calendars_skipped'] += 1
                         continue
-                    
-                    # 查找默认通道
-                    default_channel_id = None
-                    if calendar_data.get('default_channel_name'):
-                        default_channel = db.query(UserChannel).filter_by(
-                            user_id=current_user.id,
-                            channel_name=calendar_data['default_channel_name']
-                        ).first()
-                        if default_channel:
-                            default_channel_id = default_channel.id
-                    
-                    # 创建新日历
-                    new_calendar = ExternalCalendar(
-                        user_id=current_user.id,
+                    calendar_names.add(calendar_data['name'])
+                    new_calendars.append(dict(
+                        user_id=user_id,
                         name=calendar_data['name'],
                         url=calendar_data['url'],
-                        default_channel_id=default_channel_id,
+                        channel_id=channel_ids.get(calendar_data.get('default_channel_name')),
                         is_active=calendar_data.get('is_active', True),
-                    )
-                    db.add(new_calendar)
-                    stats['calendars_imported'] += 1
+                    ))
+                _bulk_insert(db, ExternalCalendar, new_calendars)
+                stats['calendars_imported'] = len(new_calendars)
             
             db.commit()
         
+        # 提交成功后再注册调度任务，导入失败回滚时不会留下指向不存在任务的作业
+        if pending_tasks:
+            scheduler.add_tasks(pending_tasks)
+        
         return jsonify({
             'message': '导入成功',
-            'stats': stats
+            'stats': stats,
+            'errors': errors
         }), 200
         
     except Exception as e:
@@ -4,33 +4,163 @@
 """
 
 import functools
+import os
+import threading
+import time
 import jwt
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime, timedelta
 from flask import request, jsonify, current_app
-from models import get_db, User
+from models import get_db, User, hash_password, password_needs_rehash, verify_password
 
 
-def generate_token(user_id, expires_in=24*60*60):
-    """生成JWT token"""
+# 已登录用户缓存：有效期（秒，0 表示不缓存）与最大条目数
+# 多进程部署时各进程分别缓存，其他进程中的资料修改最多延迟一个有效期生效
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+# 无状态模式：直接信任 token 中的用户声明，不查询数据库（禁用或降权的用户在 token 过期前仍可访问）
+AUTH_STATELESS = os.getenv('AUTH_STATELESS', 'false').lower() in ('1', 'true', 'yes')
+# 密码哈希线程池：并发计算数、排队上限与等待超时（秒），超出时拒绝请求，避免登录高峰占满 Web worker
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '16'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '5'))
+
+
+class PasswordHashBusy(Exception):
+    """密码哈希线程池已满或等待超时"""
+
+
+# pbkdf2_hmac 计算期间释放 GIL，线程池中的计算不阻塞其他请求线程
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password')
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+def run_password_hash(fn, *args):
+    """在密码哈希线程池中执行 fn，线程池已满或等待超时时抛出 PasswordHashBusy"""
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordHashBusy('登录请求过多，请稍后重试')
+    try:
+        future = _password_pool.submit(fn, *args)
+    except Exception:
+        _password_slots.release()
+        raise
+    # 计算完成后才释放名额，等待超时的计算仍占用名额
+    future.add_done_callback(lambda _: _password_slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FuturesTimeoutError:
+        future.cancel()
+        raise PasswordHashBusy('登录请求过多，请稍后重试')
+
+
+class UserPrincipal:
+    """已认证用户的只读快照（request.current_user），属性与 User.to_dict() 的字段一致"""
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getattr__(self, name):
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _UserCache:
+    """按用户 ID 缓存 UserPrincipal 的 LRU，条目超过有效期后重新查询"""
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return item[1]
+
+    def set(self, user_id, principal):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._items[user_id] = (time.monotonic() + self.ttl, principal)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(user_id, None)
+
+
+_user_cache = _UserCache(USER_CACHE_TTL, USER_CACHE_SIZE)
+
+
+def invalidate_user(user_id=None):
+    """用户资料、密码或启用状态变化后清除缓存（不传 user_id 时清空全部）"""
+    _user_cache.invalidate(user_id)
+
+
+def generate_token(user_id, expires_in=24*60*60, user=None):
+    """生成JWT token（传入 user 时附带无状态模式使用的用户声明）"""
     payload = {
         'user_id': user_id,
         'exp': datetime.utcnow() + timedelta(seconds=expires_in),
         'iat': datetime.utcnow()
     }
+    if user is not None:
+        payload['username'] = user.username
+        payload['is_admin'] = bool(user.is_admin)
     return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
 
 
-def verify_token(token):
-    """验证JWT token"""
+def decode_token(token):
+    """验证JWT token，返回载荷（无效或过期时返回 None）"""
     try:
-        payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-        return payload['user_id']
+        return jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
 
+def verify_token(token):
+    """验证JWT token"""
+    payload = decode_token(token)
+    return payload['user_id'] if payload else None
+
+
+def load_user(user_id):
+    """获取启用中的用户（优先读取缓存），不存在或已禁用时返回 None"""
+    principal = _user_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    with get_db() as db:
+        user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
+        if not user:
+            return None
+        principal = UserPrincipal(user.to_dict())
+    _user_cache.set(user_id, principal)
+    return principal
+
+
 def get_current_user():
     """获取当前登录用户"""
     token = request.headers.get('Authorization')
@@ -41,13 +171,19 @@ def get_current_user():
     if token.startswith('Bearer '):
         token = token[7:]
 
-    user_id = verify_token(token)
-    if not user_id:
+    payload = decode_token(token)
+    if not payload or not payload.get('user_id'):
         return None
 
-    with get_db() as db:
-        user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
-        return user
+    if AUTH_STATELESS and 'username' in payload:
+        return UserPrincipal({
+            'id': payload['user_id'],
+            'username': payload['username'],
+            'is_active': True,
+            'is_admin': payload.get('is_admin', False)
+        })
+
+    return load_user(payload['user_id'])
 
 
 def login_required(f):
@@ -78,22 +214,36 @@ def admin_required(f):
 
 
 def user_login(username, password):
-    """用户登录"""
+    """用户登录（密码校验在密码哈希线程池中执行，繁忙时抛出 PasswordHashBusy）"""
     with get_db() as db:
         user = db.query(User).filter(
             (User.username == username) | (User.email == username),
             User.is_active == True
         ).first()
+        if not user:
+            return None, '用户名或密码错误'
+        user_id, stored_hash, legacy_salt = user.id, user.password_hash, user.salt
 
-        if not user or not user.check_password(password):
+    # 校验期间不占用数据库连接
+    if not run_password_hash(verify_password, password, stored_hash, legacy_salt):
+        return None, '用户名或密码错误'
+    # 旧格式或迭代次数已调整的哈希按当前参数重新生成
+    new_hash = run_password_hash(hash_password, password) if password_needs_rehash(stored_hash) else None
+
+    with get_db() as db:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
             return None, '用户名或密码错误'
+        if new_hash and user.password_hash == stored_hash:
+            user.set_password_hash(new_hash)
 
         # 更新最后登录时间
         user.last_login = datetime.now()
         db.commit()
+        invalidate_user(user.id)
 
         # 生成token
-        token = generate_token(user.id)
+        token = generate_token(user.id, user=user)
 
         return {
             'token': token,
@@ -103,6 +253,9 @@ def user_login(username, password):
 
 def user_register(username, email, password):
     """用户注册"""
+    # 先计算密码哈希，计算期间不占用数据库连接
+    password_hash = run_password_hash(hash_password, password)
+
     with get_db() as db:
         # 检查用户名是否已存在
         if db.query(User).filter(User.username == username).first():
@@ -117,7 +270,7 @@ def user_register(username, email, password):
             username=username,
             email=email
         )
-        user.set_password(password)
+        user.set_password_hash(password_hash)
 
         db.add(user)
         db.commit()
@@ -130,6 +283,9 @@ def user_register(username, email, password):
 
 def update_user_profile(user_id, data):
     """更新用户资料"""
+    # 先计算新密码的哈希，计算期间不占用数据库连接
+    password_hash = run_password_hash(hash_password, data['password']) if 'password' in data else None
+
     with get_db() as db:
         user = db.query(User).filter(User.id == user_id).first()
         if not user:
@@ -146,10 +302,11 @@ def update_user_profile(user_id, data):
                 return None, '邮箱已被使用'
             user.email = data['email']
 
-        if 'password' in data:
-            user.set_password(data['password'])
+        if password_hash:
+            user.set_password_hash(password_hash)
 
         db.commit()
+        invalidate_user(user_id)
 
         return {
             'user': user.to_dict()
@@ -0,0 +1,705 @@
+"""
+异步通知发送引擎
+所有渠道共用一个长连接复用的 HTTP 客户端（httpx.AsyncClient），在后台事件循环线程中发送，
+并按目标主机限制并发连接数
+
+新增渠道：继承 ChannelAdapter 并用 @register_adapter 注册，各渠道的请求格式与 ANotify 保持一致
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.header import Header
+from urllib.parse import urlsplit
+
+import httpx
+import tracing
+from models import NotifyChannel
+
+
+# 连接池总连接数、每个主机的最大并发连接数
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_PER_HOST = int(os.getenv('HTTP_MAX_PER_HOST', '10'))
+# 单次 HTTP 请求超时（秒）
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '10'))
+# 渠道适配器实例缓存数量，以及 access_token 提前刷新的秒数
+ADAPTER_CACHE_SIZE = int(os.getenv('ADAPTER_CACHE_SIZE', '256'))
+# 限流令牌桶与主机并发限制的缓存数量（按 webhook 地址、主机创建），超出时淘汰最久未使用的空闲条目
+LIMITER_CACHE_SIZE = int(os.getenv('LIMITER_CACHE_SIZE', '1024'))
+TOKEN_REFRESH_MARGIN = 300
+
+# 限流配置，格式为 "次数/秒数"：
+#   RATE_LIMITS 按单个目标（webhook 地址、token 或应用）限流，默认值对应各平台群机器人的每分钟配额
+#   CHANNEL_RATE_LIMITS 按渠道类型整体限流，默认不限制
+# 环境变量中的 JSON 会覆盖同名渠道的默认值，例如 RATE_LIMITS='{"pushplus": "10/60"}'
+DEFAULT_RATE_LIMITS = {
+    'wecom_webhook': '20/60',
+    'dingtalk_webhook': '20/60',
+    'feishu_webhook': '100/60',
+}
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **json.loads(os.getenv('RATE_LIMITS') or '{}')}
+CHANNEL_RATE_LIMITS = json.loads(os.getenv('CHANNEL_RATE_LIMITS') or '{}')
+# 限流排队的最长等待时间（秒），超过后按发送失败处理
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '300'))
+# 群机器人消息合并窗口（毫秒）：窗口内发往同一 webhook 的消息合并为一条发送，0 表示不合并
+COALESCE_WINDOW_MS = int(os.getenv('COALESCE_WINDOW_MS', '0'))
+
+# 飞书接收者类型（兼容 ANotify 中的 UINION_ID 拼写）
+FEISHU_RECEIVER_TYPES = {
+    'OPEN_ID': 'open_id',
+    'CHAT_ID': 'chat_id',
+    'USER_ID': 'user_id',
+    'UNION_ID': 'union_id',
+    'UINION_ID': 'union_id',
+}
+
+# 当前发送协程最近一次 HTTP 响应的状态码，作为发送结果返回给调用方
+_response_status = contextvars.ContextVar('response_status', default=None)
+
+
+class DeliveryError(Exception):
+    """通知发送失败（HTTP 错误或渠道返回错误）"""
+
+    def __init__(self, channel, message, status_code=None, response=None):
+        super().__init__(message)
+        self.channel = channel
+        self.status_code = status_code
+        self.response = response
+
+    @property
+    def transient(self):
+        """网络错误、限流（429）和服务端错误（5xx）可重试"""
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+class DeliveryThrottled(DeliveryError):
+    """超出渠道配额且预计排队时间超过调用方允许的等待时间，retry_after 秒后再发送"""
+
+    def __init__(self, channel, retry_after):
+        super().__init__(channel, f"超出发送频率限制，预计 {retry_after:.0f} 秒后可发送")
+        self.retry_after = retry_after
+
+
+def _response_body(response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+def _provider_error(payload):
+    """识别各渠道常见的错误响应格式，返回错误信息"""
+    if not isinstance(payload, dict):
+        return None
+    if payload.get('ok') is False:
+        return payload.get('description') or payload.get('error') or 'provider rejected the request'
+    if payload.get('errcode', 0) not in (0, None):
+        return payload.get('errmsg') or payload.get('msg') or 'provider rejected the request'
+    code = payload.get('code')
+    if isinstance(code, int) and code not in (0, 200, 201, 202):
+        return payload.get('message') or payload.get('msg') or payload.get('error') or 'provider rejected the request'
+    if code == 'error' or payload.get('status') == 'error':
+        return payload.get('message') or payload.get('error') or 'provider rejected the request'
+    return None
+
+
+# 合并发送时各条消息之间的分隔
+MERGE_SEPARATOR = '\n\n----------\n\n'
+
+
+def _join_message(title, content, separator='\n'):
+    return title if not content or not content.strip() else f"{title}{separator}{content}"
+
+
+def _parse_rate(spec):
+    """解析 "次数/秒数" 格式的限流配置，返回 (每秒速率, 桶容量)"""
+    count, _, period = str(spec).partition('/')
+    count, period = float(count), float(period or 1)
+    return count / period, count
+
+
+class TokenBucket:
+    """
+    令牌桶限流器（在事件循环线程中使用）
+
+    等待者按到达顺序排队，waiting 为当前排队数（由 DeliveryEngine._throttle 在排队前计入）
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self._lock = asyncio.Lock()
+
+    def delay(self):
+        """现在排队预计需要等待的秒数（包括已在排队的等待者）"""
+        tokens = min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate)
+        return max(0.0, (1 - tokens + self.waiting) / self.rate)
+
+    def idle(self):
+        """没有等待者且令牌已补满：淘汰后重新创建的令牌桶状态相同"""
+        tokens = self.tokens + (time.monotonic() - self.updated) * self.rate
+        return self.waiting == 0 and tokens >= self.capacity
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostLimit:
+    """单个主机的并发限制（在事件循环线程中使用），active 为正在发送或排队的请求数"""
+
+    def __init__(self, limit):
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+
+    def idle(self):
+        return self.active == 0
+
+    async def __aenter__(self):
+        self.active += 1
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            self.active -= 1
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+        self.active -= 1
+
+
+def _evict_idle(cache):
+    """加入新条目前调用：缓存已满时按最久未使用的顺序淘汰空闲条目，正在使用的条目保留"""
+    if len(cache) < LIMITER_CACHE_SIZE:
+        return
+    for key in [key for key, limiter in cache.items() if limiter.idle()]:
+        del cache[key]
+        if len(cache) < LIMITER_CACHE_SIZE:
+            return
+
+
+class DeliveryEngine:
+    """
+    异步发送引擎：后台线程运行事件循环，所有渠道共享一个 HTTP 客户端
+
+    渠道适配器实例按 (渠道, 配置哈希) 缓存在有界 LRU 中，应用类渠道的 access_token 随实例复用；
+    令牌桶与主机并发限制同样按最久未使用淘汰，但只淘汰空闲的条目，不会放宽正在生效的限制
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._client = None
+        self._host_limits = OrderedDict()
+        self._adapters = OrderedDict()
+        self._buckets = OrderedDict()
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        """首次发送时启动事件循环线程"""
+        if self._loop:
+            return self._loop
+        with self._lock:
+            if not self._loop:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='delivery-loop', daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=3.05),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    def send(self, channel: NotifyChannel, config: dict, title: str, content: str, timeout=None, max_wait=None):
+        """
+        同步发送接口（供调度线程和 Flask 请求调用）
+
+        timeout（秒，含限流排队）在事件循环中计时，超时后取消发送协程（包括进行中的 HTTP 请求），
+        不会在返回超时错误后继续把消息发出去；指定 max_wait 时预计限流排队超过该秒数直接抛出 DeliveryThrottled
+
+        Returns:
+            int: 发送成功返回渠道最后一次响应的 HTTP 状态码，失败抛出异常
+        """
+        coro = self.send_async(channel, config, title, content, max_wait)
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+        future = asyncio.run_coroutine_threadsafe(tracing.bind_coroutine(coro), self._ensure_loop())
+        try:
+            return future.result()
+        except asyncio.TimeoutError:
+            raise DeliveryError(channel.value, f"发送超时（超过 {timeout:g} 秒）")
+
+    async def send_async(self, channel: NotifyChannel, config: dict, title: str, content: str, max_wait=None):
+        """异步发送通知，超出渠道配额时排队等待（预计等待超过 max_wait 秒时抛出 DeliveryThrottled）"""
+        adapter = self.get_adapter(channel.value, config)
+        if COALESCE_WINDOW_MS > 0 and isinstance(adapter, TextWebhookAdapter):
+            if max_wait is not None:
+                self._check_delay(adapter, self._buckets_for(adapter), max_wait)
+            return await self._coalesce(adapter, title, content)
+
+        await self._throttle(adapter, max_wait)
+        await adapter.send(title, content)
+        return _response_status.get()
+
+    def _buckets_for(self, adapter):
+        """渠道类型与发送目标的令牌桶（未配置限流的不返回）"""
+        buckets = [
+            self._get_bucket(adapter.channel, None, CHANNEL_RATE_LIMITS.get(adapter.channel)),
+            self._get_bucket(adapter.channel, adapter.rate_limit_key(), RATE_LIMITS.get(adapter.channel))
+        ]
+        return [bucket for bucket in buckets if bucket is not None]
+
+    @staticmethod
+    def _check_delay(adapter, buckets, max_wait):
+        """预计排队时间超过 max_wait 秒时抛出 DeliveryThrottled"""
+        delay = max((bucket.delay() for bucket in buckets), default=0)
+        if delay > max_wait:
+            raise DeliveryThrottled(adapter.channel, delay)
+
+    async def _throttle(self, adapter, max_wait=None):
+        """依次获取渠道类型与发送目标的令牌"""
+        buckets = self._buckets_for(adapter)
+        if max_wait is not None:
+            self._check_delay(adapter, buckets, max_wait)
+        # 检查与计入排队数之间没有 await，同时到达的发送能看到彼此，按排队位置估算等待时间
+        for bucket in buckets:
+            bucket.waiting += 1
+        try:
+            while buckets:
+                try:
+                    await asyncio.wait_for(buckets[0].acquire(), RATE_LIMIT_MAX_WAIT)
+                except asyncio.TimeoutError:
+                    raise DeliveryError(adapter.channel, f"限流排队超时（超过 {RATE_LIMIT_MAX_WAIT:g} 秒）")
+                buckets.pop(0).waiting -= 1
+        finally:
+            for bucket in buckets:
+                bucket.waiting -= 1
+
+    async def _coalesce(self, adapter, title, content):
+        """加入发往同一 webhook 的待合并批次，等待批次发送结果"""
+        key = (adapter.channel, adapter.rate_limit_key())
+        future = asyncio.get_running_loop().create_future()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            asyncio.get_running_loop().call_later(
+                COALESCE_WINDOW_MS / 1000, lambda: asyncio.ensure_future(self._flush(key, adapter))
+            )
+        batch.append((adapter.format_message(title, content), future))
+        return await future
+
+    async def _flush(self, key, adapter):
+        """按渠道的消息长度上限分组合并批次中的消息并依次发送"""
+        pending = self._batches.pop(key, [])
+        while pending:
+            try:
+                await self._throttle(adapter)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            # 排队期间已超时取消的消息不再发送；每次取到令牌后再组合下一条合并消息
+            pending = [(text, future) for text, future in pending if not future.done()]
+            if not pending:
+                return
+            text, futures = pending[0][0], [pending[0][1]]
+            count = 1
+            for next_text, future in pending[1:]:
+                if len((text + MERGE_SEPARATOR + next_text).encode('utf-8')) > adapter.max_message_bytes:
+                    break
+                text += MERGE_SEPARATOR + next_text
+                futures.append(future)
+                count += 1
+            pending = pending[count:]
+
+            try:
+                await adapter.send_text(text)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(_response_status.get())
+
+    def _get_bucket(self, channel, target, spec):
+        if not spec:
+            return None
+        key = (channel, target)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            _evict_idle(self._buckets)
+            bucket = self._buckets[key] = TokenBucket(*_parse_rate(spec))
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def queue_stats(self):
+        """各渠道因限流排队等待发送的消息数"""
+        channels = {}
+        for (channel, _), bucket in list(self._buckets.items()):
+            if bucket.waiting:
+                channels[channel] = channels.get(channel, 0) + bucket.waiting
+        return {'queued': sum(channels.values()), 'channels': channels}
+
+    def get_adapter(self, channel: str, config: dict):
+        """获取（或创建并缓存）渠道适配器实例，仅在事件循环线程中调用"""
+        adapter_cls = _ADAPTERS.get(channel)
+        if adapter_cls is None:
+            raise ValueError(f"不支持的通知渠道: {channel}")
+
+        key = (channel, hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest())
+        adapter = self._adapters.get(key)
+        if adapter is None:
+            adapter = adapter_cls(self, config)
+            self._adapters[key] = adapter
+            if len(self._adapters) > ADAPTER_CACHE_SIZE:
+                self._adapters.popitem(last=False)
+        else:
+            self._adapters.move_to_end(key)
+        return adapter
+
+    async def request(self, channel, method, url, **kwargs):
+        """发送 HTTP 请求并检查响应，按主机限制并发"""
+        host = urlsplit(url).netloc
+        limit = self._host_limits.get(host)
+        if limit is None:
+            _evict_idle(self._host_limits)
+            limit = self._host_limits[host] = HostLimit(HTTP_MAX_PER_HOST)
+        else:
+            self._host_limits.move_to_end(host)
+
+        async with limit:
+            try:
+                with tracing.span('http', method=method, host=host):
+                    response = await self._get_client().request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                raise DeliveryError(channel, f"HTTP {method} 请求失败: {e}") from e
+
+        _response_status.set(response.status_code)
+        payload = _response_body(response)
+        if response.status_code >= 400:
+            raise DeliveryError(channel, f"HTTP {response.status_code}: {payload}",
+                                status_code=response.status_code, response=payload)
+        error = _provider_error(payload)
+        if error:
+            raise DeliveryError(channel, str(error), status_code=response.status_code, response=payload)
+        return payload
+
+
+# 渠道适配器注册表：渠道值 -> 适配器类
+_ADAPTERS = {}
+
+
+def register_adapter(channel: str):
+    """注册渠道适配器（类装饰器）"""
+    def decorator(cls):
+        cls.channel = channel
+        _ADAPTERS[channel] = cls
+        return cls
+    return decorator
+
+
+class ChannelAdapter:
+    """渠道适配器基类，实例与一份渠道配置绑定"""
+
+    channel = None
+
+    def __init__(self, engine: DeliveryEngine, config: dict):
+        self.engine = engine
+        self.config = config
+
+    async def send(self, title: str, content: str):
+        raise NotImplementedError
+
+    def rate_limit_key(self):
+        """限流目标：同一 webhook 地址、token 或应用共享配额"""
+        config = self.config
+        return str(config.get('webhook_url') or config.get('token') or config.get('corpid') or config.get('appid') or '')
+
+    async def request(self, method, url, **kwargs):
+        return await self.engine.request(self.channel, method, url, **kwargs)
+
+
+class TokenChannelAdapter(ChannelAdapter):
+    """
+    需要 access_token 的应用类渠道
+
+    token 缓存到过期前 TOKEN_REFRESH_MARGIN 秒；渠道返回 token 失效错误时刷新后重试一次
+    """
+
+    # 表示 token 失效的错误码
+    token_error_codes = set()
+
+    def __init__(self, engine, config):
+        super().__init__(engine, config)
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = None
+
+    async def fetch_token(self):
+        """获取新 token，返回 (token, 有效期秒数)"""
+        raise NotImplementedError
+
+    async def get_token(self):
+        if self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if not self._token or time.monotonic() >= self._token_expires_at:
+                token, expires_in = await self.fetch_token()
+                self._token = token
+                self._token_expires_at = time.monotonic() + max(int(expires_in) - TOKEN_REFRESH_MARGIN, 0)
+        return self._token
+
+    async def send(self, title, content):
+        try:
+            await self.send_with_token(await self.get_token(), title, content)
+        except DeliveryError as e:
+            payload = e.response if isinstance(e.response, dict) else {}
+            if (payload.get('errcode') or payload.get('code')) not in self.token_error_codes:
+                raise
+            self._token = None
+            await self.send_with_token(await self.get_token(), title, content)
+
+    async def send_with_token(self, token, title, content):
+        raise NotImplementedError
+
+
+@register_adapter(NotifyChannel.WECOM.value)
+class WecomAdapter(TokenChannelAdapter):
+    """企业微信应用消息"""
+
+    token_error_codes = {40014, 42001}
+
+    async def fetch_token(self):
+        result = await self.request('GET', 'https://qyapi.weixin.qq.com/cgi-bin/gettoken', params={
+            'corpid': self.config['corpid'],
+            'corpsecret': self.config['corpsecret']
+        })
+        if 'access_token' not in result:
+            raise DeliveryError(self.channel, '获取 access_token 失败', response=result)
+        return result['access_token'], result.get('expires_in', 7200)
+
+    async def send_with_token(self, token, title, content):
+        await self.request('POST', 'https://qyapi.weixin.qq.com/cgi-bin/message/send?access_token=' + token, json={
+            "touser": "@all",
+            "msgtype": "text",
+            "agentid": self.config['agentid'],
+            "text": {"content": _join_message(title, content)},
+            "safe": 0,
+            "enable_id_trans": 0,
+            "enable_duplicate_check": 0,
+            "duplicate_check_interval": 1800
+        })
+
+
+class TextWebhookAdapter(ChannelAdapter):
+    """群机器人类渠道：发送纯文本消息，开启合并窗口时同一 webhook 的消息可合并发送"""
+
+    # 标题与内容之间的分隔符、单条消息的字节数上限
+    separator = '\n'
+    max_message_bytes = 2048
+
+    def format_message(self, title, content):
+        return _join_message(title, content, self.separator)
+
+    async def send(self, title, content):
+        await self.send_text(self.format_message(title, content))
+
+    async def send_text(self, text):
+        raise NotImplementedError
+
+
+@register_adapter(NotifyChannel.WECOM_WEBHOOK.value)
+class WecomWebhookAdapter(TextWebhookAdapter):
+    """企业微信群机器人（文本内容最长 2048 字节）"""
+
+    max_message_bytes = 2048
+
+    async def send_text(self, text):
+        await self.request('POST', self.config['webhook_url'], json={
+            "msgtype": "text",
+            "text": {"content": text}
+        })
+
+
+@register_adapter(NotifyChannel.FEISHU.value)
+class FeishuAdapter(TokenChannelAdapter):
+    """飞书应用消息"""
+
+    token_error_codes = {99991661, 99991663, 99991668}
+
+    async def fetch_token(self):
+        result = await self.request(
+            'POST', 'https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal',
+            json={'app_id': self.config['appid'], 'app_secret': self.config['appsecret']}
+        )
+        if 'tenant_access_token' not in result:
+            raise DeliveryError(self.channel, '获取 tenant_access_token 失败', response=result)
+        return result['tenant_access_token'], result.get('expire', 7200)
+
+    async def send_with_token(self, token, title, content):
+        receiver_type = self.config['receiver_type']
+        await self.request(
+            'POST', 'https://open.feishu.cn/open-apis/im/v1/messages',
+            params={'receive_id_type': FEISHU_RECEIVER_TYPES.get(str(receiver_type).upper(), receiver_type)},
+            headers={'Authorization': 'Bearer ' + token},
+            json={
+                "receive_id": self.config['receiver_id'],
+                "msg_type": "text",
+                "content": json.dumps({"text": _join_message(title, content, '\n\n')})
+            }
+        )
+
+
+@register_adapter(NotifyChannel.FEISHU_WEBHOOK.value)
+class FeishuWebhookAdapter(TextWebhookAdapter):
+    """飞书群机器人（请求体最大 20 KB）"""
+
+    separator = '\n\n'
+    max_message_bytes = 18000
+
+    async def send_text(self, text):
+        await self.request('POST', self.config['webhook_url'], json={
+            "msg_type": "text",
+            "content": {"text": text}
+        })
+
+
+@register_adapter(NotifyChannel.DINGTALK_WEBHOOK.value)
+class DingtalkWebhookAdapter(TextWebhookAdapter):
+    """钉钉群机器人（消息最长 20000 字节）"""
+
+    separator = '\n\n'
+    max_message_bytes = 20000
+
+    async def send_text(self, text):
+        await self.request('POST', self.config['webhook_url'], json={
+            "msgtype": "text",
+            "text": {"content": text}
+        })
+
+
+@register_adapter(NotifyChannel.PUSHPLUS.value)
+class PushPlusAdapter(ChannelAdapter):
+    """PushPlus"""
+
+    async def send(self, title, content):
+        await self.request('POST', 'https://www.pushplus.plus/send', json={
+            "token": self.config['token'],
+            "title": title,
+            "content": content,
+            "template": "txt",
+            "channel": "wechat"
+        })
+
+
+@register_adapter(NotifyChannel.SERVERCHAN.value)
+class ServerChanAdapter(ChannelAdapter):
+    """Server酱"""
+
+    async def send(self, title, content):
+        await self.request('POST', f"https://sctapi.ftqq.com/{self.config['token']}.send", data={
+            "text": title,
+            "desp": content
+        })
+
+
+@register_adapter(NotifyChannel.GOTIFY.value)
+class GotifyAdapter(ChannelAdapter):
+    """Gotify（`server_url` 必需，`token` 为应用 token）"""
+
+    async def send(self, title, content):
+        server = self.config.get('server_url') or self.config.get('url')
+        await self.request('POST', server.rstrip('/') + '/message', params={'token': self.config.get('token')}, json={
+            "extras": {"client::display": {"contentType": "text/plain"}},
+            "message": content,
+            "priority": 5,
+            "title": title
+        })
+
+
+@register_adapter(NotifyChannel.NTFY.value)
+class NtfyAdapter(ChannelAdapter):
+    """ntfy（`server_url` 可选，默认为 https://ntfy.sh；`topic` 必需）"""
+
+    async def send(self, title, content):
+        server = self.config.get('server_url') or 'https://ntfy.sh'
+        # 非 ASCII 标题按 RFC 2047 编码放入请求头
+        await self.request('POST', server.rstrip('/') + '/' + self.config.get('topic'),
+                           content=(content or '').encode('utf-8'),
+                           headers={'Title': Header(title, 'utf-8').encode()})
+
+
+@register_adapter(NotifyChannel.IYUU.value)
+class IyuuAdapter(ChannelAdapter):
+    """IYUU"""
+
+    async def send(self, title, content):
+        await self.request('GET', f"https://iyuu.cn/{self.config.get('token')}.send", params={
+            "text": title,
+            "desp": content
+        })
+
+
+@register_adapter(NotifyChannel.BAFAYUN.value)
+class BafayunAdapter(ChannelAdapter):
+    """巴法云"""
+
+    async def send(self, title, content):
+        await self.request('POST', 'https://apis.bemfa.com/vb/wechat/v1/wechatWarnJson', json={
+            "uid": self.config.get('token'),
+            "device": title,
+            "message": content
+        })
+
+
+@register_adapter('webhook')
+class GenericWebhookAdapter(ChannelAdapter):
+    """通用 webhook（`webhook_url`，可选 `method`（默认 POST）与 `headers`）"""
+
+    async def send(self, title, content):
+        webhook = self.config.get('webhook_url')
+        if not webhook:
+            raise ValueError('缺少 webhook_url')
+
+        method = (self.config.get('method') or 'POST').upper()
+        headers = self.config.get('headers') or {}
+        body = self.config.get('payload_template') or {'title': title, 'content': content}
+        try:
+            await self.request(method, webhook, json=body, headers=headers)
+        except DeliveryError:
+            # 最后尝试以 text/plain 直接发送内容
+            await self.request(method, webhook, content=f"{title}\n\n{content}".encode('utf-8'),
+                               headers={'Content-Type': 'text/plain', **headers})
+
+
+# 全局发送引擎
+delivery_engine = DeliveryEngine()
@@ -0,0 +1,38 @@
+"""
+独立调度进程
+负责数据库初始化、任务调度、通知发送与外部日历同步，与 Flask Web 进程分离部署
+
+用法:
+    python -m dispatcher
+
+Web 进程设置 SCHEDULER_ROLE=web 后只提供 API，不再启动调度线程，
+任务变更通过 scheduler_signals 表通知本进程。
+"""
+
+import signal
+import threading
+from models import init_db
+from scheduler import scheduler, logger
+
+
+def main():
+    """启动调度进程并阻塞直到收到退出信号"""
+    init_db()
+    scheduler.start()
+
+    stop_event = threading.Event()
+
+    def handle_exit(signum, frame):
+        logger.info(f"收到退出信号 {signum}，正在停止调度进程...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_exit)
+    signal.signal(signal.SIGINT, handle_exit)
+
+    logger.info("调度进程已启动")
+    stop_event.wait()
+    scheduler.shutdown()
+
+
+if __name__ == '__main__':
+    main()
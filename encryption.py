@@ -4,10 +4,13 @@ Encryption utilities for protecting sensitive data in export/import
 """
 import base64
 import json
-from typing import Any, Dict
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+import tracing
 
 
 # 需要加密的敏感字段名称
@@ -26,10 +29,14 @@ SENSITIVE_FIELDS = {
     'password',     # Passwords for auth
 }
 
+# 轮换前使用过的 SECRET_KEY（逗号分隔），导入旧密钥加密的导出文件时依次尝试
+# Previous SECRET_KEYs (comma separated) accepted when decrypting after a key rotation
+PREVIOUS_SECRET_KEYS = [key.strip() for key in os.getenv('PREVIOUS_SECRET_KEYS', '').split(',') if key.strip()]
+
 
 def derive_encryption_key(secret_key: str) -> bytes:
     """
-    从 SECRET_KEY 派生 Fernet 加密密钥
+    从 SECRET_KEY 派生 Fernet 加密密钥（结果按密钥缓存）
     Derive Fernet encryption key from SECRET_KEY using HKDF
     
     Args:
@@ -38,6 +45,11 @@ def derive_encryption_key(secret_key: str) -> bytes:
     Returns:
         Base64 编码的 Fernet 密钥
     """
+    return _derive_encryption_key(secret_key)
+
+
+@lru_cache(maxsize=32)
+def _derive_encryption_key(secret_key: str) -> bytes:
     kdf = HKDF(
         algorithm=hashes.SHA256(),
         length=32,
@@ -49,37 +61,35 @@ def derive_encryption_key(secret_key: str) -> bytes:
     return base64.urlsafe_b64encode(derived_key)
 
 
-def get_fernet_cipher(secret_key: str) -> Fernet:
+def get_fernet_cipher(secret_key: str, previous_keys: Optional[Sequence[str]] = None):
     """
-    获取 Fernet 加密器实例
+    获取 Fernet 加密器实例（按密钥缓存，同一密钥只派生一次）
     Get Fernet cipher instance
     
     Args:
         secret_key: 应用的 SECRET_KEY
+        previous_keys: 轮换前使用过的 SECRET_KEY，默认读取环境变量 PREVIOUS_SECRET_KEYS
         
     Returns:
-        Fernet 加密器
+        Fernet 加密器；有旧密钥时为 MultiFernet（用当前密钥加密，可用任一密钥解密）
     """
-    key = derive_encryption_key(secret_key)
-    return Fernet(key)
+    if previous_keys is None:
+        previous_keys = PREVIOUS_SECRET_KEYS
+    return _get_cipher(secret_key, tuple(k for k in previous_keys if k and k != secret_key))
 
 
-def encrypt_sensitive_fields(data: Dict[str, Any], secret_key: str) -> Dict[str, Any]:
-    """
-    加密字典中的敏感字段
-    Encrypt sensitive fields in a dictionary
-    
-    Args:
-        data: 包含敏感数据的字典
-        secret_key: 应用的 SECRET_KEY
-        
-    Returns:
-        加密后的字典副本（标记为已加密）
-    """
+@lru_cache(maxsize=32)
+def _get_cipher(secret_key: str, previous_keys: Tuple[str, ...]):
+    cipher = Fernet(derive_encryption_key(secret_key))
+    if not previous_keys:
+        return cipher
+    return MultiFernet([cipher] + [Fernet(derive_encryption_key(key)) for key in previous_keys])
+
+
+def _encrypt_fields(data: Dict[str, Any], cipher) -> Dict[str, Any]:
     if not data:
         return data
-        
-    cipher = get_fernet_cipher(secret_key)
+
     encrypted_data = data.copy()
     
     # 标记数据已加密
@@ -90,32 +100,18 @@ def encrypt_sensitive_fields(data: Dict[str, Any], secret_key: str) -> Dict[str,
         if field in encrypted_data and encrypted_data[field]:
             # 将值加密为字符串
             value_str = str(encrypted_data[field])
-            encrypted_bytes = cipher.encrypt(value_str.encode('utf-8'))
+            with tracing.span('cipher.encrypt', field=field):
+                encrypted_bytes = cipher.encrypt(value_str.encode('utf-8'))
             encrypted_data[field] = base64.b64encode(encrypted_bytes).decode('utf-8')
     
     return encrypted_data
 
 
-def decrypt_sensitive_fields(data: Dict[str, Any], secret_key: str) -> Dict[str, Any]:
-    """
-    解密字典中的敏感字段
-    Decrypt sensitive fields in a dictionary
-    
-    Args:
-        data: 包含加密数据的字典
-        secret_key: 应用的 SECRET_KEY
-        
-    Returns:
-        解密后的字典副本
-    """
-    if not data:
-        return data
-    
+def _decrypt_fields(data: Dict[str, Any], cipher) -> Dict[str, Any]:
     # 如果没有加密标记，直接返回（向后兼容）
-    if not data.get('_encrypted'):
+    if not data or not data.get('_encrypted'):
         return data
-    
-    cipher = get_fernet_cipher(secret_key)
+
     decrypted_data = data.copy()
     
     # 移除加密标记
@@ -127,7 +123,8 @@ def decrypt_sensitive_fields(data: Dict[str, Any], secret_key: str) -> Dict[str,
             try:
                 # 解密字符串
                 encrypted_bytes = base64.b64decode(decrypted_data[field])
-                decrypted_bytes = cipher.decrypt(encrypted_bytes)
+                with tracing.span('cipher.decrypt', field=field):
+                    decrypted_bytes = cipher.decrypt(encrypted_bytes)
                 decrypted_data[field] = decrypted_bytes.decode('utf-8')
             except Exception as e:
                 # 解密失败，记录错误但保持原值（可能已是明文）
@@ -137,6 +134,61 @@ def decrypt_sensitive_fields(data: Dict[str, Any], secret_key: str) -> Dict[str,
     return decrypted_data
 
 
+def encrypt_sensitive_fields(data: Dict[str, Any], secret_key: str) -> Dict[str, Any]:
+    """
+    加密字典中的敏感字段
+    Encrypt sensitive fields in a dictionary
+    
+    Args:
+        data: 包含敏感数据的字典
+        secret_key: 应用的 SECRET_KEY
+        
+    Returns:
+        加密后的字典副本（标记为已加密）
+    """
+    if not data:
+        return data
+    return _encrypt_fields(data, get_fernet_cipher(secret_key))
+
+
+def decrypt_sensitive_fields(data: Dict[str, Any], secret_key: str,
+                             previous_keys: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    解密字典中的敏感字段
+    Decrypt sensitive fields in a dictionary
+    
+    Args:
+        data: 包含加密数据的字典
+        secret_key: 应用的 SECRET_KEY
+        previous_keys: 轮换前使用过的 SECRET_KEY（用于解密旧密钥导出的数据）
+        
+    Returns:
+        解密后的字典副本
+    """
+    if not data or not data.get('_encrypted'):
+        return data
+    return _decrypt_fields(data, get_fernet_cipher(secret_key, previous_keys))
+
+
+def encrypt_sensitive_fields_batch(items: Iterable[Dict[str, Any]], secret_key: str) -> List[Dict[str, Any]]:
+    """
+    批量加密多个字典中的敏感字段（只获取一次加密器）
+    Encrypt sensitive fields of many dictionaries in one pass
+    """
+    cipher = get_fernet_cipher(secret_key)
+    return [_encrypt_fields(item, cipher) for item in items]
+
+
+def decrypt_sensitive_fields_batch(items: Iterable[Dict[str, Any]], secret_key: str,
+                                   previous_keys: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """
+    批量解密多个字典中的敏感字段（只获取一次加密器）
+    Decrypt sensitive fields of many dictionaries in one pass
+    """
+    cipher = get_fernet_cipher(secret_key, previous_keys)
+    return [_decrypt_fields(item, cipher) for item in items]
+
+
 def encrypt_channel_config(channel_config: str, secret_key: str) -> str:
     """
     加密通道配置 JSON 字符串
@@ -183,3 +235,28 @@ def decrypt_channel_config(channel_config: str, secret_key: str) -> str:
     except json.JSONDecodeError:
         # 如果不是有效 JSON，直接返回
         return channel_config
+
+
+if __name__ == '__main__':
+    # 基准测试：逐条派生密钥加密 与 缓存加密器批量加密 的耗时对比
+    # Benchmark: per-item key derivation vs cached cipher batch encryption
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    secret = 'benchmark-secret-key'
+    configs = [{'webhook_url': f'https://example.com/hook/{i}', 'token': f'token-{i}'} for i in range(count)]
+
+    started = time.perf_counter()
+    uncached = [_encrypt_fields(config, Fernet(_derive_encryption_key.__wrapped__(secret))) for config in configs]
+    uncached_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = encrypt_sensitive_fields_batch(configs, secret)
+    batched_time = time.perf_counter() - started
+
+    assert decrypt_sensitive_fields_batch(batched, secret) == configs
+    print(f"{count} 条配置")
+    print(f"逐条派生密钥: {uncached_time:.3f}s ({uncached_time / count * 1e6:.1f} µs/条)")
+    print(f"缓存批量加密: {batched_time:.3f}s ({batched_time / count * 1e6:.1f} µs/条)")
+    print(f"加速: {uncached_time / batched_time:.2f}x")
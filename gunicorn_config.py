@@ -5,10 +5,13 @@ import multiprocessing
 bind = "0.0.0.0:5000"
 
 # 工作进程数
-workers = multiprocessing.cpu_count() * 2 + 1
+workers = multiprocessing.cpu_count()
 
-# 工作模式
-worker_class = "sync"
+# 工作模式：gthread 每个进程用 threads 个线程处理请求，
+# 同一进程内的请求共享密码哈希线程池（PASSWORD_HASH_WORKERS）及其排队上限，
+# 登录高峰时超出部分返回 503，而不是占满全部请求线程；SSE 长连接也只占用一个线程
+worker_class = "gthread"
+threads = 8
 
 # 超时时间
 timeout = 120
@@ -0,0 +1,192 @@
+"""
+运行指标（Prometheus 文本格式）
+
+提供线程安全的 Counter / Gauge / Histogram，由 `/metrics` 接口输出。
+指标保存在进程内存中：多 worker 部署时每个进程分别统计，调度相关指标只在调度主节点上有数据。
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# 默认直方图分桶（秒），覆盖毫秒级数据库会话到分钟级的限流排队
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """返回 [(后缀, 标签值, 额外标签, 值)]"""
+        with self._lock:
+            return [('', key, None, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    可增可减的数值
+
+    也可以用 set_function 注册回调，在输出时取值；有标签的指标回调返回 {标签值元组: 值}
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+        try:
+            value = self._function()
+        except Exception:
+            return []
+        if not self.labelnames:
+            return [('', (), None, value)]
+        return [('', tuple(str(v) for v in key), None, v) for key, v in value.items()]
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各分桶计数（最后一个为 +Inf）, 总和]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """统计 with 代码块的耗时（秒）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', key, ('le', _format_value(float(bound))), cumulative))
+            samples.append(('_sum', key, None, total))
+            samples.append(('_count', key, None, cumulative))
+        return samples
+
+
+REGISTRY = []
+
+
+def render():
+    """以 Prometheus 文本格式输出所有指标"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# 调度
+SCHEDULE_LAG = Histogram(
+    'notify_schedule_lag_seconds', '任务计划时间到实际开始执行的延迟（秒）'
+)
+TASK_EXECUTIONS = Counter(
+    'notify_task_executions_total', '任务执行次数', ('status',)
+)
+JOBSTORE_JOBS = Gauge(
+    'notify_jobstore_jobs', '调度器作业存储中的作业数（仅调度主节点）', ('jobstore',)
+)
+SCHEDULER_LEADER = Gauge(
+    'notify_scheduler_leader', '当前进程是否为调度主节点'
+)
+
+# 发送
+SEND_DURATION = Histogram(
+    'notify_send_duration_seconds', '单个渠道发送耗时（秒，含限流排队）', ('channel',)
+)
+SEND_TOTAL = Counter(
+    'notify_send_total', '渠道发送次数', ('channel', 'status')
+)
+DELIVERY_QUEUED = Gauge(
+    'notify_delivery_queued', '因限流排队等待发送的消息数'
+)
+
+# 数据库与前端连接
+DB_SESSION_DURATION = Histogram(
+    'notify_db_session_seconds', 'get_db() 数据库会话持续时间（秒）'
+)
+SSE_LISTENERS = Gauge(
+    'notify_sse_listeners', '本进程的 SSE 连接数'
+)
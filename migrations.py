@@ -0,0 +1,335 @@
+"""
+数据库版本化迁移
+
+init_db() 先用 create_all 创建缺失的表，再按版本号顺序执行尚未应用的迁移，已应用的版本记录在
+schema_migrations 表中。迁移通过 SQLAlchemy inspect 检查现有结构，同时支持 SQLite 与 PostgreSQL，
+对新建的数据库执行时不做任何修改。
+
+修改已有表的结构（新增列、索引等）时，在 MIGRATIONS 末尾追加新版本，不要修改已发布的迁移。
+
+直接运行 `python migrations.py` 会初始化数据库并检查高频查询的执行计划。
+"""
+
+from datetime import datetime
+import ast
+import json
+from sqlalchemy import and_, func, inspect, or_, select, text
+from sqlalchemy.exc import IntegrityError
+from models import (
+    DeliveryRetry, ExternalCalendar, NotifyStatus, NotifyTask, SchemaMigration, TaskDelivery, TaskExecution,
+    TaskTombstone, User, UserChannel, engine
+)
+
+
+def _columns(conn, table):
+    return {column['name']: column for column in inspect(conn).get_columns(table)}
+
+
+def _add_columns(conn, table, columns):
+    """添加缺失的列，columns 为 (列名, 类型) 列表"""
+    existing = _columns(conn, table)
+    for name, column_type in columns:
+        if name not in existing:
+            print(f"Migrating: Adding {name} to {table} table...")
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+
+
+def add_users_calendar_token(conn):
+    _add_columns(conn, 'users', [('calendar_token', 'VARCHAR(64)')])
+
+
+def add_notify_tasks_external_uid(conn):
+    _add_columns(conn, 'notify_tasks', [('external_uid', 'VARCHAR(255)')])
+
+
+def add_multi_channel_fields(conn):
+    _add_columns(conn, 'notify_tasks', [
+        ('channels_json', 'TEXT'),
+        ('channels_config_json', 'TEXT'),
+        ('send_results', 'TEXT'),
+    ])
+
+
+def make_single_channel_fields_nullable(conn):
+    """移除 channel 和 channel_config 的 NOT NULL 约束（多渠道模式需要）"""
+    columns = _columns(conn, 'notify_tasks')
+    if columns['channel']['nullable'] and columns['channel_config']['nullable']:
+        return
+
+    print("Migrating: Removing NOT NULL constraint from channel and channel_config...")
+    if conn.dialect.name != 'sqlite':
+        conn.execute(text("ALTER TABLE notify_tasks ALTER COLUMN channel DROP NOT NULL"))
+        conn.execute(text("ALTER TABLE notify_tasks ALTER COLUMN channel_config DROP NOT NULL"))
+        return
+
+    # SQLite 不支持直接修改列约束，需要重建表
+    conn.execute(text("""
+        CREATE TABLE notify_tasks_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title VARCHAR(200) NOT NULL,
+            content TEXT NOT NULL,
+            channel TEXT,
+            scheduled_time DATETIME NOT NULL,
+            channel_config TEXT,
+            channels_json TEXT,
+            channels_config_json TEXT,
+            send_results TEXT,
+            status TEXT DEFAULT 'pending',
+            sent_time DATETIME,
+            error_msg TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_recurring BOOLEAN DEFAULT 0,
+            cron_expression VARCHAR(100),
+            external_uid VARCHAR(255),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """))
+    conn.execute(text("""
+        INSERT INTO notify_tasks_new
+        SELECT id, user_id, title, content, channel, scheduled_time,
+               channel_config, channels_json, channels_config_json, send_results,
+               status, sent_time, error_msg, created_at, updated_at,
+               is_recurring, cron_expression, external_uid
+        FROM notify_tasks
+    """))
+    conn.execute(text("DROP TABLE notify_tasks"))
+    conn.execute(text("ALTER TABLE notify_tasks_new RENAME TO notify_tasks"))
+
+
+def dedupe_external_uid(conn):
+    """
+    唯一索引前清理重复的外部日历任务（保留最早创建的一条）
+
+    删除前将重复的任务原样复制到 notify_tasks_duplicates 表中，并输出被删除的任务 ID，便于核对与恢复
+    """
+    duplicates = """
+        FROM notify_tasks
+        WHERE external_uid IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM notify_tasks WHERE external_uid IS NOT NULL GROUP BY external_uid
+        )
+    """
+    rows = conn.execute(text("SELECT id, user_id, external_uid " + duplicates)).all()
+    if not rows:
+        return
+
+    print(f"Migrating: Archiving {len(rows)} duplicated external calendar tasks to notify_tasks_duplicates...")
+    for task_id, user_id, external_uid in rows:
+        print(f"    task {task_id} (user {user_id}, external_uid {external_uid})")
+    if inspect(conn).has_table('notify_tasks_duplicates'):
+        conn.execute(text("INSERT INTO notify_tasks_duplicates SELECT * " + duplicates))
+    else:
+        conn.execute(text("CREATE TABLE notify_tasks_duplicates AS SELECT * " + duplicates))
+    conn.execute(text("DELETE " + duplicates))
+
+
+def _create_indexes(conn, indexes):
+    """
+    为已存在的表补建索引（create_all 只为新建的表创建索引）
+
+    indexes 为 (索引名, 表名, 列名列表, 是否唯一) 列表，索引定义写死在各版本中，
+    之后修改模型不会影响已发布的迁移
+    """
+    existing = {}
+    for name, table, columns, unique in indexes:
+        if table not in existing:
+            existing[table] = {index['name'] for index in inspect(conn).get_indexes(table)}
+        if name in existing[table]:
+            continue
+        print(f"Migrating: Creating index {name} on {table}...")
+        conn.execute(text(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})"
+        ))
+
+
+def add_task_indexes(conn):
+    """用户、状态、计划时间相关的任务索引，以及外部日历事件 UID 唯一索引"""
+    _create_indexes(conn, [
+        ('ix_external_calendars_user_id', 'external_calendars', ['user_id'], False),
+        ('ix_user_channels_user_id', 'user_channels', ['user_id'], False),
+        ('ix_notify_tasks_updated_at', 'notify_tasks', ['updated_at'], False),
+        ('ix_notify_tasks_status_scheduled_time', 'notify_tasks', ['status', 'scheduled_time'], False),
+        ('ix_notify_tasks_user_status_scheduled_time', 'notify_tasks', ['user_id', 'status', 'scheduled_time'], False),
+        ('ux_notify_tasks_external_uid', 'notify_tasks', ['external_uid'], True),
+    ])
+
+
+def add_task_cursor_indexes(conn):
+    """任务列表游标分页索引"""
+    _create_indexes(conn, [
+        ('ix_notify_tasks_user_scheduled_time_id', 'notify_tasks', ['user_id', 'scheduled_time', 'id'], False),
+        ('ix_notify_tasks_user_created_at_id', 'notify_tasks', ['user_id', 'created_at', 'id'], False),
+    ])
+
+
+def add_task_changes_index(conn):
+    """任务增量同步索引"""
+    _create_indexes(conn, [
+        ('ix_notify_tasks_user_updated_at_id', 'notify_tasks', ['user_id', 'updated_at', 'id'], False),
+    ])
+
+
+def normalize_legacy_json(conn):
+    """将旧版本以 Python 字面量保存的渠道配置转换为 JSON"""
+    for table in ('notify_tasks', 'user_channels'):
+        updates = []
+        rows = conn.execute(text(f"SELECT id, channel_config FROM {table} WHERE channel_config IS NOT NULL"))
+        for row_id, raw in rows:
+            try:
+                json.loads(raw)
+            except ValueError:
+                try:
+                    value = ast.literal_eval(raw)
+                except Exception:
+                    continue
+                updates.append({'id': row_id, 'config': json.dumps(value, ensure_ascii=False)})
+        if updates:
+            print(f"Migrating: Converting {len(updates)} legacy channel configs in {table} to JSON...")
+            conn.execute(text(f"UPDATE {table} SET channel_config = :config WHERE id = :id"), updates)
+
+
+def add_delivery_retries_snapshot(conn):
+    _add_columns(conn, 'delivery_retries', [
+        ('task_scheduled_time', 'TIMESTAMP'),
+        ('config_digest', 'VARCHAR(64)'),
+    ])
+
+
+# (版本号, 迁移函数)，版本号只增不改
+MIGRATIONS = [
+    (1, add_users_calendar_token),
+    (2, add_notify_tasks_external_uid),
+    (3, add_multi_channel_fields),
+    (4, make_single_channel_fields_nullable),
+    (5, dedupe_external_uid),
+    (6, add_task_indexes),
+    (7, add_task_cursor_indexes),
+    (8, add_task_changes_index),
+    (9, normalize_legacy_json),
+    (10, add_delivery_retries_snapshot),
+]
+
+
+def run_migrations(bind=engine):
+    """
+    执行尚未应用的迁移
+
+    每个迁移与其版本记录在同一事务中提交；多个进程同时启动时，
+    后插入版本记录的进程会因主键冲突跳过该迁移。
+    """
+    with bind.connect() as conn:
+        applied = set(conn.execute(select(SchemaMigration.version)).scalars())
+
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with bind.begin() as conn:
+                conn.execute(SchemaMigration.__table__.insert().values(
+                    version=version, name=migration.__name__, applied_at=datetime.now()
+                ))
+                migration(conn)
+        except IntegrityError:
+            # 其他进程已应用该迁移
+            continue
+        except Exception as e:
+            print(f"Migration {version} ({migration.__name__}) failed: {e}")
+            raise
+
+
+# 高频查询：check_query_plans() 检查它们都能命中索引
+def _hot_queries():
+    now = datetime.now()
+    return {
+        'list_tasks': select(NotifyTask).where(NotifyTask.user_id == 1).order_by(NotifyTask.scheduled_time),
+        'list_tasks_cursor': select(NotifyTask).where(
+            NotifyTask.user_id == 1,
+            or_(NotifyTask.created_at < now, and_(NotifyTask.created_at == now, NotifyTask.id < 100))
+        ).order_by(
+            NotifyTask.created_at.is_(None).desc(), NotifyTask.created_at.desc(), NotifyTask.id.desc()
+        ).limit(20),
+        'list_tasks_by_status': select(NotifyTask).where(
+            NotifyTask.user_id == 1, NotifyTask.status == NotifyStatus.PENDING
+        ).order_by(NotifyTask.scheduled_time),
+        'calendar_feed': select(NotifyTask).where(
+            NotifyTask.user_id == 1, NotifyTask.status != NotifyStatus.CANCELLED
+        ),
+        'calendar_feed_user': select(User).where(User.calendar_token == 'token'),
+        'horizon_sweep': select(NotifyTask).where(
+            NotifyTask.status == NotifyStatus.PENDING,
+            NotifyTask.scheduled_time >= now,
+            NotifyTask.scheduled_time <= now
+        ).order_by(NotifyTask.scheduled_time),
+        'reconcile_changed': select(NotifyTask).where(NotifyTask.updated_at >= now),
+        'task_changes': select(NotifyTask).where(
+            NotifyTask.user_id == 1,
+            or_(NotifyTask.updated_at > now, and_(NotifyTask.updated_at == now, NotifyTask.id > 100))
+        ).order_by(NotifyTask.updated_at, NotifyTask.id).limit(500),
+        'task_tombstones': select(TaskTombstone.task_id).where(
+            TaskTombstone.user_id == 1, TaskTombstone.deleted_at >= now
+        ),
+        'calendar_sync_lookup': select(NotifyTask).where(NotifyTask.external_uid == 'ext-1-uid'),
+        'user_channels': select(UserChannel).where(UserChannel.user_id == 1),
+        'external_calendars': select(ExternalCalendar).where(ExternalCalendar.user_id == 1),
+        'due_retries': select(DeliveryRetry).where(
+            DeliveryRetry.status == 'pending', DeliveryRetry.next_attempt_at <= now
+        ),
+        'task_deliveries': select(TaskDelivery).where(
+            TaskDelivery.task_id == 1, TaskDelivery.user_id == 1, TaskDelivery.id < 100
+        ).order_by(TaskDelivery.id.desc()).limit(50),
+        'delivery_stats': select(TaskDelivery.channel, TaskDelivery.status, func.count()).where(
+            TaskDelivery.user_id == 1, TaskDelivery.created_at >= now
+        ).group_by(TaskDelivery.channel, TaskDelivery.status),
+        'delivery_failures': select(TaskDelivery.channel, func.count()).where(
+            TaskDelivery.status == 'failed', TaskDelivery.created_at >= now
+        ).group_by(TaskDelivery.channel),
+        'delivery_prune': select(TaskDelivery.id).where(TaskDelivery.created_at < now),
+        'task_executions': select(TaskExecution).where(
+            TaskExecution.task_id == 1, TaskExecution.user_id == 1, TaskExecution.id < 100
+        ).order_by(TaskExecution.id.desc()).limit(50),
+        'execution_prune': select(TaskExecution.id).where(TaskExecution.started_at < now).limit(5000),
+    }
+
+
+def check_query_plans(bind=engine):
+    """
+    对高频查询执行 EXPLAIN，返回发生全表扫描的查询 {名称: 执行计划}
+
+    支持 SQLite 与 PostgreSQL（临时关闭顺序扫描，避免小表上的计划误报）
+    """
+    scans = {}
+    with bind.connect() as conn:
+        for name, stmt in _hot_queries().items():
+            sql = str(stmt.compile(dialect=bind.dialect, compile_kwargs={'literal_binds': True}))
+            if bind.dialect.name == 'sqlite':
+                plan = [row[-1] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+                full_scan = any(
+                    line.startswith('SCAN ') and ' USING ' not in line and 'CONSTANT ROW' not in line
+                    for line in plan
+                )
+            elif bind.dialect.name == 'postgresql':
+                with conn.begin():
+                    conn.execute(text('SET LOCAL enable_seqscan = off'))
+                    plan = [row[0] for row in conn.execute(text('EXPLAIN ' + sql))]
+                full_scan = any('Seq Scan' in line for line in plan)
+            else:
+                continue
+            if full_scan:
+                scans[name] = plan
+    return scans
+
+
+if __name__ == '__main__':
+    # 初始化数据库并检查高频查询的执行计划，有全表扫描时返回非零退出码
+    import sys
+    from models import init_db
+
+    init_db()
+    scans = check_query_plans()
+    for name, plan in scans.items():
+        print(f"全表扫描: {name}")
+        for line in plan:
+            print(f"    {line}")
+    print("执行计划检查完成" if not scans else f"{len(scans)} 个查询未命中索引")
+    sys.exit(1 if scans else 0)
@@ -1,17 +1,101 @@
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean, Enum, ForeignKey, text
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Text, Boolean, Enum, ForeignKey, Index
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from contextlib import contextmanager
 import enum
 import hashlib
+import hmac
 import os
 import secrets
+import time
 import json
 import ast
+from functools import lru_cache
+from metrics import DB_SESSION_DURATION
+import tracing
 
 Base = declarative_base()
 
+# JSON 文本列解析缓存条目数：按原始文本缓存，相同配置的任务只解析一次
+JSON_CACHE_SIZE = int(os.getenv('JSON_CACHE_SIZE', '4096'))
+
+
+@lru_cache(maxsize=JSON_CACHE_SIZE)
+def _decode_json(raw, literal_fallback):
+    try:
+        with tracing.span('json.decode'):
+            return json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        if literal_fallback:
+            # 兼容旧数据（只能解析字面量），迁移 9 已将库中的旧数据转换为 JSON
+            try:
+                return ast.literal_eval(raw)
+            except Exception:
+                pass
+        return None
+
+
+def _copy_json(value):
+    """复制解析结果中的字典与列表（其余 JSON 值不可变，直接共享）"""
+    if isinstance(value, dict):
+        return {key: _copy_json(item) for key, item in value.items()}
+    if isinstance(value, (list, set)):
+        return type(value)(_copy_json(item) for item in value)
+    return value
+
+
+def decode_json(raw, literal_fallback=False):
+    """
+    解析 JSON 文本列，空值或格式错误时返回 None
+
+    解析结果按原始文本缓存，每次返回新的副本，调用方可以自由修改
+    """
+    if not raw:
+        return None
+    return _copy_json(_decode_json(raw, literal_fallback))
+
+# 密码哈希：格式为 pbkdf2_sha256$迭代次数$盐值$哈希，迭代次数调整后用户下次登录时自动按新参数重新哈希
+PASSWORD_HASH_ALGORITHM = 'pbkdf2_sha256'
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '100000'))
+# 旧版本只保存哈希值（盐值在 salt 列），固定为 100000 次迭代
+LEGACY_PASSWORD_ITERATIONS = 100000
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), iterations).hex()
+
+
+def hash_password(password, iterations=None):
+    """生成带算法与参数的密码哈希（CPU 密集，登录注册接口中通过 auth 的密码线程池调用）"""
+    iterations = iterations or PASSWORD_HASH_ITERATIONS
+    salt = secrets.token_hex(16)
+    return f"{PASSWORD_HASH_ALGORITHM}${iterations}${salt}${_pbkdf2(password, salt, iterations)}"
+
+
+def verify_password(password, encoded, legacy_salt=None):
+    """校验密码（常量时间比较），兼容旧版本只保存哈希值的格式"""
+    if not encoded:
+        return False
+    parts = encoded.split('$')
+    if len(parts) == 4 and parts[0] == PASSWORD_HASH_ALGORITHM:
+        _, iterations, salt, expected = parts
+        computed = _pbkdf2(password, salt, int(iterations))
+    elif legacy_salt:
+        expected = encoded
+        computed = _pbkdf2(password, legacy_salt, LEGACY_PASSWORD_ITERATIONS)
+    else:
+        return False
+    return hmac.compare_digest(computed, expected)
+
+
+def password_needs_rehash(encoded):
+    """旧格式或迭代次数与当前配置不同的哈希需要在登录成功后重新生成"""
+    parts = (encoded or '').split('$')
+    return len(parts) != 4 or parts[0] != PASSWORD_HASH_ALGORITHM or parts[1] != str(PASSWORD_HASH_ITERATIONS)
+
+
 # 定义通知渠道枚举
 class NotifyChannel(enum.Enum):
     """通知渠道枚举"""
@@ -69,12 +153,16 @@ class User(Base):
 
     def set_password(self, password):
         """设置密码"""
-        self.salt = secrets.token_hex(16)
-        self.password_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), self.salt.encode('utf-8'), 100000).hex()
+        self.set_password_hash(hash_password(password))
+
+    def set_password_hash(self, encoded):
+        """保存 hash_password() 生成的哈希（salt 列同步保存盐值，兼容旧版本）"""
+        self.password_hash = encoded
+        self.salt = encoded.split('$')[2]
 
     def check_password(self, password):
         """验证密码"""
-        return self.password_hash == hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), self.salt.encode('utf-8'), 100000).hex()
+        return verify_password(password, self.password_hash, self.salt)
 
     def to_dict(self):
         """转换为字典"""
@@ -95,7 +183,7 @@ class ExternalCalendar(Base):
     __tablename__ = 'external_calendars'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, comment="用户ID")
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True, comment="用户ID")
     name = Column(String(100), nullable=False, comment="日历名称")
     url = Column(String(500), nullable=False, comment="ICS链接")
     channel_id = Column(Integer, ForeignKey('user_channels.id'), nullable=True, comment="默认通知渠道")
@@ -124,7 +212,7 @@ class UserChannel(Base):
     __tablename__ = 'user_channels'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, comment="用户ID")
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True, comment="用户ID")
     channel_name = Column(String(100), nullable=False, comment="渠道名称")
     channel_type = Column(Enum(NotifyChannel), nullable=False, comment="渠道类型")
     channel_config = Column(Text, nullable=False, comment="渠道配置（JSON）")
@@ -137,23 +225,18 @@ class UserChannel(Base):
     # 关联关系
     user = relationship("User", back_populates="notify_channels")
 
+    @property
+    def parsed_channel_config(self):
+        """解析后的渠道配置"""
+        return decode_json(self.channel_config, literal_fallback=True)
+
     def to_dict(self):
         """转换为字典"""
-        # 安全解析 channel_config
-        try:
-            config = json.loads(self.channel_config) if self.channel_config else {}
-        except (json.JSONDecodeError, TypeError):
-            # 如果解析失败，尝试使用 ast.literal_eval（兼容旧数据，但只能解析字面量）
-            try:
-                config = ast.literal_eval(self.channel_config) if self.channel_config else {}
-            except:
-                config = {}
-
         return {
             'id': self.id,
             'channel_name': self.channel_name,
             'channel_type': self.channel_type.value if hasattr(self.channel_type, 'value') else str(self.channel_type),
-            'channel_config': config,
+            'channel_config': self.parsed_channel_config or {},
             'is_default': self.is_default,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
@@ -185,7 +268,7 @@ class NotifyTask(Base):
 
     # 时间戳
     created_at = Column(DateTime, default=datetime.now, comment="创建时间")
-    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, comment="更新时间")
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, index=True, comment="更新时间")
 
     # 是否重复任务
     is_recurring = Column(Boolean, default=False, comment="是否重复任务")
@@ -195,33 +278,40 @@ class NotifyTask(Base):
     # 关联关系
     user = relationship("User", back_populates="notify_tasks")
 
+    __table_args__ = (
+        # 调度窗口扫描：按状态 + 计划时间范围查询即将到期的任务
+        Index('ix_notify_tasks_status_scheduled_time', 'status', 'scheduled_time'),
+        # 任务列表、日历订阅：按用户（+ 状态）过滤并按计划时间排序
+        Index('ix_notify_tasks_user_status_scheduled_time', 'user_id', 'status', 'scheduled_time'),
+        # 任务列表游标分页：按用户过滤，按 (排序字段, id) 定位与排序
+        Index('ix_notify_tasks_user_scheduled_time_id', 'user_id', 'scheduled_time', 'id'),
+        Index('ix_notify_tasks_user_created_at_id', 'user_id', 'created_at', 'id'),
+        # 任务增量同步：按用户查询 updated_at 之后的变更
+        Index('ix_notify_tasks_user_updated_at_id', 'user_id', 'updated_at', 'id'),
+        # 外部日历同步：按事件 UID 查找，同一事件只对应一个任务
+        Index('ux_notify_tasks_external_uid', 'external_uid', unique=True),
+    )
+
+    # 解析后的 JSON 列（按原始文本缓存解析，每次返回副本）
+    @property
+    def parsed_channel_config(self):
+        return decode_json(self.channel_config, literal_fallback=True)
+
+    @property
+    def parsed_channels(self):
+        return decode_json(self.channels_json)
+
+    @property
+    def parsed_channels_config(self):
+        return decode_json(self.channels_config_json)
+
+    @property
+    def parsed_send_results(self):
+        return decode_json(self.send_results)
+
     def to_dict(self):
         """转换为字典"""
-        # 安全解析 channel_config
-        try:
-            channel_config = json.loads(self.channel_config) if self.channel_config else {}
-        except (json.JSONDecodeError, TypeError):
-            # 如果解析失败，尝试使用 ast.literal_eval（兼容旧数据，但只能解析字面量）
-            try:
-                channel_config = ast.literal_eval(self.channel_config) if self.channel_config else {}
-            except:
-                channel_config = {}
-        
-        # 安全解析多渠道字段
-        try:
-            channels = json.loads(self.channels_json) if self.channels_json else None
-        except (json.JSONDecodeError, TypeError):
-            channels = None
-        
-        try:
-            channels_config = json.loads(self.channels_config_json) if self.channels_config_json else None
-        except (json.JSONDecodeError, TypeError):
-            channels_config = None
-        
-        try:
-            send_results = json.loads(self.send_results) if self.send_results else None
-        except (json.JSONDecodeError, TypeError):
-            send_results = None
+        channels = self.parsed_channels
 
         result = {
             'id': self.id,
@@ -233,118 +323,229 @@ class NotifyTask(Base):
             'sent_time': self.sent_time.isoformat() if self.sent_time else None,
             'error_msg': self.error_msg,
             'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'is_recurring': self.is_recurring,
             'cron_expression': self.cron_expression,
-            'channel_config': channel_config,
+            'channel_config': self.parsed_channel_config or {},
             'external_uid': self.external_uid
         }
         
         # 添加多渠道字段（如果存在）
         if channels:
             result['channels'] = channels
-            result['channels_config'] = channels_config
-            result['send_results'] = send_results
+            result['channels_config'] = self.parsed_channels_config
+            result['send_results'] = self.parsed_send_results
         
         return result
 
 
+class SchedulerLease(Base):
+    """调度器主节点租约（多进程选主，只有持有租约的进程负责调度与发送）"""
+    __tablename__ = 'scheduler_leases'
+
+    name = Column(String(50), primary_key=True, comment="租约名称")
+    holder = Column(String(100), nullable=True, comment="当前持有者标识")
+    expires_at = Column(DateTime, nullable=True, comment="租约过期时间")
+
+
+class SchedulerSignal(Base):
+    """Web 进程发给调度主节点的信号（任务变更、日历同步请求等）"""
+    __tablename__ = 'scheduler_signals'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    action = Column(String(30), nullable=False, comment="信号类型")
+    target_id = Column(Integer, nullable=False, comment="目标ID（任务ID或日历ID）")
+    created_at = Column(DateTime, default=datetime.now, comment="创建时间")
+
+
+class SchedulerCheckpoint(Base):
+    """调度器检查点（记录已同步到作业存储的 notify_tasks.updated_at 水位）"""
+    __tablename__ = 'scheduler_checkpoints'
+
+    name = Column(String(50), primary_key=True, comment="检查点名称")
+    watermark = Column(DateTime, nullable=False, comment="水位时间")
+
+
+class SchedulerEvent(Base):
+    """调度主节点产生的前端事件，由各 Web 进程拉取后推送给 SSE 连接"""
+    __tablename__ = 'scheduler_events'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False, comment="用户ID")
+    payload = Column(Text, nullable=False, comment="事件内容（JSON）")
+    created_at = Column(DateTime, default=datetime.now, comment="创建时间")
+
+
+class DeliveryRetry(Base):
+    """渠道发送重试状态（每个任务渠道一行，记录已尝试次数与下次重试时间）"""
+    __tablename__ = 'delivery_retries'
+    __table_args__ = (
+        Index('ix_delivery_retries_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, nullable=False, index=True, comment="任务ID")
+    channel = Column(String(50), nullable=False, comment="通知渠道")
+    attempt = Column(Integer, nullable=False, default=1, comment="已尝试次数")
+    status = Column(String(20), nullable=False, default='pending', comment="状态：pending/succeeded/exhausted/cancelled")
+    next_attempt_at = Column(DateTime, nullable=True, comment="下次重试时间")
+    last_error = Column(Text, nullable=True, comment="最近一次错误信息")
+    # 登记重试时任务的计划时间与渠道配置摘要，任务改期或修改配置后重试作废
+    task_scheduled_time = Column(DateTime, nullable=True, comment="登记时任务的计划时间")
+    config_digest = Column(String(64), nullable=True, comment="登记时渠道配置的摘要")
+    created_at = Column(DateTime, default=datetime.now, comment="创建时间")
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, comment="更新时间")
+
+
+class TaskDelivery(Base):
+    """渠道投递记录（每个任务、渠道、尝试次数一行，只追加不修改）"""
+    __tablename__ = 'task_deliveries'
+    __table_args__ = (
+        # 单个任务的投递历史（按 id 倒序分页）
+        Index('ix_task_deliveries_task_id_id', 'task_id', 'id'),
+        # 按用户统计一段时间内各渠道的成功/失败数（覆盖索引，无需回表）
+        Index('ix_task_deliveries_user_created_at_channel_status', 'user_id', 'created_at', 'channel', 'status'),
+        # 全局统计一段时间内各渠道的失败数
+        Index('ix_task_deliveries_status_created_at_channel', 'status', 'created_at', 'channel'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, nullable=False, comment="任务ID")
+    user_id = Column(Integer, nullable=False, comment="用户ID")
+    channel = Column(String(50), nullable=False, comment="通知渠道")
+    attempt = Column(Integer, nullable=False, default=1, comment="第几次尝试（1 为首次发送）")
+    status = Column(String(20), nullable=False, comment="状态：sent/failed")
+    latency_ms = Column(Integer, nullable=True, comment="发送耗时（毫秒）")
+    http_code = Column(Integer, nullable=True, comment="HTTP 状态码")
+    error = Column(Text, nullable=True, comment="错误信息")
+    created_at = Column(DateTime, default=datetime.now, index=True, comment="发送时间")
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'channel': self.channel,
+            'attempt': self.attempt,
+            'status': self.status,
+            'latency_ms': self.latency_ms,
+            'http_code': self.http_code,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class TaskExecution(Base):
+    """任务执行记录（每次触发一行，认领时以 running 写入，发送完成后写回结果），用于统计调度延迟与失败率"""
+    __tablename__ = 'task_executions'
+    __table_args__ = (
+        # 单个任务的执行历史（按 id 倒序分页）
+        Index('ix_task_executions_task_id_id', 'task_id', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, nullable=False, comment="任务ID")
+    user_id = Column(Integer, nullable=False, comment="用户ID")
+    fire_time = Column(DateTime, nullable=True, comment="计划触发时间")
+    started_at = Column(DateTime, nullable=False, default=datetime.now, index=True, comment="实际开始时间")
+    lag_ms = Column(Integer, nullable=True, comment="调度延迟（开始时间减去计划时间，毫秒）")
+    duration_ms = Column(Integer, nullable=True, comment="执行耗时（毫秒）")
+    status = Column(String(20), nullable=False, comment="结果：running/sent/partial/failed/deferred（全部渠道因限流延后）")
+    error = Column(Text, nullable=True, comment="错误信息")
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'fire_time': self.fire_time.isoformat() if self.fire_time else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'lag_ms': self.lag_ms,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'error': self.error,
+        }
+
+
+class TaskTombstone(Base):
+    """已删除任务的记录，供前端增量同步接口返回删除事件"""
+    __tablename__ = 'task_tombstones'
+    __table_args__ = (
+        Index('ix_task_tombstones_user_deleted_at', 'user_id', 'deleted_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, nullable=False, comment="任务ID")
+    user_id = Column(Integer, nullable=False, comment="用户ID")
+    deleted_at = Column(DateTime, default=datetime.now, index=True, comment="删除时间")
+
+
+class SchemaMigration(Base):
+    """已应用的数据库迁移版本"""
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True, autoincrement=False, comment="迁移版本号")
+    name = Column(String(100), nullable=False, comment="迁移名称")
+    applied_at = Column(DateTime, default=datetime.now, comment="应用时间")
+
+
 # 数据库配置
 default_db_path = os.path.join(os.getenv('DATA_DIR', 'data'), 'notify_scheduler.db')
 os.makedirs(os.path.dirname(default_db_path), exist_ok=True)
 DATABASE_URL = os.getenv('DATABASE_URL', f"sqlite:///{default_db_path}")
-engine = create_engine(DATABASE_URL, echo=True)
+
+# 输出所有 SQL 语句（仅用于调试）
+SQL_ECHO = os.getenv('SQL_ECHO', 'false').lower() in ('1', 'true', 'yes')
+# 连接池：Web 请求线程、调度线程与发送线程共用
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+# SQLite 参数：WAL 模式下读写互不阻塞，NORMAL 同步级别在 WAL 下仍能保证数据库不损坏
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+
+def _create_engine(url):
+    """按数据库类型创建引擎"""
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(
+            url, echo=SQL_ECHO, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=True
+        )
+    if url.database in (None, '', ':memory:'):
+        # 内存数据库只能使用单连接池
+        return create_engine(url, echo=SQL_ECHO)
+
+    sqlite_engine = create_engine(
+        url, echo=SQL_ECHO, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+        connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    )
+
+    @event.listens_for(sqlite_engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.close()
+
+    return sqlite_engine
+
+
+engine = _create_engine(DATABASE_URL)
+tracing.instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
 def init_db():
-    """初始化数据库"""
+    """初始化数据库：创建缺失的表并执行尚未应用的迁移（见 migrations.py）"""
+    from migrations import run_migrations
+
     Base.metadata.create_all(bind=engine)
-    
-    # 简单的自动迁移逻辑：检查并添加新字段
     try:
-        with engine.connect() as conn:
-            # 1. 检查 users.calendar_token
-            try:
-                conn.execute(text("SELECT calendar_token FROM users LIMIT 1"))
-            except Exception:
-                print("Migrating: Adding calendar_token to users table...")
-                conn.execute(text("ALTER TABLE users ADD COLUMN calendar_token VARCHAR(64)"))
-                conn.commit()
-                
-            # 2. 检查 notify_tasks.external_uid
-            try:
-                conn.execute(text("SELECT external_uid FROM notify_tasks LIMIT 1"))
-            except Exception:
-                print("Migrating: Adding external_uid to notify_tasks table...")
-                conn.execute(text("ALTER TABLE notify_tasks ADD COLUMN external_uid VARCHAR(255)"))
-                conn.commit()
-            
-            # 3. 检查 notify_tasks.channels_json（多渠道支持）
-            try:
-                conn.execute(text("SELECT channels_json FROM notify_tasks LIMIT 1"))
-            except Exception:
-                print("Migrating: Adding multi-channel support fields to notify_tasks table...")
-                conn.execute(text("ALTER TABLE notify_tasks ADD COLUMN channels_json TEXT"))
-                conn.execute(text("ALTER TABLE notify_tasks ADD COLUMN channels_config_json TEXT"))
-                conn.execute(text("ALTER TABLE notify_tasks ADD COLUMN send_results TEXT"))
-                conn.commit()
-            
-            # 4. 移除 channel 和 channel_config 的 NOT NULL 约束（多渠道模式需要）
-            # SQLite 不支持直接修改列约束，需要重建表
-            try:
-                # 检查是否已经迁移（通过尝试插入 channel=NULL 的记录）
-                result = conn.execute(text("SELECT sql FROM sqlite_master WHERE type='table' AND name='notify_tasks'"))
-                table_schema = result.fetchone()[0]
-                
-                # 如果表结构中 channel 字段仍有 NOT NULL 约束
-                if 'channel' in table_schema and 'channel TEXT NOT NULL' in table_schema:
-                    print("Migrating: Removing NOT NULL constraint from channel and channel_config...")
-                    
-                    # 创建临时表
-                    conn.execute(text("""
-                        CREATE TABLE notify_tasks_new (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            user_id INTEGER NOT NULL,
-                            title VARCHAR(200) NOT NULL,
-                            content TEXT NOT NULL,
-                            channel TEXT,
-                            scheduled_time DATETIME NOT NULL,
-                            channel_config TEXT,
-                            channels_json TEXT,
-                            channels_config_json TEXT,
-                            send_results TEXT,
-                            status TEXT DEFAULT 'pending',
-                            sent_time DATETIME,
-                            error_msg TEXT,
-                            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                            is_recurring BOOLEAN DEFAULT 0,
-                            cron_expression VARCHAR(100),
-                            external_uid VARCHAR(255),
-                            FOREIGN KEY (user_id) REFERENCES users(id)
-                        )
-                    """))
-                    
-                    # 复制数据
-                    conn.execute(text("""
-                        INSERT INTO notify_tasks_new 
-                        SELECT id, user_id, title, content, channel, scheduled_time, 
-                               channel_config, channels_json, channels_config_json, send_results,
-                               status, sent_time, error_msg, created_at, updated_at, 
-                               is_recurring, cron_expression, external_uid
-                        FROM notify_tasks
-                    """))
-                    
-                    # 删除旧表
-                    conn.execute(text("DROP TABLE notify_tasks"))
-                    
-                    # 重命名新表
-                    conn.execute(text("ALTER TABLE notify_tasks_new RENAME TO notify_tasks"))
-                    
-                    conn.commit()
-                    print("Migration completed: channel and channel_config are now nullable")
-            except Exception as e:
-                print(f"Channel nullable migration info: {e}")
+        run_migrations(engine)
     except Exception as e:
         print(f"Migration warning: {e}")
 
@@ -352,8 +553,10 @@ def init_db():
 @contextmanager
 def get_db():
     """获取数据库会话（上下文管理器）"""
+    started = time.perf_counter()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+        DB_SESSION_DURATION.observe(time.perf_counter() - started)
@@ -1,29 +1,149 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from apscheduler.events import EVENT_JOB_MISSED
+from apscheduler.executors.pool import ThreadPoolExecutor as JobExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.cron import CronTrigger
-from models import NotifyTask, NotifyStatus, ExternalCalendar, UserChannel, get_db
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from sqlalchemy import and_, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from models import (
+    NotifyTask, NotifyChannel, NotifyStatus, ExternalCalendar, UserChannel, SchedulerLease, SchedulerSignal, SchedulerEvent,
+    SchedulerCheckpoint, DeliveryRetry, TaskDelivery, TaskExecution, TaskTombstone, engine, get_db
+)
 from notifier import NotificationSender, parse_config
+from delivery import DeliveryError, DeliveryThrottled, delivery_engine
+import tracing
+from metrics import DELIVERY_QUEUED, JOBSTORE_JOBS, SCHEDULE_LAG, SCHEDULER_LEADER, SSE_LISTENERS, TASK_EXECUTIONS
+import atexit
+import hashlib
+import json
 import logging
+import os
 import queue
+import random
 import requests
 import re
+import socket
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 选主租约有效期（秒），主节点每隔 1/3 有效期续约一次
+SCHEDULER_LEASE_TTL = int(os.getenv('SCHEDULER_LEASE_TTL', '30'))
+# 主节点处理 Web 进程信号的间隔（秒）
+SCHEDULER_SIGNAL_INTERVAL = float(os.getenv('SCHEDULER_SIGNAL_INTERVAL', '2'))
+# 调度窗口（分钟）：只有计划时间在窗口内的一次性任务才注册到内存，窗口外的留在数据库中
+SCHEDULER_HORIZON_MINUTES = int(os.getenv('SCHEDULER_HORIZON_MINUTES', '60'))
+# 调度窗口扫描间隔（秒），需远小于调度窗口
+SCHEDULER_SWEEP_SECONDS = int(os.getenv('SCHEDULER_SWEEP_SECONDS', '60'))
+# 错过执行时间后仍允许执行的宽限时间（秒），需大于发送任务占用调度线程的最长时间
+MISFIRE_GRACE_SECONDS = int(os.getenv('MISFIRE_GRACE_SECONDS', '300'))
+# 执行任务作业的调度线程数；信号处理、窗口扫描与重试队列使用单独的线程，不会被发送任务占满
+SCHEDULER_THREADS = int(os.getenv('SCHEDULER_THREADS', '20'))
+SCHEDULER_INTERNAL_THREADS = 4
+# 认领任务时允许计划时间晚于当前时间的秒数（调度触发与数据库时间的误差）
+CLAIM_TOLERANCE_SECONDS = 5
+# 是否通过数据库租约选主；仅 PostgreSQL 可关闭，此时所有调度进程同时调度，由行锁认领避免重复发送
+SCHEDULER_LEADER_ELECTION = os.getenv('SCHEDULER_LEADER_ELECTION', 'true').lower() not in ('0', 'false', 'no')
+# 重复任务作业存储：sqlalchemy（默认，持久化到数据库）或 memory
+SCHEDULER_JOBSTORE = os.getenv('SCHEDULER_JOBSTORE', 'sqlalchemy')
+# 启动同步时每批处理的任务数，以及检查点回退的秒数
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '1000'))
+RECONCILE_OVERLAP_SECONDS = 5
+# 发送线程池大小，以及多渠道任务中单个渠道的发送超时（秒，不含限流排队时间）
+SENDER_POOL_SIZE = int(os.getenv('SENDER_POOL_SIZE', '16'))
+SEND_TIMEOUT = float(os.getenv('SEND_TIMEOUT', '30'))
+# 发送截止后等待发送线程返回取消结果的秒数
+SEND_CANCEL_GRACE = 5
+# 调度发送遇到限流时最多排队等待的秒数；预计等待更久的渠道登记为延后重试（不计入尝试次数），
+# 由重试队列在配额恢复后发送，不占用调度线程
+THROTTLE_DEFER_SECONDS = float(os.getenv('THROTTLE_DEFER_SECONDS', '5'))
+# 发送认领的有效期（秒）：认领后超过该时间仍未写回结果的任务或重试视为进程已中断，可再次认领
+SEND_CLAIM_SECONDS = SEND_TIMEOUT + THROTTLE_DEFER_SECONDS + SEND_CANCEL_GRACE + 60
+# 渠道发送失败后的最大尝试次数（含首次发送）、重试退避基数与上限（秒）、重试队列扫描间隔（秒）
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '4'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '30'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '3600'))
+RETRY_POLL_SECONDS = int(os.getenv('RETRY_POLL_SECONDS', '10'))
+# 已结束的重试记录、已删除任务记录的保留天数
+RETRY_RETENTION_DAYS = 7
+TOMBSTONE_RETENTION_DAYS = 7
+# 渠道投递记录、任务执行记录的保留天数，以及清理时每批删除的行数
+DELIVERY_RETENTION_DAYS = int(os.getenv('DELIVERY_RETENTION_DAYS', '30'))
+EXECUTION_RETENTION_DAYS = int(os.getenv('EXECUTION_RETENTION_DAYS', '30'))
+PRUNE_BATCH_SIZE = 5000
+# SSE 事件拉取间隔（秒）与事件保留时间（秒）
+EVENT_POLL_INTERVAL = float(os.getenv('EVENT_POLL_INTERVAL', '2'))
+EVENT_RETENTION_SECONDS = int(os.getenv('EVENT_RETENTION_SECONDS', '300'))
+
 
 class EventManager:
+    """
+    前端事件分发
+
+    事件由调度主节点写入 scheduler_events 表，各进程在 SSE 连接中调用 poll()
+    拉取新事件并分发给本进程的监听者；同一进程内的多个连接共享一次查询。
+    """
+
     def __init__(self):
         # listeners: list of (queue, user_id)
         self.listeners = []
+        self._poll_lock = threading.Lock()
+        self._last_event_id = None
+        self._last_poll = 0.0
 
     def listen(self, user_id):
         q = queue.Queue(maxsize=10)
         self.listeners.append((q, user_id))
+        if self._last_event_id is None:
+            # 首次监听时从最新事件开始，避免回放历史事件
+            with get_db() as db:
+                self._last_event_id = db.query(func.max(SchedulerEvent.id)).scalar() or 0
         return q
 
+    def unlisten(self, q):
+        self.listeners = [(lq, uid) for lq, uid in self.listeners if lq is not q]
+
     def announce(self, user_id, msg):
+        """发布事件（写入事件表，由各进程的 poll 转发）"""
+        try:
+            with get_db() as db:
+                db.add(SchedulerEvent(user_id=user_id, payload=json.dumps(msg, ensure_ascii=False)))
+                db.commit()
+        except Exception as e:
+            logger.warning(f"发布事件失败: {str(e)}")
+
+    def poll(self):
+        """拉取新事件并分发给本进程的监听者（限频，多个连接共享）"""
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if now - self._last_poll < EVENT_POLL_INTERVAL or self._last_event_id is None:
+                return
+            self._last_poll = now
+            with get_db() as db:
+                rows = db.query(SchedulerEvent).filter(
+                    SchedulerEvent.id > self._last_event_id
+                ).order_by(SchedulerEvent.id).limit(500).all()
+                events = [(row.id, row.user_id, row.payload) for row in rows]
+            for event_id, user_id, payload in events:
+                self._last_event_id = event_id
+                self._dispatch(user_id, json.loads(payload))
+        except Exception as e:
+            logger.warning(f"拉取事件失败: {str(e)}")
+        finally:
+            self._poll_lock.release()
+
+    def _dispatch(self, user_id, msg):
         for i in range(len(self.listeners) - 1, -1, -1):
             q, uid = self.listeners[i]
             if uid == user_id:
@@ -32,9 +152,80 @@ class EventManager:
                 except queue.Full:
                     del self.listeners[i]
 
+    def prune(self):
+        """清理过期事件"""
+        cutoff = datetime.now() - timedelta(seconds=EVENT_RETENTION_SECONDS)
+        with get_db() as db:
+            db.query(SchedulerEvent).filter(SchedulerEvent.created_at < cutoff).delete(synchronize_session=False)
+            db.commit()
+
 event_manager = EventManager()
 
 
+class LeaderLease:
+    """基于数据库租约行的选主：租约过期后其他进程才能接管"""
+
+    def __init__(self, name='notify_scheduler', ttl=SCHEDULER_LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def try_acquire(self):
+        """
+        获取或续约租约
+
+        Returns:
+            True 持有租约；False 租约被其他进程持有；None 数据库异常（状态未知）
+        """
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.ttl)
+        with get_db() as db:
+            try:
+                updated = db.query(SchedulerLease).filter(
+                    SchedulerLease.name == self.name,
+                    or_(
+                        SchedulerLease.holder == self.holder,
+                        SchedulerLease.holder.is_(None),
+                        SchedulerLease.expires_at < now
+                    )
+                ).update({'holder': self.holder, 'expires_at': expires_at}, synchronize_session=False)
+                if not updated:
+                    if db.query(SchedulerLease.name).filter(SchedulerLease.name == self.name).first():
+                        db.rollback()
+                        return False
+                    db.add(SchedulerLease(name=self.name, holder=self.holder, expires_at=expires_at))
+                db.commit()
+                return True
+            except IntegrityError:
+                # 其他进程同时插入了租约行
+                db.rollback()
+                return False
+            except Exception as e:
+                logger.warning(f"续约调度器租约失败: {str(e)}")
+                db.rollback()
+                return None
+
+    def release(self):
+        """主动释放租约，便于其他进程立即接管"""
+        try:
+            with get_db() as db:
+                db.query(SchedulerLease).filter(
+                    SchedulerLease.name == self.name,
+                    SchedulerLease.holder == self.holder
+                ).update({'holder': None, 'expires_at': None}, synchronize_session=False)
+                db.commit()
+        except Exception as e:
+            logger.warning(f"释放调度器租约失败: {str(e)}")
+
+    def current_holder(self):
+        """返回当前租约持有者及过期时间"""
+        with get_db() as db:
+            lease = db.query(SchedulerLease).filter(SchedulerLease.name == self.name).first()
+            if not lease or not lease.holder or (lease.expires_at and lease.expires_at < datetime.now()):
+                return None, None
+            return lease.holder, lease.expires_at
+
+
 def get_cron_trigger(expression):
     """根据 cron 表达式获取触发器，支持 5 位 (分时日月周) 和 6 位 (秒分时日月周)"""
     values = expression.strip().split()
@@ -51,20 +242,255 @@ def get_cron_trigger(expression):
 
 
 class NotifyScheduler:
-    """通知调度器"""
+    """
+    通知调度器
+
+    多进程部署时（如 Gunicorn 多 worker），各进程通过数据库租约选出唯一的主节点，
+    只有主节点运行 APScheduler 并发送通知；其他进程对任务的增删改通过
+    scheduler_signals 表通知主节点。
+    """
     
     def __init__(self):
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.start()
-        logger.info("通知调度器已启动")
-    
+        jobstores = {
+            # 内部作业（信号处理、日历同步）只存在内存中
+            'volatile': MemoryJobStore()
+        }
+        if SCHEDULER_JOBSTORE == 'sqlalchemy':
+            # 任务作业持久化到数据库，重启后无需重新加载
+            jobstores['default'] = SQLAlchemyJobStore(engine=engine, tablename='apscheduler_jobs')
+        else:
+            jobstores['default'] = MemoryJobStore()
+        self.jobstores = jobstores
+        executors = {
+            'default': JobExecutor(SCHEDULER_THREADS),
+            'internal': JobExecutor(SCHEDULER_INTERNAL_THREADS)
+        }
+        self.scheduler = BackgroundScheduler(jobstores=jobstores, executors=executors)
+        self.scheduler.add_listener(self._on_job_missed, EVENT_JOB_MISSED)
+        self.lease = LeaderLease()
+        self.is_leader = False
+        self._lease_deadline = 0.0
+        self._stop_event = threading.Event()
+        self._election_thread = None
+        self._last_event_prune = 0.0
+        # 多渠道任务的发送线程池（线程在首次提交时才创建）
+        self.sender_pool = ThreadPoolExecutor(max_workers=SENDER_POOL_SIZE, thread_name_prefix='sender')
+
+    def start(self):
+        """启动选主循环，成为主节点后才加载任务并开始调度"""
+        if self._election_thread or self.is_leader:
+            return
+        if not SCHEDULER_LEADER_ELECTION and engine.dialect.name == 'postgresql':
+            # 多节点同时调度：每个节点各自装载任务，执行时通过行锁认领
+            self._promote(confirm_lease=False)
+            atexit.register(self.shutdown)
+            logger.info(f"通知调度器已启动 (节点: {self.lease.holder}, 未启用选主)")
+            return
+        if not SCHEDULER_LEADER_ELECTION:
+            logger.warning("仅 PostgreSQL 支持关闭选主，继续使用租约选主")
+        self._try_lead()
+        self._election_thread = threading.Thread(
+            target=self._election_loop, name='scheduler-election', daemon=True
+        )
+        self._election_thread.start()
+        atexit.register(self.shutdown)
+        logger.info(f"通知调度器已启动 (节点: {self.lease.holder}, 主节点: {self.is_leader})")
+
+    def _election_loop(self):
+        while not self._stop_event.wait(max(self.lease.ttl / 3, 1)):
+            self._try_lead()
+
+    def _try_lead(self):
+        acquired = self.lease.try_acquire()
+        if acquired:
+            self._lease_deadline = time.monotonic() + self.lease.ttl
+            if not self.is_leader:
+                self._promote()
+        elif self.is_leader and (acquired is False or time.monotonic() >= self._lease_deadline):
+            # 租约已被接管，或续约失败且租约已过期
+            self._demote()
+
+    def _promote(self, confirm_lease=True):
+        """
+        成为调度主节点
+
+        先在暂停状态下装载作业，装载完成后再次续约确认仍持有租约才开始执行；
+        装载耗时超过租约有效期时，租约可能已被其他进程接管，此时放弃成为主节点。
+        """
+        logger.info(f"当前进程获得调度租约，开始装载任务: {self.lease.holder}")
+        if not self.scheduler.running:
+            self.scheduler.start(paused=True)
+        self.load_pending_tasks()
+        self.add_external_calendar_sync_job()
+        self.scheduler.add_job(
+            self._sweep_horizon,
+            'interval',
+            seconds=SCHEDULER_SWEEP_SECONDS,
+            id='sweep_horizon',
+            jobstore='volatile',
+            executor='internal',
+            next_run_time=datetime.now(),
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        self.scheduler.add_job(
+            self._process_signals,
+            'interval',
+            seconds=SCHEDULER_SIGNAL_INTERVAL,
+            id='process_signals',
+            jobstore='volatile',
+            executor='internal',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        self.scheduler.add_job(
+            self._process_retries,
+            'interval',
+            seconds=RETRY_POLL_SECONDS,
+            id='process_retries',
+            jobstore='volatile',
+            executor='internal',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+
+        if confirm_lease:
+            if not self.lease.try_acquire():
+                logger.warning(f"装载任务期间调度租约已失效，放弃成为主节点: {self.lease.holder}")
+                self._demote()
+                return
+            self._lease_deadline = time.monotonic() + self.lease.ttl
+        self.is_leader = True
+        self.scheduler.resume()
+        logger.info(f"当前进程成为调度主节点: {self.lease.holder}")
+
+    def _demote(self):
+        logger.warning(f"当前进程失去调度主节点身份: {self.lease.holder}")
+        self.is_leader = False
+        self.scheduler.pause()
+        # 持久化的重复任务作业由新的主节点接管，这里只清理内存中的作业（窗口内任务由新主节点重新装载）
+        self.scheduler.remove_all_jobs(jobstore='volatile')
+        if SCHEDULER_JOBSTORE != 'sqlalchemy':
+            self.scheduler.remove_all_jobs()
+
+    def _on_job_missed(self, event):
+        """
+        作业错过执行宽限时间：APScheduler 不再执行该次触发
+
+        一次性任务不会再被触发，标记为失败，避免一直停留在待发送状态
+        """
+        logger.warning(f"作业 {event.job_id} 错过计划执行时间 {event.scheduled_run_time}")
+        if not event.job_id.startswith('task_'):
+            return
+        task_id = int(event.job_id[len('task_'):])
+        error = f"错过计划执行时间（调度延迟超过 {MISFIRE_GRACE_SECONDS} 秒）"
+        try:
+            with get_db() as db:
+                task = db.query(NotifyTask.scheduled_time).filter(NotifyTask.id == task_id).first()
+                if task and self._deferred(db, task_id, task.scheduled_time):
+                    # 已因限流延后，由重试队列发送
+                    return
+                updated = db.query(NotifyTask).filter(
+                    NotifyTask.id == task_id,
+                    NotifyTask.status == NotifyStatus.PENDING
+                ).update({'status': NotifyStatus.FAILED, 'error_msg': error}, synchronize_session=False)
+                db.commit()
+                if not updated:
+                    return
+                user_id, title = db.query(NotifyTask.user_id, NotifyTask.title).filter(NotifyTask.id == task_id).one()
+            event_manager.announce(user_id, {
+                'type': 'task_executed',
+                'task_id': task_id,
+                'title': title,
+                'status': 'failed',
+                'message': error
+            })
+        except Exception as e:
+            logger.error(f"标记任务 {task_id} 错过执行失败: {str(e)}")
+
+    def _signal(self, action, target_id):
+        """向主节点发送信号"""
+        try:
+            with get_db() as db:
+                db.add(SchedulerSignal(action=action, target_id=target_id))
+                db.commit()
+        except Exception as e:
+            logger.error(f"发送调度信号 {action}:{target_id} 失败: {str(e)}")
+
+    def _process_signals(self):
+        """主节点处理其他进程发来的信号"""
+        with get_db() as db:
+            signals = db.query(SchedulerSignal).order_by(SchedulerSignal.id).limit(500).all()
+            task_ids = list(dict.fromkeys(s.target_id for s in signals if s.action == 'task'))
+            cal_ids = list(dict.fromkeys(s.target_id for s in signals if s.action == 'calendar_sync'))
+            if signals:
+                db.query(SchedulerSignal).filter(
+                    SchedulerSignal.id <= signals[-1].id
+                ).delete(synchronize_session=False)
+                db.commit()
+
+        for task_id in task_ids:
+            self.sync_task(task_id)
+        for cal_id in cal_ids:
+            self.request_calendar_sync(cal_id)
+
+        if time.monotonic() - self._last_event_prune > 60:
+            self._last_event_prune = time.monotonic()
+            event_manager.prune()
+            self._prune_retries()
+            self._prune_tombstones()
+            self._prune_history(TaskDelivery, TaskDelivery.created_at, DELIVERY_RETENTION_DAYS, '投递记录')
+            self._prune_history(TaskExecution, TaskExecution.started_at, EXECUTION_RETENTION_DAYS, '执行记录')
+            # 此前的任务变更均已通过信号同步到作业存储，推进检查点
+            self._save_watermark(datetime.now())
+            stats = delivery_engine.queue_stats()
+            if stats['queued']:
+                logger.info(f"限流排队中的消息: {stats['queued']} {stats['channels']}")
+
     def add_task(self, task: NotifyTask):
         """
-        添加通知任务到调度器
+        添加通知任务到调度器（非主节点时通知主节点）
         
         Args:
             task: 通知任务对象
         """
+        if self.is_leader:
+            self._schedule_task(task)
+        else:
+            self._signal('task', task.id)
+
+    def add_tasks(self, tasks):
+        """
+        批量添加通知任务（如导入后），非主节点时在一个事务中写入信号
+
+        Args:
+            tasks: 任务对象，或包含 id、is_recurring、cron_expression、scheduled_time 的查询结果行
+        """
+        if self.is_leader:
+            for task in tasks:
+                self._schedule_task(task)
+            return
+
+        # 调度窗口外的一次性任务由主节点的 _sweep_horizon 装载，无需通知
+        horizon = datetime.now() + timedelta(minutes=SCHEDULER_HORIZON_MINUTES)
+        task_ids = [
+            task.id for task in tasks
+            if (task.is_recurring and task.cron_expression) or task.scheduled_time <= horizon
+        ]
+        if not task_ids:
+            return
+        try:
+            with get_db() as db:
+                db.execute(insert(SchedulerSignal), [{'action': 'task', 'target_id': task_id} for task_id in task_ids])
+                db.commit()
+        except Exception as e:
+            logger.error(f"发送 {len(task_ids)} 个任务的调度信号失败: {str(e)}")
+
+    def _schedule_task(self, task: NotifyTask):
+        """在本进程的 APScheduler 中注册任务"""
         if task.is_recurring and task.cron_expression:
             # 重复任务，使用 cron 表达式
             try:
@@ -72,275 +498,860 @@ class NotifyScheduler:
                 job_id = f"recurring_task_{task.id}"
                 
                 self.scheduler.add_job(
-                    func=self._execute_task,
+                    func=execute_task,
                     trigger=trigger,
                     args=[task.id],
                     id=job_id,
                     replace_existing=True,
-                    misfire_grace_time=60  # 错过时间窗口60秒内仍执行
+                    misfire_grace_time=MISFIRE_GRACE_SECONDS
                 )
                 logger.info(f"任务 {task.id} 已添加到调度器，计划执行时间: {task.scheduled_time}")
             except Exception as e:
                 logger.error(f"添加任务 {task.id} 失败，Cron 表达式无效: {e}")
         else:
+            # 一次性任务只在进入调度窗口后才注册，窗口外的任务留在数据库中，由 _sweep_horizon 定期装载
+            if task.scheduled_time > datetime.now() + timedelta(minutes=SCHEDULER_HORIZON_MINUTES):
+                logger.debug(f"任务 {task.id} 计划时间在调度窗口之外，稍后装载")
+                return
+
             # 一次性任务，使用指定时间
             trigger = DateTrigger(run_date=task.scheduled_time)
             job_id = f"task_{task.id}"
         
             self.scheduler.add_job(
-                func=self._execute_task,
+                func=execute_task,
                 trigger=trigger,
                 args=[task.id],
                 id=job_id,
+                jobstore='volatile',
                 replace_existing=True,
-                misfire_grace_time=60  # 错过时间窗口60秒内仍执行
+                misfire_grace_time=MISFIRE_GRACE_SECONDS
             )
             
             logger.info(f"任务 {task.id} 已添加到调度器，计划执行时间: {task.scheduled_time}")
     
     def remove_task(self, task_id: int, is_recurring: bool = False):
         """
-        从调度器中移除任务
+        从调度器中移除任务（非主节点时通知主节点）
         
         Args:
             task_id: 任务ID
             is_recurring: 是否为重复任务
         """
+        if not self.is_leader:
+            self._signal('task', task_id)
+            return
         try:
             job_id = f"recurring_task_{task_id}" if is_recurring else f"task_{task_id}"
             self.scheduler.remove_job(job_id)
             logger.info(f"任务 {task_id} 已从调度器移除")
+        except JobLookupError:
+            # 调度窗口外的一次性任务本来就没有注册作业
+            logger.debug(f"任务 {task_id} 不在调度器中，无需移除")
         except Exception as e:
             logger.warning(f"移除任务 {task_id} 失败: {str(e)}")
+
+    def sync_task(self, task_id: int):
+        """按数据库中的最新状态重新注册任务（任务已删除或非待发送时移除）"""
+        for job_id in (f"task_{task_id}", f"recurring_task_{task_id}"):
+            if self.scheduler.get_job(job_id):
+                self.scheduler.remove_job(job_id)
+        with get_db() as db:
+            task = db.query(NotifyTask).filter(NotifyTask.id == task_id).first()
+            if task and task.status == NotifyStatus.PENDING:
+                self._schedule_task(task)
+
+    def request_calendar_sync(self, cal_id: int):
+        """立即同步指定的外部日历（非主节点时通知主节点）"""
+        if not self.is_leader:
+            self._signal('calendar_sync', cal_id)
+            return
+        self.scheduler.add_job(
+            sync_single_calendar,
+            args=[cal_id],
+            id=f"sync_cal_{cal_id}_manual_{uuid.uuid4().hex[:8]}",
+            jobstore='volatile',
+            misfire_grace_time=300
+        )
     
     def _execute_task(self, task_id: int):
         """
         执行通知任务
 
+        认领（短事务，写入 running 执行记录后立即提交释放行锁）→ 在事务之外向各渠道发送 →
+        收集全部发送结果后在一个短事务中写入任务状态、投递记录与重试，发送期间不持有数据库锁
+
         Args:
             task_id: 任务ID
         """
+        started_at = datetime.now()
+        run_started = time.monotonic()
+        claim = self._claim_task(task_id, started_at, run_started)
+        if claim is None:
+            return
+
+        started = time.monotonic()
+        deadline = started + SEND_TIMEOUT + THROTTLE_DEFER_SECONDS
+        if claim['channels'] is not None:
+            # 在发送线程池中并发向各渠道发送，任务耗时取决于最慢的渠道
+            futures = [
+                (channel_str, self.sender_pool.submit(
+                    tracing.bind(self._send_channel), task_id, channel_str,
+                    claim['channels_config'].get(channel_str, {}), claim['title'], claim['content'], deadline
+                ))
+                for channel_str in claim['channels']
+            ]
+            outcomes = [(channel_str, self._wait_send(future, deadline, started)) for channel_str, future in futures]
+        else:
+            outcomes = [(claim['channel'], self._send_channel(
+                task_id, claim['channel'], claim['channel_config'], claim['title'], claim['content'], deadline
+            ))]
+
+        try:
+            event = self._save_execution(claim, outcomes, run_started)
+        except Exception as e:
+            logger.error(f"保存任务 {task_id} 的执行结果失败: {str(e)}")
+            return
+
+        # 提交后再通知前端，保证前端刷新时能读到最新状态
+        if event:
+            event_manager.announce(claim['user_id'], event)
+
+    def _claim_task(self, task_id: int, started_at: datetime, run_started: float):
+        """
+        认领任务的本次触发：锁定任务行检查状态，写入 running 执行记录后提交
+
+        Returns:
+            dict: 发送所需的任务快照；不需要执行时返回 None
+        """
         with get_db() as db:
             try:
-                # 获取任务
-                task = db.query(NotifyTask).filter(NotifyTask.id == task_id).first()
+                # 认领任务：锁定任务行做检查，其他节点跳过被锁定的任务（SQLite 不支持行锁，由选主保证单节点执行）
+                task = db.query(NotifyTask).filter(
+                    NotifyTask.id == task_id
+                ).with_for_update(skip_locked=True).first()
                 if not task:
-                    logger.error(f"任务 {task_id} 不存在")
-                    return
+                    logger.warning(f"任务 {task_id} 不存在或正由其他节点执行")
+                    return None
 
                 # 如果任务已取消，跳过执行
                 if task.status == NotifyStatus.CANCELLED:
                     logger.info(f"任务 {task_id} 已取消，跳过执行")
-                    return
+                    return None
 
                 # 检查暂停状态
                 if task.status == NotifyStatus.PAUSED:
                     logger.info(f"任务 {task_id} 已暂停，跳过执行")
-                    return
+                    return None
 
-                logger.info(f"开始执行任务 {task_id}: {task.title}")
+                # 一次性任务只执行一次（持久化作业存储中可能残留过期作业）
+                if not task.is_recurring and task.status != NotifyStatus.PENDING:
+                    logger.info(f"任务 {task_id} 状态为 {task.status}，跳过执行")
+                    return None
 
-                # 检测是多渠道还是单渠道任务
-                is_multi_channel = task.channels_json is not None
-                
-                if is_multi_channel:
-                    # 多渠道模式
-                    import json
+                # 计划时间仍在未来：任务已改期，或本次触发已由其他节点执行（重复任务已滚动到下一次）
+                if task.scheduled_time and task.scheduled_time > datetime.now() + timedelta(seconds=CLAIM_TOLERANCE_SECONDS):
+                    logger.info(f"任务 {task_id} 计划时间为 {task.scheduled_time}，跳过本次触发")
+                    return None
+
+                # 本次触发的计划时间（重复任务随后滚动到下一次）
+                fire_time = task.scheduled_time
+
+                # 一次性任务本次触发已因限流延后，由重试队列发送
+                if not task.is_recurring and self._deferred(db, task_id, fire_time):
+                    logger.info(f"任务 {task_id} 本次触发已因限流延后，由重试队列发送")
+                    return None
+
+                # 一次性任务发送期间状态仍为待发送，由 running 执行记录标记本次触发已被认领（超过认领有效期视为进程已中断）
+                if not task.is_recurring:
+                    running = db.query(TaskExecution).filter(
+                        TaskExecution.task_id == task_id,
+                        TaskExecution.fire_time == fire_time,
+                        TaskExecution.status == 'running'
+                    ).order_by(TaskExecution.id.desc()).first()
+                    if running and running.started_at >= started_at - timedelta(seconds=SEND_CLAIM_SECONDS):
+                        # 认领到期后再检查一次：发送方已写回结果则跳过，进程中断则重新发送
+                        recheck_at = running.started_at + timedelta(seconds=SEND_CLAIM_SECONDS + 1)
+                        self.scheduler.add_job(
+                            execute_task,
+                            trigger=DateTrigger(run_date=recheck_at),
+                            args=[task_id],
+                            id=f"task_{task_id}",
+                            jobstore='volatile',
+                            replace_existing=True,
+                            misfire_grace_time=MISFIRE_GRACE_SECONDS
+                        )
+                        logger.info(f"任务 {task_id} 本次触发正由其他节点发送，{recheck_at} 再检查")
+                        return None
+                    if running:
+                        running.status = 'failed'
+                        running.error = '发送进程中断，未写回结果'
+
+                # 重复任务滚动更新下一次执行时间（用于列表展示，也标记本次触发已被认领）
+                if task.is_recurring and task.cron_expression:
                     try:
-                        channels = json.loads(task.channels_json)
-                        channels_config = json.loads(task.channels_config_json)
-                    except (json.JSONDecodeError, TypeError) as e:
-                        logger.error(f"任务 {task_id} 多渠道配置解析失败: {str(e)}")
+                        next_run = get_cron_trigger(task.cron_expression).get_next_fire_time(None, datetime.now())
+                        if next_run:
+                            task.scheduled_time = next_run
+                    except Exception as e:
+                        logger.warning(f"任务 {task_id} 更新下一次执行时间失败: {str(e)}")
+
+                execution = self._start_execution(task, fire_time, started_at)
+                claim = {
+                    'id': task.id,
+                    'user_id': task.user_id,
+                    'title': task.title,
+                    'content': task.content,
+                    'fire_time': fire_time,
+                    'channels': None
+                }
+
+                # 检测是多渠道还是单渠道任务
+                if task.channels_json is not None:
+                    channels = task.parsed_channels
+                    channels_config = task.parsed_channels_config
+                    if channels is None or channels_config is None:
+                        logger.error(f"任务 {task_id} 多渠道配置解析失败")
                         task.status = NotifyStatus.FAILED
-                        task.error_msg = f"配置解析失败: {str(e)}"
+                        task.error_msg = "配置解析失败: 渠道列表或渠道配置不是有效的 JSON"
+                        db.add(self._finish_execution(execution, run_started, 'failed', task.error_msg))
                         db.commit()
-                        return
-                    
-                    send_results = {}
-                    success_count = 0
-                    fail_count = 0
-                    
-                    # 遍历所有渠道发送通知
-                    for channel_str in channels:
-                        try:
-                            from models import NotifyChannel
-                            channel = NotifyChannel(channel_str)
-                            config = parse_config(channels_config.get(channel_str, {}))
-                            
-                            logger.info(f"任务 {task_id} 向渠道 {channel_str} 发送通知")
-                            NotificationSender.send(
-                                channel=channel,
-                                config=config,
-                                title=task.title,
-                                content=task.content
-                            )
-                            
-                            send_results[channel_str] = {
-                                'status': 'sent',
-                                'message': '发送成功',
-                                'sent_time': datetime.now().isoformat()
-                            }
-                            success_count += 1
-                            logger.info(f"任务 {task_id} 渠道 {channel_str} 发送成功")
-                            
-                        except Exception as e:
-                            send_results[channel_str] = {
-                                'status': 'failed',
-                                'message': str(e),
-                                'sent_time': datetime.now().isoformat()
-                            }
-                            fail_count += 1
-                            logger.error(f"任务 {task_id} 渠道 {channel_str} 发送失败: {str(e)}")
-                    
+                        return None
+                    claim.update(channels=channels, channels_config=channels_config)
+                else:
+                    config = task.parsed_channel_config
+                    claim.update(
+                        channel=task.channel.value,
+                        # 无法解析的配置由 _send_channel 按发送失败记录
+                        channel_config=config if config is not None else task.channel_config
+                    )
+
+                db.add(execution)
+                db.flush()
+                claim['execution_id'] = execution.id
+                db.commit()
+                logger.info(f"开始执行任务 {task_id}: {claim['title']}")
+                return claim
+
+            except Exception as e:
+                logger.error(f"执行任务 {task_id} 时发生错误: {str(e)}")
+                db.rollback()
+                return None
+
+    @staticmethod
+    def _deferred(db, task_id: int, scheduled_time) -> bool:
+        """一次性任务在该计划时间的发送是否已因限流延后（存在登记于该计划时间的待处理重试）"""
+        return db.query(DeliveryRetry.id).filter(
+            DeliveryRetry.task_id == task_id,
+            DeliveryRetry.status == 'pending',
+            DeliveryRetry.task_scheduled_time == scheduled_time
+        ).first() is not None
+
+    def _save_execution(self, claim: dict, outcomes, run_started: float):
+        """
+        在一个事务中写入本次触发的全部发送结果：任务状态、投递记录、重试与执行记录
+
+        因限流延后的渠道没有发出请求，不算失败：登记重试作为改期，一次性任务保持待发送
+
+        Returns:
+            dict: 通知前端的事件（任务已被删除或全部渠道均延后时为 None）
+        """
+        task_id = claim['id']
+        with get_db() as db:
+            execution = db.get(TaskExecution, claim['execution_id'])
+            task = db.query(NotifyTask).filter(NotifyTask.id == task_id).with_for_update().first()
+            deferred = [c for c, outcome in outcomes if isinstance(outcome['error'], DeliveryThrottled)]
+            failed = [c for c, outcome in outcomes if outcome['error'] is not None and c not in deferred]
+            sent = len(outcomes) - len(failed) - len(deferred)
+            if not failed and not deferred:
+                run_status = 'sent'
+            elif not sent and not failed:
+                run_status = 'deferred'
+            elif not sent and not deferred:
+                run_status = 'failed'
+            else:
+                run_status = 'partial'
+            if task is None:
+                logger.warning(f"任务 {task_id} 在发送期间已被删除")
+                db.add(self._finish_execution(execution, run_started, run_status, '任务已删除'))
+                db.commit()
+                return None
+
+            # 发送期间任务可能被修改：只有仍处于本次认领时的状态（待发送且未改期）才更新任务状态、登记重试
+            current = task.status == NotifyStatus.PENDING and (
+                task.is_recurring or task.scheduled_time == claim['fire_time']
+            )
+            # 本次执行重新发送了全部渠道，之前登记的重试全部作废
+            cancel_task_retries(db, task_id)
+
+            if claim['channels'] is not None:
+                send_results = {}
+                deliveries = []
+                for channel_str, outcome in outcomes:
+                    e = outcome['error']
+                    if e is None:
+                        send_results[channel_str] = {
+                            'status': 'sent',
+                            'message': '发送成功',
+                            'sent_time': outcome['sent_at'].isoformat()
+                        }
+                        deliveries.append(self._delivery(task, channel_str, 1, outcome))
+                        logger.info(f"任务 {task_id} 渠道 {channel_str} 发送成功")
+                        continue
+
+                    error = self._send_error(e)
+                    if isinstance(e, DeliveryThrottled):
+                        # 限流延后的渠道没有发出请求，不记录投递
+                        logger.info(f"任务 {task_id} 渠道 {channel_str} {error}，延后发送")
+                    else:
+                        deliveries.append(self._delivery(task, channel_str, 1, outcome, error))
+                        logger.error(f"任务 {task_id} 渠道 {channel_str} 发送失败: {error}")
+
+                    retry_at = self._schedule_retry(db, task, channel_str, 1, e) if current else None
+                    if retry_at:
+                        status = 'deferred' if isinstance(e, DeliveryThrottled) else 'retrying'
+                    else:
+                        status = 'failed'
+                    send_results[channel_str] = {
+                        'status': status,
+                        'message': error,
+                        'sent_time': datetime.now().isoformat()
+                    }
+                    if retry_at:
+                        send_results[channel_str]['next_retry_time'] = retry_at.isoformat()
+
+                statuses = [result['status'] for result in send_results.values()]
+                success_count = statuses.count('sent')
+                fail_count = len(statuses) - success_count - statuses.count('deferred')
+
+                # 更新任务状态（全部渠道均延后时保持待发送，由重试队列发送）
+                if not task.is_recurring and current:
+                    if success_count > 0:
+                        task.status = NotifyStatus.SENT
+                    elif fail_count > 0:
+                        task.status = NotifyStatus.FAILED
+
+                if success_count > 0 or fail_count > 0:
+                    task.sent_time = datetime.now()
+                # send_results 只保留最近一次执行的汇总，完整的投递历史记录在 task_deliveries 表中
+                task.send_results = json.dumps(send_results, ensure_ascii=False)
+                task.error_msg = self._results_summary(send_results)
+                db.add_all(deliveries)
+
+                logger.info(
+                    f"任务 {task_id} 多渠道执行完成: {success_count} 成功, {fail_count} 失败, "
+                    f"{len(statuses) - success_count - fail_count} 延后"
+                )
+
+                # 通知前端
+                event = None
+                if success_count > 0 or fail_count > 0:
+                    event = {
+                        'type': 'task_executed',
+                        'task_id': task.id,
+                        'title': task.title,
+                        'status': 'sent' if success_count > 0 else 'failed',
+                        'message': f'{success_count}/{len(outcomes)} 个渠道发送成功'
+                    }
+
+            else:
+                # 单渠道模式（向后兼容）
+                channel_str, outcome = outcomes[0]
+                e = outcome['error']
+                retry_at = None
+                if e is not None and current:
+                    retry_at = self._schedule_retry(db, task, channel_str, 1, e)
+
+                if e is None:
+                    db.add(self._delivery(task, channel_str, 1, outcome))
+
                     # 更新任务状态
-                    if not task.is_recurring:
-                        if success_count > 0:
-                            task.status = NotifyStatus.SENT
-                        else:
-                            task.status = NotifyStatus.FAILED
-                    
+                    if not task.is_recurring and current:
+                        task.status = NotifyStatus.SENT
                     task.sent_time = datetime.now()
-                    task.send_results = json.dumps(send_results, ensure_ascii=False)
-                    
-                    # 设置错误信息（如果有失败）
-                    if fail_count > 0:
-                        task.error_msg = f"{success_count}/{len(channels)} 个渠道发送成功，{fail_count} 个失败"
-                    else:
-                        task.error_msg = None
-                    
-                    # 重复任务执行成功后，滚动更新下一次执行时间
-                    if task.is_recurring and task.cron_expression:
-                        try:
-                            trigger = get_cron_trigger(task.cron_expression)
-                            base_time = datetime.now()
-                            next_run = trigger.get_next_fire_time(None, base_time)
-                            if next_run:
-                                task.scheduled_time = next_run
-                        except Exception as e:
-                            logger.warning(f"任务 {task_id} 更新下一次执行时间失败: {str(e)}")
-                    
-                    logger.info(f"任务 {task_id} 多渠道执行完成: {success_count} 成功, {fail_count} 失败")
-                    
+                    task.error_msg = None
+
+                    logger.info(f"任务 {task_id} 执行成功")
+
                     # 通知前端
-                    event_manager.announce(task.user_id, {
+                    event = {
                         'type': 'task_executed',
                         'task_id': task.id,
                         'title': task.title,
-                        'status': 'sent' if success_count > 0 else 'failed',
-                        'message': f'{success_count}/{len(channels)} 个渠道发送成功'
-                    })
-                    
+                        'status': 'sent',
+                        'message': '发送成功'
+                    }
+
+                elif isinstance(e, DeliveryThrottled) and retry_at:
+                    # 限流延后：没有发出请求，任务保持原状态，由重试队列在配额恢复后发送
+                    task.error_msg = f"{e}，将于 {retry_at.strftime('%Y-%m-%d %H:%M:%S')} 发送"
+                    logger.info(f"任务 {task_id} {e}，延后发送")
+                    event = None
+
                 else:
-                    # 单渠道模式（向后兼容）
-                    config = parse_config(task.channel_config)
+                    # 更新任务状态为失败，可重试的错误稍后由重试队列重新发送
+                    if not isinstance(e, DeliveryThrottled):
+                        db.add(self._delivery(task, channel_str, 1, outcome, str(e)))
+                    if current:
+                        task.status = NotifyStatus.FAILED
+                    task.error_msg = str(e)
+                    logger.error(f"任务 {task_id} 执行失败: {str(e)}")
+                    if retry_at:
+                        task.error_msg += f"（将于 {retry_at.strftime('%Y-%m-%d %H:%M:%S')} 重试）"
 
-                    # 发送通知
-                    try:
-                        NotificationSender.send(
-                            channel=task.channel,
-                            config=config,
-                            title=task.title,
-                            content=task.content
-                        )
+                    # 通知前端
+                    event = {
+                        'type': 'task_executed',
+                        'task_id': task.id,
+                        'title': task.title,
+                        'status': 'failed',
+                        'message': str(e)
+                    }
 
-                        # 更新任务状态
-                        if not task.is_recurring:
-                            task.status = NotifyStatus.SENT
-                        task.sent_time = datetime.now()
-                        task.error_msg = None
-
-                        # 关键：重复任务执行成功后，滚动更新下一次执行时间（用于列表展示）
-                        if task.is_recurring and task.cron_expression:
-                            try:
-                                trigger = get_cron_trigger(task.cron_expression)
-                                # 以"本次实际执行时间"为基准，计算下一次
-                                base_time = datetime.now()
-                                next_run = trigger.get_next_fire_time(None, base_time)
-                                if next_run:
-                                    task.scheduled_time = next_run
-                            except Exception as e:
-                                # 不影响本次发送结果，但记录日志
-                                logger.warning(f"任务 {task_id} 更新下一次执行时间失败: {str(e)}")
-
-                        logger.info(f"任务 {task_id} 执行成功")
-                        
-                        # 通知前端
-                        event_manager.announce(task.user_id, {
-                            'type': 'task_executed',
-                            'task_id': task.id,
-                            'title': task.title,
-                            'status': 'sent',
-                            'message': '发送成功'
-                        })
+            db.add(self._finish_execution(execution, run_started, run_status, task.error_msg))
+            db.commit()
+            return event
 
-                    except Exception as e:
-                        # 更新任务状态为失败
+    @staticmethod
+    def _results_summary(send_results: dict):
+        """根据各渠道最近一次的结果生成任务的错误信息，全部发送成功时返回 None"""
+        statuses = [result.get('status') for result in send_results.values()]
+        sent = statuses.count('sent')
+        deferred = statuses.count('deferred')
+        failed = len(statuses) - sent - deferred
+        if not failed and not deferred:
+            return None
+        message = f"{sent}/{len(statuses)} 个渠道发送成功"
+        if failed:
+            message += f"，{failed} 个失败"
+            if statuses.count('retrying'):
+                message += f"（{statuses.count('retrying')} 个等待重试）"
+        if deferred:
+            message += f"，{deferred} 个因限流延后发送"
+        return message
+
+    def _send_channel(self, task_id: int, channel_str: str, channel_config, title: str, content: str, deadline: float):
+        """
+        向单个渠道发送通知（通常在发送线程池中执行），不抛出异常
+
+        deadline 为 time.monotonic() 截止时间，发送引擎在截止时取消请求
+
+        Returns:
+            dict: error（发送失败时的异常，成功为 None）、http_code、latency_ms（毫秒）、sent_at
+        """
+        started = time.monotonic()
+        http_code = error = None
+        try:
+            channel = NotifyChannel(channel_str)
+            config = parse_config(channel_config)
+
+            logger.info(f"任务 {task_id} 向渠道 {channel_str} 发送通知")
+            http_code = NotificationSender.send(
+                channel=channel,
+                config=config,
+                title=title,
+                content=content,
+                timeout=max(deadline - time.monotonic(), 0.001),
+                max_wait=THROTTLE_DEFER_SECONDS
+            )
+        except Exception as e:
+            error = e
+            http_code = getattr(e, 'status_code', None)
+        return {
+            'error': error,
+            'http_code': http_code,
+            'latency_ms': int((time.monotonic() - started) * 1000),
+            'sent_at': datetime.now()
+        }
+
+    @staticmethod
+    def _wait_send(future, deadline: float, started: float):
+        """
+        等待发送线程池返回 _send_channel 的结果
+
+        发送引擎在截止时间取消请求，已开始的发送总会在截止时间后很快返回，这里等待其真实结果；
+        截止时仍未开始（线程池排满）的发送直接取消，按超时失败处理
+        """
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0) + SEND_CANCEL_GRACE)
+        except FuturesTimeoutError as e:
+            if not future.cancel():
+                return future.result()
+            return {
+                'error': e,
+                'http_code': None,
+                'latency_ms': int((time.monotonic() - started) * 1000),
+                'sent_at': datetime.now()
+            }
+
+    @staticmethod
+    def _send_error(error) -> str:
+        if isinstance(error, FuturesTimeoutError):
+            return f'发送超时（超过 {SEND_TIMEOUT} 秒）'
+        return str(error)
+
+    @staticmethod
+    def _start_execution(task, fire_time, started_at: datetime):
+        """生成本次触发的 running 执行记录（认领时写入），同时记录调度延迟指标"""
+        lag = (started_at - fire_time).total_seconds() if fire_time else None
+        if lag is not None:
+            SCHEDULE_LAG.observe(max(lag, 0))
+        return TaskExecution(
+            task_id=task.id,
+            user_id=task.user_id,
+            fire_time=fire_time,
+            started_at=started_at,
+            lag_ms=int(lag * 1000) if lag is not None else None,
+            status='running'
+        )
+
+    @staticmethod
+    def _finish_execution(execution, run_started: float, status: str, error: str = None):
+        """填写执行记录的结果与耗时（与任务状态在同一事务中写入）"""
+        TASK_EXECUTIONS.inc(status=status)
+        execution.duration_ms = int((time.monotonic() - run_started) * 1000)
+        execution.status = status
+        execution.error = error
+        return execution
+
+    @staticmethod
+    def _delivery(task, channel_str: str, attempt: int, outcome: dict, error: str = None):
+        """根据发送结果生成一条投递记录（由调用方与任务状态一起批量写入）"""
+        return TaskDelivery(
+            task_id=task.id,
+            user_id=task.user_id,
+            channel=channel_str,
+            attempt=attempt,
+            status='failed' if outcome['error'] is not None else 'sent',
+            latency_ms=outcome['latency_ms'],
+            http_code=outcome['http_code'],
+            error=error,
+            created_at=outcome['sent_at']
+        )
+
+    def _schedule_retry(self, db, task, channel_str: str, attempt: int, error):
+        """
+        为发送失败的渠道登记重试（在调用方的事务中），返回下次重试时间
+
+        只有网络错误、超时、限流和服务端错误会重试，配置错误等不会重试；
+        同时记录任务当前的计划时间与渠道配置摘要，任务改期或修改配置后重试作废
+        """
+        # 限流延后：本次没有请求渠道，不计入尝试次数，在配额恢复后发送
+        throttled = isinstance(error, DeliveryThrottled)
+        if throttled:
+            attempt -= 1
+        if not is_retryable(error) or attempt >= RETRY_MAX_ATTEMPTS:
+            return None
+        delay = error.retry_after if throttled else retry_delay(attempt)
+        next_attempt_at = datetime.now() + timedelta(seconds=delay)
+        db.add(DeliveryRetry(
+            task_id=task.id,
+            channel=channel_str,
+            attempt=attempt,
+            next_attempt_at=next_attempt_at,
+            last_error=str(error) or type(error).__name__,
+            task_scheduled_time=task.scheduled_time,
+            config_digest=_config_digest(_retry_config(task, channel_str))
+        ))
+        return next_attempt_at
+
+    def _process_retries(self):
+        """
+        主节点重新发送到期的失败渠道（只重发失败的渠道）
+
+        短事务认领到期的重试（把下次重试时间推迟到认领有效期之后，进程中断时到期会再次发送）→
+        在事务之外发送 → 在一个事务中写入全部结果
+        """
+        now = datetime.now()
+        claims = []
+        with get_db() as db:
+            due = db.query(DeliveryRetry).filter(
+                DeliveryRetry.status == 'pending',
+                DeliveryRetry.next_attempt_at <= now
+            ).order_by(DeliveryRetry.next_attempt_at).limit(SENDER_POOL_SIZE * 4).with_for_update(skip_locked=True).all()
+            if not due:
+                return
+
+            tasks = {t.id: t for t in db.query(NotifyTask).filter(NotifyTask.id.in_({r.task_id for r in due}))}
+            for retry in due:
+                task = tasks.get(retry.task_id)
+                if not task or task.status in (NotifyStatus.CANCELLED, NotifyStatus.PAUSED) or _retry_stale(retry, task):
+                    # 任务已删除、取消、暂停，或登记重试后已改期、修改了渠道配置
+                    logger.info(f"任务 {retry.task_id} 渠道 {retry.channel} 的重试已失效，不再发送")
+                    retry.status = 'cancelled'
+                    retry.next_attempt_at = None
+                    continue
+                config = _retry_config(task, retry.channel)
+                retry.next_attempt_at = now + timedelta(seconds=SEND_CLAIM_SECONDS)
+                claims.append({
+                    'retry_id': retry.id,
+                    'task_id': task.id,
+                    'channel': retry.channel,
+                    'attempt': retry.attempt + 1,
+                    'config': config,
+                    'title': task.title,
+                    'content': task.content
+                })
+            db.commit()
+        if not claims:
+            return
+
+        started = time.monotonic()
+        deadline = started + SEND_TIMEOUT + THROTTLE_DEFER_SECONDS
+        futures = []
+        for claim in claims:
+            logger.info(f"任务 {claim['task_id']} 渠道 {claim['channel']} 第 {claim['attempt']} 次尝试发送")
+            futures.append((claim, self.sender_pool.submit(
+                tracing.bind(self._send_channel), claim['task_id'], claim['channel'], claim['config'],
+                claim['title'], claim['content'], deadline
+            )))
+        outcomes = [(claim, self._wait_send(future, deadline, started)) for claim, future in futures]
+
+        events = []
+        with get_db() as db:
+            retries = {r.id: r for r in db.query(DeliveryRetry).filter(
+                DeliveryRetry.id.in_([claim['retry_id'] for claim in claims])
+            )}
+            tasks = {t.id: t for t in db.query(NotifyTask).filter(
+                NotifyTask.id.in_({claim['task_id'] for claim in claims})
+            ).with_for_update()}
+            deliveries = []
+            for claim, outcome in outcomes:
+                retry = retries.get(claim['retry_id'])
+                task = tasks.get(claim['task_id'])
+                attempt = claim['attempt']
+                e = outcome['error']
+                if task is None or retry is None:
+                    continue
+                if not isinstance(e, DeliveryThrottled):
+                    deliveries.append(self._delivery(
+                        task, retry.channel, attempt, outcome, self._send_error(e) if e is not None else None
+                    ))
+                if retry.status != 'pending' or _retry_stale(retry, task):
+                    # 发送期间任务已被修改或重新执行，任务状态以新的计划或执行结果为准
+                    continue
+
+                result = {'sent_time': outcome['sent_at'].isoformat()}
+                if e is None:
+                    retry.status = 'succeeded'
+                    retry.attempt = attempt
+                    retry.next_attempt_at = None
+                    result.update(status='sent', message=f'第 {attempt} 次尝试发送成功')
+                    logger.info(f"任务 {task.id} 渠道 {retry.channel} 重试发送成功")
+                elif isinstance(e, DeliveryThrottled):
+                    # 仍超出配额：不计入尝试次数，配额恢复后再发送
+                    retry.next_attempt_at = datetime.now() + timedelta(seconds=e.retry_after)
+                    result.update(status='deferred', message=str(e), next_retry_time=retry.next_attempt_at.isoformat())
+                    logger.info(f"任务 {task.id} 渠道 {retry.channel} {e}，延后发送")
+                else:
+                    error = self._send_error(e)
+                    logger.error(f"任务 {task.id} 渠道 {retry.channel} 第 {attempt} 次尝试发送失败: {error}")
+                    if is_retryable(e) and attempt < RETRY_MAX_ATTEMPTS:
+                        retry.attempt = attempt
+                        retry.next_attempt_at = datetime.now() + timedelta(seconds=retry_delay(attempt))
+                        retry.last_error = error
+                        result.update(status='retrying', message=error,
+                                      next_retry_time=retry.next_attempt_at.isoformat())
+                    else:
+                        retry.status = 'exhausted'
+                        retry.attempt = attempt
+                        retry.next_attempt_at = None
+                        retry.last_error = error
+                        result.update(status='failed', message=f'已尝试 {attempt} 次: {error}')
+
+                if task.channels_json is not None:
+                    send_results = json.loads(task.send_results or '{}')
+                    send_results[retry.channel] = result
+                    task.send_results = json.dumps(send_results, ensure_ascii=False)
+                    task.error_msg = self._results_summary(send_results)
+                    statuses = [r.get('status') for r in send_results.values()]
+                    succeeded = 'sent' in statuses
+                    unfinished = 'retrying' in statuses or 'deferred' in statuses
+                else:
+                    succeeded = result['status'] == 'sent'
+                    unfinished = result['status'] in ('retrying', 'deferred')
+                    task.error_msg = None if succeeded else result['message']
+
+                if succeeded:
+                    task.sent_time = datetime.now()
+                if not task.is_recurring:
+                    # 失败或因限流延后（仍为待发送）的一次性任务：补发成功即已发送，延后的发送最终失败时标记失败
+                    if succeeded and task.status in (NotifyStatus.FAILED, NotifyStatus.PENDING):
+                        task.status = NotifyStatus.SENT
+                    elif not succeeded and not unfinished and task.status == NotifyStatus.PENDING:
                         task.status = NotifyStatus.FAILED
-                        task.error_msg = str(e)
-                        logger.error(f"任务 {task_id} 执行失败: {str(e)}")
-                        
-                        # 通知前端
-                        event_manager.announce(task.user_id, {
-                            'type': 'task_executed',
-                            'task_id': task.id,
-                            'title': task.title,
-                            'status': 'failed',
-                            'message': str(e)
-                        })
+                if result['status'] not in ('retrying', 'deferred'):
+                    events.append((task.user_id, {
+                        'type': 'task_executed',
+                        'task_id': task.id,
+                        'title': task.title,
+                        'status': result['status'],
+                        'message': f"渠道 {retry.channel} {result['message']}"
+                    }))
 
+            db.add_all(deliveries)
+            db.commit()
+
+        for user_id, event in events:
+            event_manager.announce(user_id, event)
+
+    def _prune_retries(self):
+        """清理已结束的重试记录"""
+        try:
+            with get_db() as db:
+                db.query(DeliveryRetry).filter(
+                    DeliveryRetry.status != 'pending',
+                    DeliveryRetry.updated_at < datetime.now() - timedelta(days=RETRY_RETENTION_DAYS)
+                ).delete(synchronize_session=False)
                 db.commit()
+        except Exception as e:
+            logger.error(f"清理重试记录失败: {str(e)}")
+
+    def _prune_tombstones(self):
+        """清理过期的已删除任务记录（增量同步游标早于保留期的前端会重新全量加载）"""
+        try:
+            with get_db() as db:
+                db.query(TaskTombstone).filter(
+                    TaskTombstone.deleted_at < datetime.now() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+                ).delete(synchronize_session=False)
+                db.commit()
+        except Exception as e:
+            logger.error(f"清理已删除任务记录失败: {str(e)}")
+
+    def _prune_history(self, model, column, retention_days: int, label: str):
+        """分批删除超过保留期的历史记录，每批单独提交，避免长时间占用写锁"""
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        try:
+            while True:
+                with get_db() as db:
+                    ids = [row.id for row in db.query(model.id).filter(column < cutoff).limit(PRUNE_BATCH_SIZE)]
+                    if ids:
+                        db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+                        db.commit()
+                if len(ids) < PRUNE_BATCH_SIZE:
+                    break
+        except Exception as e:
+            logger.error(f"清理{label}失败: {str(e)}")
 
-            except Exception as e:
-                logger.error(f"执行任务 {task_id} 时发生错误: {str(e)}")
-                db.rollback()
-    
     def load_pending_tasks(self):
         """
-        加载所有待发送的任务到调度器
+        将待发送任务同步到调度器
+
+        使用持久化作业存储时，仅增量处理 updated_at 晚于检查点的任务；
+        首次启动（无检查点）或使用内存作业存储时全量加载所有待发送任务。
         """
-        with get_db() as db:
-            try:
-                # 查询所有待发送的任务
-                pending_tasks = db.query(NotifyTask).filter(
-                    NotifyTask.status == NotifyStatus.PENDING
-                ).all()
+        started_at = datetime.now()
+        try:
+            watermark = self._get_watermark() if SCHEDULER_JOBSTORE == 'sqlalchemy' else None
+            if watermark is None:
+                logger.info("全量加载待发送任务")
+                count = self._reconcile(and_(
+                    NotifyTask.status == NotifyStatus.PENDING,
+                    or_(
+                        NotifyTask.is_recurring == True,
+                        NotifyTask.scheduled_time <= datetime.now() + timedelta(minutes=SCHEDULER_HORIZON_MINUTES)
+                    )
+                ))
+            else:
+                logger.info(f"增量同步 {watermark} 之后变更的任务")
+                count = self._reconcile(NotifyTask.updated_at >= watermark)
+            self._save_watermark(started_at)
+            logger.info(f"待发送任务加载完成，共处理 {count} 个任务，耗时 {(datetime.now() - started_at).total_seconds():.2f} 秒")
+        except Exception as e:
+            logger.error(f"加载待发送任务失败: {str(e)}")
 
-                logger.info(f"找到 {len(pending_tasks)} 个待发送任务")
+    def _sweep_horizon(self):
+        """装载计划时间进入调度窗口的一次性任务（按 status, scheduled_time 索引范围查询）"""
+        now = datetime.now()
+        scheduled = {job.id for job in self.scheduler.get_jobs(jobstore='volatile')}
+        count = 0
+        try:
+            with get_db() as db:
+                tasks = db.query(NotifyTask).filter(
+                    NotifyTask.status == NotifyStatus.PENDING,
+                    NotifyTask.scheduled_time >= now - timedelta(seconds=MISFIRE_GRACE_SECONDS),
+                    NotifyTask.scheduled_time <= now + timedelta(minutes=SCHEDULER_HORIZON_MINUTES)
+                ).order_by(NotifyTask.scheduled_time).yield_per(RECONCILE_BATCH_SIZE)
+                for task in tasks:
+                    if (task.is_recurring and task.cron_expression) or f"task_{task.id}" in scheduled:
+                        continue
+                    if task.channels_json is None and task.channel is None:
+                        continue
+                    self._schedule_task(task)
+                    count += 1
+            if count:
+                logger.info(f"调度窗口内新装载 {count} 个任务")
+        except Exception as e:
+            logger.error(f"装载调度窗口内任务失败: {str(e)}")
 
-                for task in pending_tasks:
+    def _reconcile(self, criterion):
+        """按 id 分批处理满足条件的任务，避免一次性把所有任务载入内存"""
+        count = 0
+        last_id = 0
+        while True:
+            with get_db() as db:
+                tasks = db.query(NotifyTask).filter(
+                    criterion, NotifyTask.id > last_id
+                ).order_by(NotifyTask.id).limit(RECONCILE_BATCH_SIZE).all()
+                if not tasks:
+                    return count
+                for task in tasks:
                     try:
-                        # 验证任务配置：单渠道任务必须有channel，多渠道任务必须有channels_json
-                        is_multi_channel = task.channels_json is not None
-                        if not is_multi_channel and task.channel is None:
-                            logger.warning(f"任务 {task.id} 配置无效（单渠道和多渠道字段都为空），跳过加载")
-                            continue
-                        
-                        # 如果是一次性任务且计划时间已过，跳过
-                        if not task.is_recurring and task.scheduled_time < datetime.now():
-                            logger.warning(f"任务 {task.id} 计划时间已过，跳过加载")
-                            continue
-
-                        # 如果是重复任务且计划时间已过，重新计算下一次执行时间
-                        if task.is_recurring and task.cron_expression and task.scheduled_time < datetime.now():
-                            try:
-                                trigger = get_cron_trigger(task.cron_expression)
-                                next_run = trigger.get_next_fire_time(None, datetime.now())
-                                if next_run:
-                                    task.scheduled_time = next_run
-                                    db.commit()
-                                    logger.info(f"重复任务 {task.id} 的执行时间已过期，已更新为下一次执行时间: {next_run}")
-                            except Exception as e:
-                                logger.warning(f"重复任务 {task.id} 更新下一次执行时间失败: {str(e)}")
-
-                        self.add_task(task)
+                        self._reconcile_task(task)
                     except Exception as e:
                         logger.error(f"加载任务 {task.id} 失败: {str(e)}")
-                        continue
+                db.commit()
+                count += len(tasks)
+                last_id = tasks[-1].id
+
+    def _reconcile_task(self, task: NotifyTask):
+        """使作业存储中的作业与任务当前状态一致"""
+        if task.status != NotifyStatus.PENDING:
+            for job_id in (f"task_{task.id}", f"recurring_task_{task.id}"):
+                if self.scheduler.get_job(job_id):
+                    self.scheduler.remove_job(job_id)
+            return
 
-                logger.info("待发送任务加载完成")
+        # 验证任务配置：单渠道任务必须有channel，多渠道任务必须有channels_json
+        is_multi_channel = task.channels_json is not None
+        if not is_multi_channel and task.channel is None:
+            logger.warning(f"任务 {task.id} 配置无效（单渠道和多渠道字段都为空），跳过加载")
+            return
 
+        now = datetime.now()
+        # 如果是一次性任务且计划时间已过，跳过
+        if not task.is_recurring and task.scheduled_time < now:
+            logger.warning(f"任务 {task.id} 计划时间已过，跳过加载")
+            return
+
+        # 如果是重复任务且计划时间已过，重新计算下一次执行时间（由调用方批量提交）
+        if task.is_recurring and task.cron_expression and task.scheduled_time < now:
+            try:
+                trigger = get_cron_trigger(task.cron_expression)
+                next_run = trigger.get_next_fire_time(None, now)
+                if next_run:
+                    task.scheduled_time = next_run
+                    logger.info(f"重复任务 {task.id} 的执行时间已过期，已更新为下一次执行时间: {next_run}")
             except Exception as e:
-                logger.error(f"加载待发送任务失败: {str(e)}")
+                logger.warning(f"重复任务 {task.id} 更新下一次执行时间失败: {str(e)}")
+
+        self._schedule_task(task)
+
+    def _get_watermark(self):
+        with get_db() as db:
+            checkpoint = db.query(SchedulerCheckpoint).filter(SchedulerCheckpoint.name == 'tasks').first()
+            return checkpoint.watermark if checkpoint else None
+
+    def _save_watermark(self, started_at):
+        """保存检查点（回退一小段时间，覆盖检查点附近提交的变更）"""
+        watermark = started_at - timedelta(seconds=RECONCILE_OVERLAP_SECONDS)
+        with get_db() as db:
+            checkpoint = db.query(SchedulerCheckpoint).filter(SchedulerCheckpoint.name == 'tasks').first()
+            if checkpoint:
+                checkpoint.watermark = watermark
+            else:
+                db.add(SchedulerCheckpoint(name='tasks', watermark=watermark))
+            db.commit()
     
     def get_scheduled_jobs(self):
         """获取所有已调度的任务"""
@@ -352,10 +1363,32 @@ class NotifyScheduler:
                 'trigger': str(job.trigger)
             })
         return jobs
+
+    def job_counts(self):
+        """各作业存储中的作业数（仅调度主节点运行调度器）"""
+        if not self.scheduler.running:
+            return {}
+        counts = {}
+        for alias, store in self.jobstores.items():
+            if isinstance(store, SQLAlchemyJobStore):
+                # 持久化作业存储直接计数，避免反序列化全部作业
+                with engine.connect() as conn:
+                    counts[(alias,)] = conn.execute(select(func.count()).select_from(store.jobs_t)).scalar()
+            else:
+                counts[(alias,)] = len(store.get_all_jobs())
+        return counts
     
     def shutdown(self):
-        """关闭调度器"""
-        self.scheduler.shutdown()
+        """关闭调度器并释放租约"""
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        self.sender_pool.shutdown(wait=False)
+        if self.is_leader:
+            self.is_leader = False
+            self.lease.release()
         logger.info("通知调度器已关闭")
 
     def add_external_calendar_sync_job(self):
@@ -366,14 +1399,79 @@ class NotifyScheduler:
                 'interval',
                 minutes=15,
                 id='sync_external_calendars',
+                jobstore='volatile',
                 replace_existing=True
             )
             logger.info("外部日历同步任务已启动 (每15分钟)")
 
 
+def is_retryable(error) -> bool:
+    """判断发送错误是否值得重试"""
+    if isinstance(error, FuturesTimeoutError):
+        return True
+    return isinstance(error, DeliveryError) and error.transient
+
+
+def retry_delay(attempt: int) -> float:
+    """第 attempt 次失败后的重试等待秒数：指数退避，并在后半区间随机抖动以错开重试"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def cancel_task_retries(db, task_id: int) -> int:
+    """
+    作废任务尚未完成的重试（在调用方的事务中），返回作废的条数
+
+    任务被修改、暂停、取消、删除或重新执行时调用，避免旧的重试按过期的计划或配置再次发送
+    """
+    return db.query(DeliveryRetry).filter(
+        DeliveryRetry.task_id == task_id,
+        DeliveryRetry.status == 'pending'
+    ).update({'status': 'cancelled', 'next_attempt_at': None}, synchronize_session=False)
+
+
+def _retry_config(task, channel_str: str):
+    """任务当前在该渠道上的配置，任务已不再使用该渠道时返回 None"""
+    if task.channels_json is not None:
+        if channel_str not in (task.parsed_channels or []):
+            return None
+        return (task.parsed_channels_config or {}).get(channel_str, {})
+    if task.channel is None or task.channel.value != channel_str:
+        return None
+    return task.channel_config
+
+
+def _config_digest(config) -> str:
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def _retry_stale(retry, task) -> bool:
+    """登记重试后任务已改期、修改了渠道配置或不再使用该渠道"""
+    config = _retry_config(task, retry.channel)
+    if config is None:
+        return True
+    if retry.task_scheduled_time is not None and retry.task_scheduled_time != task.scheduled_time:
+        return True
+    return retry.config_digest is not None and retry.config_digest != _config_digest(config)
+
+
 # 全局调度器实例
 scheduler = NotifyScheduler()
 
+# 输出时取值的指标
+JOBSTORE_JOBS.set_function(scheduler.job_counts)
+SCHEDULER_LEADER.set_function(lambda: int(scheduler.is_leader))
+SSE_LISTENERS.set_function(lambda: len(event_manager.listeners))
+DELIVERY_QUEUED.set_function(lambda: delivery_engine.queue_stats()['queued'])
+
+
+def execute_task(task_id: int):
+    """任务作业入口（模块级函数，便于持久化作业存储按引用序列化）"""
+    with tracing.trace('execute_task', task_id=task_id):
+        scheduler._execute_task(task_id)
+
 # --- 外部日历同步逻辑 ---
 
 def parse_ics_content(content):
@@ -423,6 +1521,11 @@ def parse_ics_date(date_str):
 
 def sync_single_calendar(cal_id):
     """同步单个外部日历"""
+    with tracing.trace('sync_calendar', cal_id=cal_id):
+        _sync_single_calendar(cal_id)
+
+
+def _sync_single_calendar(cal_id):
     with get_db() as db:
         try:
             cal = db.query(ExternalCalendar).filter(ExternalCalendar.id == cal_id).first()
@@ -441,10 +1544,12 @@ def sync_single_calendar(cal_id):
                     channel_type = channel.channel_type
             
             # 下载 ICS
-            resp = requests.get(cal.url, timeout=30)
+            with tracing.span('http', method='GET', host=urlsplit(cal.url).netloc):
+                resp = requests.get(cal.url, timeout=30)
             resp.raise_for_status()
             
-            events = parse_ics_content(resp.text)
+            with tracing.span('ics.parse'):
+                events = parse_ics_content(resp.text)
             count = 0
             
             for event in events:
@@ -467,6 +1572,7 @@ def sync_single_calendar(cal_id):
                 if existing:
                     # 更新
                     if existing.scheduled_time != dt_start or existing.title != summary:
+                        cancel_task_retries(db, existing.id)
                         existing.scheduled_time = dt_start
                         existing.title = summary
                         existing.content = desc or summary
@@ -489,7 +1595,12 @@ def sync_single_calendar(cal_id):
                         is_recurring=False # 外部日历的重复由外部处理，这里只同步具体事件
                     )
                     db.add(new_task)
-                    db.commit() # 提交以获取 ID
+                    try:
+                        db.commit() # 提交以获取 ID
+                    except IntegrityError:
+                        # 该事件已由其他同步创建（external_uid 唯一）
+                        db.rollback()
+                        continue
                     scheduler.add_task(new_task)
                     count += 1
             
@@ -516,6 +1627,7 @@ def sync_all_external_calendars():
                 sync_single_calendar,
                 args=[cal.id],
                 id=f"sync_cal_{cal.id}_auto",
+                jobstore='volatile',
                 replace_existing=True,
                 misfire_grace_time=60
             )
@@ -23,7 +23,6 @@ source venv/bin/activate
 # 安装依赖
 echo "安装依赖包..."
 pip install -r requirements.txt
-pip install gunicorn ANotify
 
 # 创建必要的目录
 mkdir -p logs data
@@ -259,7 +259,7 @@ function logout() {
 // 导出数据
 async function exportData() {
     try {
-        const response = await fetch(`${API_BASE}/export`, {
+        const response = await fetch(`${API_BASE}/export?gzip=1`, {
             method: 'GET',
             headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` }
         });
@@ -361,8 +361,12 @@ async function importData(event) {
                         `任务: 导入 ${stats.tasks_imported || 0} 条, 跳过 ${stats.tasks_skipped || 0} 条\n` +
                         `通道: 导入 ${stats.channels_imported || 0} 个, 跳过 ${stats.channels_skipped || 0} 个\n` +
                         `日历: 导入 ${stats.calendars_imported || 0} 个, 跳过 ${stats.calendars_skipped || 0} 个`;
-        
-        showNotification(statsMsg, 'success');
+        const invalid = (stats.tasks_invalid || 0) + (stats.channels_invalid || 0) + (stats.calendars_invalid || 0);
+
+        showNotification(invalid ? `${statsMsg}\n\n${invalid} 条无效记录未导入` : statsMsg, 'success');
+        if (result.errors && result.errors.length) {
+            console.warn('Import invalid records:', result.errors);
+        }
 
         // 刷新页面数据
         loadTasks();
@@ -1059,6 +1063,11 @@ function convertCronExpressionForBackend(expr) {
     return parts.join(' ');
 }
 
+// 任务列表中已加载的任务（按 id），增量同步时就地合并；
+// loadedTasksBoundary 为列表只加载了第一页时的最后一条，排在它之后的变更不在当前列表范围内
+const loadedTasks = new Map();
+let loadedTasksBoundary = null;
+
 // 加载任务列表
 async function loadTasks() {
     const taskList = document.getElementById('taskList');
@@ -1073,7 +1082,8 @@ async function loadTasks() {
     taskList.innerHTML = '<div class="loading"><div class="spinner"></div><p>加载中...</p></div>';
 
     try {
-        const params = new URLSearchParams({ page_size: '100' });
+        // 游标分页取第一页，不需要总数
+        const params = new URLSearchParams({ page_size: '100', cursor: '', with_total: 'false' });
         if (statusFilter) params.append('status', statusFilter);
         if (sortField) params.append('sort_by', sortField);
         if (sortOrder) params.append('sort_order', sortOrder.toLowerCase());
@@ -1085,6 +1095,10 @@ async function loadTasks() {
         });
         const data = await response.json();
 
+        loadedTasks.clear();
+        (data.tasks || []).forEach(task => loadedTasks.set(task.id, task));
+        loadedTasksBoundary = data.next_cursor && data.tasks.length ? data.tasks[data.tasks.length - 1] : null;
+
         if (data.tasks && data.tasks.length > 0) {
             taskList.innerHTML = '';
             let tasks = data.tasks;
@@ -1112,6 +1126,7 @@ async function loadTasks() {
 function createTaskElement(task) {
     const div = document.createElement('div');
     div.className = 'task-item';
+    div.dataset.taskId = task.id;
     if (task.is_recurring) div.classList.add('recurring');
 
     // 标记过期任务：状态为 pending 且计划时间早于当前时间
@@ -2161,6 +2176,113 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
+// 任务增量同步游标：定时刷新时只拉取变更，并按 id 合并到当前列表
+let taskChangesCursor = null;
+
+// 与后端 /api/tasks 一致的排序：排序字段相同时按 id
+function compareTasks(a, b) {
+    const field = document.getElementById('sortField')?.value || 'scheduled_time';
+    const order = document.getElementById('sortOrder')?.value === 'desc' ? -1 : 1;
+    const key = task => field === 'id' ? task.id : (task[field] || '');
+    if (key(a) < key(b)) return -order;
+    if (key(a) > key(b)) return order;
+    return (a.id - b.id) * order;
+}
+
+function matchesTaskFilters(task) {
+    const statusFilter = document.getElementById('statusFilter').value;
+    const recurringFilter = document.getElementById('recurringFilter')?.value || '';
+    if (statusFilter && task.status !== statusFilter) return false;
+    if (recurringFilter === 'recurring') return !!task.is_recurring;
+    if (recurringFilter === 'non_recurring') return !task.is_recurring;
+    return true;
+}
+
+// updated_at 为 isoformat，微秒为 0 时省略小数部分，补齐后可按字符串比较
+function taskVersion(task) {
+    const ts = task.updated_at || '';
+    return ts.length === 19 ? ts + '.000000' : ts;
+}
+
+function removeTaskRow(taskList, id) {
+    loadedTasks.delete(id);
+    const row = taskList.querySelector(`.task-item[data-task-id="${id}"]`);
+    if (row) row.remove();
+}
+
+// 合并一条变更：重叠窗口重复返回的、不比当前版本新的记录直接跳过
+function mergeTaskRow(taskList, task) {
+    const known = loadedTasks.get(task.id);
+    if (known && taskVersion(task) <= taskVersion(known)) return false;
+    if (!matchesTaskFilters(task) || (loadedTasksBoundary && compareTasks(task, loadedTasksBoundary) > 0)) {
+        if (!known) return false;
+        removeTaskRow(taskList, task.id);
+        return true;
+    }
+
+    removeTaskRow(taskList, task.id);
+    loadedTasks.set(task.id, task);
+    const next = [...taskList.querySelectorAll('.task-item')]
+        .find(row => compareTasks(task, loadedTasks.get(Number(row.dataset.taskId))) < 0);
+    taskList.insertBefore(createTaskElement(task), next || null);
+    return true;
+}
+
+function applyTaskChanges(tasks, deleted) {
+    const taskList = document.getElementById('taskList');
+    // 同一批变更中仍然存在的任务以变更为准（SQLite 可能复用已删除任务的 id）
+    const alive = new Set(tasks.map(task => task.id));
+    let changed = false;
+    deleted.forEach(id => {
+        if (!alive.has(id) && loadedTasks.has(id)) {
+            removeTaskRow(taskList, id);
+            changed = true;
+        }
+    });
+    if (tasks.length || changed) {
+        taskList.querySelectorAll('.empty-state, .loading').forEach(el => el.remove());
+    }
+    tasks.forEach(task => {
+        if (mergeTaskRow(taskList, task)) changed = true;
+    });
+    if (!taskList.querySelector('.task-item')) {
+        taskList.innerHTML = '<div class="empty-state"><i>📭</i><p>暂无任务</p></div>';
+    }
+    return changed;
+}
+
+async function refreshTaskChanges() {
+    const headers = { 'Authorization': `Bearer ${localStorage.getItem('token')}` };
+    try {
+        if (!taskChangesCursor) {
+            const response = await fetch(`${API_BASE}/tasks/changes?limit=0`, { headers });
+            if (response.ok) taskChangesCursor = (await response.json()).cursor;
+            return;
+        }
+
+        let changed = false;
+        let data;
+        do {
+            const response = await fetch(`${API_BASE}/tasks/changes?since=${encodeURIComponent(taskChangesCursor)}`, { headers });
+            if (!response.ok) return;
+            data = await response.json();
+            if (data.reset) {
+                // 游标已过期，重新全量加载
+                taskChangesCursor = null;
+                delete window.__TASKS_CACHE;
+                loadTasks();
+                return;
+            }
+            if (applyTaskChanges(data.tasks, data.deleted)) changed = true;
+            taskChangesCursor = data.cursor;
+        } while (data.has_more);
+
+        if (changed) delete window.__TASKS_CACHE;
+    } catch (error) {
+        console.warn('增量同步任务失败:', error);
+    }
+}
+
 // 监听页面可见性变化，优化性能
 document.addEventListener('visibilitychange', function() {
     if (document.hidden) {
@@ -2168,13 +2290,14 @@ document.addEventListener('visibilitychange', function() {
         clearInterval(window.taskRefreshInterval);
     } else {
         // 页面显示时恢复正常刷新频率
-        window.taskRefreshInterval = setInterval(loadTasks, 30000);
-        loadTasks(); // 立即刷新数据
+        window.taskRefreshInterval = setInterval(refreshTaskChanges, 30000);
+        refreshTaskChanges(); // 立即检查变更
     }
 });
 
 // 存储刷新间隔ID，便于管理
-window.taskRefreshInterval = setInterval(loadTasks, 30000);
+window.taskRefreshInterval = setInterval(refreshTaskChanges, 30000);
+refreshTaskChanges();
 
 // --- 日历同步功能 ---
 
@@ -0,0 +1,135 @@
+"""
+测试环境：项目根目录加入 sys.path，未设置 DATABASE_URL 时使用临时目录下的 SQLite 数据库，
+导入 app 时不启动调度器（测试中直接调用调度器的方法）
+
+需要在导入 models 之前完成，数据库引擎在导入时创建
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='notify-scheduler-test-'))
+os.environ.setdefault('SCHEDULER_ROLE', 'web')
+
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import NotifyChannel, NotifyStatus, NotifyTask, User, get_db, init_db
+
+init_db()
+
+
+@pytest.fixture
+def user():
+    """新建一个用户（每个测试独立，避免相互影响）"""
+    with get_db() as db:
+        user = User(username=f'user-{uuid.uuid4().hex[:8]}', email=f'{uuid.uuid4().hex[:8]}@example.com')
+        user.set_password('password')
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+        return user
+
+
+@pytest.fixture
+def client(user):
+    """以 user 身份调用接口的 Flask 测试客户端"""
+    from app import app
+    from auth import generate_token
+
+    with app.app_context():
+        token = generate_token(user.id, user=user)
+    test_client = app.test_client()
+    test_client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return test_client
+
+
+@pytest.fixture
+def make_task(user):
+    """创建已到期的待发送任务，channels 为渠道列表时创建多渠道任务"""
+    def make(channels=None, is_recurring=False, **fields):
+        values = dict(
+            user_id=user.id,
+            title='测试任务',
+            content='内容',
+            scheduled_time=datetime.now() - timedelta(seconds=1),
+            status=NotifyStatus.PENDING,
+            is_recurring=is_recurring,
+            cron_expression='0 9 * * *' if is_recurring else None,
+        )
+        if channels:
+            values.update(
+                channels_json=json.dumps(channels),
+                channels_config_json=json.dumps({c: {'webhook_url': f'http://example.com/{c}'} for c in channels}),
+            )
+        else:
+            values.update(
+                channel=NotifyChannel.WECOM_WEBHOOK,
+                channel_config=json.dumps({'webhook_url': 'http://example.com/hook'}),
+            )
+        values.update(fields)
+        with get_db() as db:
+            task = NotifyTask(**values)
+            db.add(task)
+            db.commit()
+            return task.id
+    return make
+
+
+def outcome(error=None):
+    """_send_channel 的返回值"""
+    return {
+        'error': error,
+        'http_code': getattr(error, 'status_code', None) if error else 200,
+        'latency_ms': 1,
+        'sent_at': datetime.now(),
+    }
+
+
+def run_task(task_id, errors=None):
+    """
+    执行一次任务，各渠道的发送结果由 errors（{渠道: 异常}）给出，不发出网络请求
+
+    Returns:
+        (claim, event)：任务未被认领时为 (None, None)
+    """
+    from scheduler import scheduler
+
+    errors = errors or {}
+    claim = scheduler._claim_task(task_id, datetime.now(), time.monotonic())
+    if claim is None:
+        return None, None
+    channels = claim['channels'] if claim['channels'] is not None else [claim['channel']]
+    outcomes = [(channel, outcome(errors.get(channel))) for channel in channels]
+    return claim, scheduler._save_execution(claim, outcomes, time.monotonic())
+
+
+def process_due_retries(monkeypatch, task_id, errors=None):
+    """把任务待处理的重试提前到期并处理一次，返回实际发送的 (任务ID, 渠道) 列表"""
+    from models import DeliveryRetry
+    from scheduler import scheduler
+
+    errors = errors or {}
+    sent = []
+
+    def send_channel(task_id, channel_str, channel_config, title, content, deadline):
+        sent.append((task_id, channel_str))
+        return outcome(errors.get(channel_str))
+
+    monkeypatch.setattr(scheduler, '_send_channel', send_channel)
+    with get_db() as db:
+        db.query(DeliveryRetry).filter(
+            DeliveryRetry.task_id == task_id, DeliveryRetry.status == 'pending'
+        ).update(
+            {'next_attempt_at': datetime.now() - timedelta(seconds=1)}, synchronize_session=False
+        )
+        db.commit()
+    scheduler._process_retries()
+    return sent
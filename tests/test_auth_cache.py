@@ -0,0 +1,72 @@
+"""已登录用户缓存：命中时不查数据库，资料修改与禁用后立即失效，按有效期与条目数淘汰"""
+
+import pytest
+
+import auth
+from auth import UserPrincipal, _UserCache, invalidate_user, load_user
+from models import User, get_db
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    invalidate_user()
+    yield
+    invalidate_user()
+
+
+def set_user(user_id, **fields):
+    with get_db() as db:
+        db.query(User).filter(User.id == user_id).update(fields, synchronize_session=False)
+        db.commit()
+
+
+def test_cached_user_is_served_until_invalidated(user):
+    assert load_user(user.id).email == user.email
+    set_user(user.id, email='changed@example.com')
+
+    assert load_user(user.id).email == user.email
+    invalidate_user(user.id)
+    assert load_user(user.id).email == 'changed@example.com'
+
+
+def test_profile_update_invalidates_cache(client, user):
+    assert client.get('/api/auth/profile').get_json()['user']['email'] == user.email
+    response = client.put('/api/auth/profile', json={'email': 'new@example.com'})
+    assert response.status_code == 200
+    assert client.get('/api/auth/profile').get_json()['user']['email'] == 'new@example.com'
+
+
+def test_disabled_user_is_rejected_after_invalidation(client, user):
+    assert client.get('/api/tasks').status_code == 200
+    set_user(user.id, is_active=False)
+    invalidate_user(user.id)
+    assert client.get('/api/tasks').status_code == 401
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth.time, 'monotonic', lambda: now[0])
+    cache = _UserCache(ttl=60, maxsize=10)
+    cache.set(1, UserPrincipal({'id': 1}))
+
+    now[0] += 59
+    assert cache.get(1).id == 1
+    now[0] += 2
+    assert cache.get(1) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = _UserCache(ttl=60, maxsize=2)
+    for user_id in (1, 2):
+        cache.set(user_id, UserPrincipal({'id': user_id}))
+    cache.get(1)
+    cache.set(3, UserPrincipal({'id': 3}))
+
+    assert cache.get(2) is None
+    assert cache.get(1).id == 1 and cache.get(3).id == 3
+
+
+def test_zero_ttl_disables_cache():
+    cache = _UserCache(ttl=0, maxsize=10)
+    cache.set(1, UserPrincipal({'id': 1}))
+    assert cache.get(1) is None
@@ -0,0 +1,69 @@
+"""数据导入：无效记录在插入前跳过并返回原因，其余记录正常导入"""
+
+from models import NotifyTask, UserChannel, get_db
+
+TASK = dict(
+    title='有效任务',
+    content='内容',
+    channel='wecom_webhook',
+    channel_config='{"webhook_url": "http://example.com/hook"}',
+    scheduled_time='2030-01-01T09:00:00',
+)
+
+
+def import_data(client, **data):
+    response = client.post('/api/import', json={'version': '1.0', **data})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_invalid_tasks_are_skipped_with_reasons(client, user):
+    result = import_data(client, tasks=[
+        TASK,
+        dict(TASK, scheduled_time=None),
+        dict(TASK, scheduled_time='garbage'),
+        dict(TASK, title=None),
+        dict(TASK, channel='nope'),
+        dict(TASK, is_recurring=True, cron_expression='xx'),
+        dict(TASK, title='重复任务', is_recurring=True, cron_expression='0 9 * * *', scheduled_time=None),
+    ])
+
+    assert result['stats']['tasks_imported'] == 2
+    assert result['stats']['tasks_invalid'] == 5
+    assert [(error['type'], error['index']) for error in result['errors']] == [
+        ('tasks', 1), ('tasks', 2), ('tasks', 3), ('tasks', 4), ('tasks', 5)
+    ]
+    with get_db() as db:
+        titles = {title for title, in db.query(NotifyTask.title).filter(NotifyTask.user_id == user.id)}
+    # 重复任务缺少计划时间时按 Cron 表达式计算下一次执行时间
+    assert titles == {'有效任务', '重复任务'}
+
+
+def test_duplicates_are_skipped_not_rejected(client):
+    import_data(client, tasks=[TASK])
+    result = import_data(client, tasks=[TASK])
+    assert result['stats']['tasks_skipped'] == 1
+    assert result['stats']['tasks_invalid'] == 0
+
+
+def test_invalid_channels_and_calendars(client, user):
+    result = import_data(
+        client,
+        user_channels=[
+            {'channel_name': '无效类型', 'channel_type': 'bogus'},
+            {'channel_type': 'wecom_webhook'},
+            {'channel_name': '企业微信', 'channel_type': 'wecom_webhook',
+             'channel_config': {'webhook_url': 'http://example.com/hook'}},
+        ],
+        external_calendars=[{'name': '缺少链接'}],
+    )
+
+    assert result['stats']['channels_imported'] == 1
+    assert result['stats']['channels_invalid'] == 2
+    assert result['stats']['calendars_invalid'] == 1
+    with get_db() as db:
+        assert db.query(UserChannel).filter(UserChannel.user_id == user.id).count() == 1
+
+
+def test_unsupported_version_is_rejected(client):
+    assert client.post('/api/import', json={'version': '0.9', 'tasks': [TASK]}).status_code == 400
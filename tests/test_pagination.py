@@ -0,0 +1,79 @@
+"""任务列表的游标分页：排序字段含 NULL 时也能翻完全部记录，无效游标返回 400"""
+
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import NotifyStatus, NotifyTask, get_db
+
+
+@pytest.fixture
+def tasks(make_task):
+    """7 个任务，其中两个的 created_at 为 NULL（旧版本数据）"""
+    base = datetime(2030, 1, 1, 9)
+    ids = [
+        make_task(scheduled_time=base + timedelta(hours=i % 3), created_at=base - timedelta(days=i % 4),
+                  status=[NotifyStatus.PENDING, NotifyStatus.SENT][i % 2])
+        for i in range(7)
+    ]
+    with get_db() as db:
+        db.query(NotifyTask).filter(NotifyTask.id.in_(ids[2:4])).update(
+            {'created_at': None}, synchronize_session=False
+        )
+        db.commit()
+    return ids
+
+
+def page_through(client, sort_by, sort_order):
+    ids, cursor, pages = [], '', 0
+    while cursor is not None:
+        response = client.get('/api/tasks', query_string={
+            'cursor': cursor, 'page_size': 2, 'sort_by': sort_by, 'sort_order': sort_order, 'with_total': 'false'
+        })
+        assert response.status_code == 200, response.get_json()
+        data = response.get_json()
+        ids += [task['id'] for task in data['tasks']]
+        cursor = data['next_cursor']
+        pages += 1
+        assert pages < 10
+    return ids
+
+
+@pytest.mark.parametrize('sort_by', ['scheduled_time', 'id', 'status', 'created_at'])
+@pytest.mark.parametrize('sort_order', ['asc', 'desc'])
+def test_cursor_pages_match_offset_order(client, tasks, sort_by, sort_order):
+    expected = [task['id'] for task in client.get('/api/tasks', query_string={
+        'page_size': 100, 'sort_by': sort_by, 'sort_order': sort_order
+    }).get_json()['tasks']]
+
+    ids = page_through(client, sort_by, sort_order)
+
+    assert ids == expected
+    assert sorted(ids) == sorted(tasks)
+
+
+def test_nulls_sort_last_ascending_and_first_descending(client, tasks):
+    null_ids = tasks[2:4]
+    assert page_through(client, 'created_at', 'asc')[-2:] == null_ids
+    assert page_through(client, 'created_at', 'desc')[:2] == null_ids[::-1]
+
+
+def encode(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+@pytest.mark.parametrize('sort_by, cursor', [
+    ('scheduled_time', 'not-a-cursor'),
+    ('scheduled_time', encode(['scheduled_time', 'desc', '2030-01-01T09:00:00', 1])),
+    ('scheduled_time', encode(['scheduled_time', 'asc', None, 1])),
+    ('scheduled_time', encode(['scheduled_time', 'asc', 'garbage', 1])),
+    ('scheduled_time', encode(['scheduled_time', 'asc', 12, 1])),
+    ('status', encode(['status', 'asc', 'bogus', 1])),
+    ('id', encode(['id', 'asc', 'x', 1])),
+    ('created_at', encode(['created_at', 'asc', '2030-01-01T09:00:00', None])),
+])
+def test_invalid_cursor_is_rejected(client, sort_by, cursor):
+    response = client.get('/api/tasks', query_string={'cursor': cursor, 'sort_by': sort_by, 'sort_order': 'asc'})
+    assert response.status_code == 400
@@ -0,0 +1,12 @@
+"""高频查询的执行计划检查：新增查询或修改索引后都应能命中索引"""
+
+from migrations import check_query_plans
+from models import init_db
+
+
+def test_hot_queries_use_indexes():
+    init_db()
+    scans = check_query_plans()
+    assert scans == {}, '以下查询发生全表扫描:\n' + '\n'.join(
+        f"{name}:\n    " + '\n    '.join(plan) for name, plan in scans.items()
+    )
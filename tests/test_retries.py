@@ -0,0 +1,121 @@
+"""失败渠道的重试：登记、补发，以及任务修改、删除或重新执行后作废"""
+
+from datetime import datetime, timedelta
+
+from conftest import process_due_retries, run_task
+from delivery import DeliveryError
+from models import DeliveryRetry, NotifyStatus, NotifyTask, get_db
+
+
+def server_error():
+    return DeliveryError('wecom_webhook', 'HTTP 500', status_code=500)
+
+
+def load(task_id):
+    with get_db() as db:
+        task = db.get(NotifyTask, task_id)
+        # SQLite 会复用已删除任务的 ID，只取本任务创建之后的重试
+        retries = db.query(DeliveryRetry).filter(
+            DeliveryRetry.task_id == task_id, DeliveryRetry.created_at >= task.created_at
+        ).order_by(DeliveryRetry.id).all()
+        return task, [retry.status for retry in retries]
+
+
+def test_failed_send_is_retried(make_task, monkeypatch):
+    task_id = make_task()
+    run_task(task_id, {'wecom_webhook': server_error()})
+    task, retries = load(task_id)
+    assert task.status == NotifyStatus.FAILED
+    assert retries == ['pending']
+
+    assert process_due_retries(monkeypatch, task_id) == [(task_id, 'wecom_webhook')]
+    task, retries = load(task_id)
+    assert task.status == NotifyStatus.SENT
+    assert retries == ['succeeded']
+
+
+def test_non_retryable_error_is_not_retried(make_task):
+    task_id = make_task()
+    run_task(task_id, {'wecom_webhook': DeliveryError('wecom_webhook', 'HTTP 400', status_code=400)})
+    task, retries = load(task_id)
+    assert task.status == NotifyStatus.FAILED
+    assert retries == []
+
+
+def test_rescheduling_cancels_pending_retries(make_task, client, monkeypatch):
+    task_id = make_task()
+    run_task(task_id, {'wecom_webhook': server_error()})
+
+    tomorrow = (datetime.now() + timedelta(days=1)).replace(microsecond=0)
+    response = client.put(f'/api/tasks/{task_id}', json={'scheduled_time': tomorrow.isoformat()})
+    assert response.status_code == 200
+
+    assert process_due_retries(monkeypatch, task_id) == []
+    task, retries = load(task_id)
+    assert task.status == NotifyStatus.PENDING
+    assert task.scheduled_time == tomorrow
+    assert task.sent_time is None
+    assert retries == ['cancelled']
+
+
+def test_pausing_and_cancelling_cancel_pending_retries(make_task, client):
+    for status in ('paused', 'cancelled'):
+        task_id = make_task(is_recurring=True)
+        run_task(task_id, {'wecom_webhook': server_error()})
+        assert client.put(f'/api/tasks/{task_id}', json={'status': status}).status_code == 200
+        assert load(task_id)[1] == ['cancelled']
+
+
+def test_deleting_cancels_pending_retries(make_task, client, monkeypatch):
+    task_id = make_task()
+    run_task(task_id, {'wecom_webhook': server_error()})
+    assert client.delete(f'/api/tasks/{task_id}').status_code == 200
+
+    assert process_due_retries(monkeypatch, task_id) == []
+    with get_db() as db:
+        assert db.query(DeliveryRetry).filter(
+            DeliveryRetry.task_id == task_id, DeliveryRetry.status == 'pending'
+        ).count() == 0
+
+
+def test_retry_is_dropped_when_task_changes_outside_the_api(make_task, monkeypatch):
+    # 如外部日历同步直接修改计划时间或配置
+    for changes in ({'scheduled_time': datetime.now() + timedelta(days=1)},
+                    {'channel_config': '{"webhook_url": "http://example.com/new"}'}):
+        task_id = make_task()
+        run_task(task_id, {'wecom_webhook': server_error()})
+        with get_db() as db:
+            db.query(NotifyTask).filter(NotifyTask.id == task_id).update(changes)
+            db.commit()
+
+        assert process_due_retries(monkeypatch, task_id) == []
+        assert load(task_id)[1] == ['cancelled']
+
+
+def test_next_run_cancels_earlier_retries(make_task):
+    task_id = make_task(is_recurring=True)
+    run_task(task_id, {'wecom_webhook': server_error()})
+    assert load(task_id)[1] == ['pending']
+
+    # 下一次触发发送成功
+    with get_db() as db:
+        db.query(NotifyTask).filter(NotifyTask.id == task_id).update(
+            {'scheduled_time': datetime.now() - timedelta(seconds=1)}
+        )
+        db.commit()
+    claim, event = run_task(task_id)
+    assert claim is not None and event['status'] == 'sent'
+    assert load(task_id)[1] == ['cancelled']
+
+
+def test_multi_channel_retries_only_failed_channel(make_task, monkeypatch):
+    task_id = make_task(channels=['wecom_webhook', 'dingtalk_webhook'])
+    run_task(task_id, {'dingtalk_webhook': server_error()})
+    task, retries = load(task_id)
+    assert task.status == NotifyStatus.SENT
+    assert task.parsed_send_results['dingtalk_webhook']['status'] == 'retrying'
+
+    assert process_due_retries(monkeypatch, task_id) == [(task_id, 'dingtalk_webhook')]
+    task, retries = load(task_id)
+    assert task.error_msg is None
+    assert task.parsed_send_results['dingtalk_webhook']['status'] == 'sent'
@@ -0,0 +1,81 @@
+"""任务增量同步：/api/tasks/changes 返回修改与删除，重叠窗口内重复返回的记录 updated_at 不变"""
+
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import app
+from models import NotifyTask, get_db
+
+
+@pytest.fixture
+def tasks(make_task, user):
+    """3 个一小时前最后修改的任务（在重叠窗口之外）"""
+    ids = [make_task(title=f'任务 {i}') for i in range(3)]
+    with get_db() as db:
+        db.query(NotifyTask).filter(NotifyTask.user_id == user.id).update(
+            {'updated_at': datetime.now() - timedelta(hours=1)}, synchronize_session=False
+        )
+        db.commit()
+    return ids
+
+
+def changes(client, since=None, **params):
+    if since is not None:
+        params['since'] = since
+    response = client.get('/api/tasks/changes', query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_first_sync_returns_everything_in_pages(client, tasks):
+    data, ids = changes(client, limit=2), []
+    ids += [task['id'] for task in data['tasks']]
+    assert data['has_more']
+    data = changes(client, data['cursor'], limit=2)
+    ids += [task['id'] for task in data['tasks']]
+    assert not data['has_more']
+    assert ids == tasks
+
+
+def test_limit_zero_returns_only_a_cursor(client, tasks):
+    data = changes(client, limit=0)
+    assert data['tasks'] == [] and data['cursor']
+    assert changes(client, data['cursor'])['tasks'] == []
+
+
+def test_updates_and_deletes_since_cursor(client, tasks):
+    cursor = changes(client, limit=0)['cursor']
+    with get_db() as db:
+        db.get(NotifyTask, tasks[0]).title = '已修改'
+        db.commit()
+    assert client.delete(f'/api/tasks/{tasks[1]}').status_code == 200
+
+    data = changes(client, cursor)
+
+    assert [task['id'] for task in data['tasks']] == [tasks[0]]
+    assert data['tasks'][0]['title'] == '已修改'
+    assert data['deleted'] == [tasks[1]]
+
+
+def test_overlap_repeats_rows_with_the_same_updated_at(client, tasks):
+    cursor = changes(client, limit=0)['cursor']
+    with get_db() as db:
+        db.get(NotifyTask, tasks[2]).title = '已修改'
+        db.commit()
+
+    first = changes(client, cursor)
+    again = changes(client, first['cursor'])
+
+    # 游标回退 CHANGES_OVERLAP_SECONDS，刚修改的记录会再返回一次，客户端按 updated_at 去重
+    assert [task['id'] for task in again['tasks']] == [tasks[2]]
+    assert again['tasks'][0]['updated_at'] == first['tasks'][0]['updated_at']
+
+
+def test_invalid_and_expired_cursors(client, tasks):
+    assert client.get('/api/tasks/changes', query_string={'since': 'garbage'}).status_code == 400
+    old = (datetime.now() - timedelta(days=app.TOMBSTONE_RETENTION_DAYS + 1)).isoformat()
+    since = base64.urlsafe_b64encode(json.dumps([old, 0]).encode('utf-8')).decode('ascii').rstrip('=')
+    assert changes(client, since)['reset'] is True
@@ -0,0 +1,149 @@
+"""限流：排队估算，以及超出配额的发送延后而不是失败"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import delivery
+from conftest import process_due_retries, run_task
+from delivery import DeliveryError, DeliveryEngine, DeliveryThrottled
+from metrics import TASK_EXECUTIONS
+from models import DeliveryRetry, NotifyStatus, NotifyTask, TaskDelivery, TaskExecution, get_db
+from scheduler import scheduler
+
+
+def throttled(channel='wecom_webhook'):
+    return DeliveryThrottled(channel, 30)
+
+
+def load(task_id):
+    with get_db() as db:
+        task = db.get(NotifyTask, task_id)
+        retries = db.query(DeliveryRetry).filter(
+            DeliveryRetry.task_id == task_id, DeliveryRetry.created_at >= task.created_at
+        ).all()
+        deliveries = db.query(TaskDelivery).filter(
+            TaskDelivery.task_id == task_id, TaskDelivery.created_at >= task.created_at
+        ).count()
+        execution = db.query(TaskExecution).filter(
+            TaskExecution.task_id == task_id, TaskExecution.started_at >= task.created_at
+        ).order_by(TaskExecution.id.desc()).first()
+        return task, retries, deliveries, execution
+
+
+def failed_runs():
+    return TASK_EXECUTIONS._values.get(('failed',), 0)
+
+
+class FakeAdapter:
+    channel = 'fake_webhook'
+
+    def rate_limit_key(self):
+        return 'http://example.com/hook'
+
+
+def test_concurrent_sends_see_each_other_in_the_queue(monkeypatch):
+    # 每 60 秒 1 次：第一条立即发送，其余同时到达的发送预计都要等待 60 秒以上
+    monkeypatch.setitem(delivery.RATE_LIMITS, 'fake_webhook', '1/60')
+    engine = DeliveryEngine()
+    adapter = FakeAdapter()
+
+    async def burst():
+        return await asyncio.gather(
+            *(engine._throttle(adapter, max_wait=5) for _ in range(5)), return_exceptions=True
+        )
+
+    results = asyncio.run(burst())
+    assert results[0] is None
+    assert all(isinstance(result, DeliveryThrottled) for result in results[1:])
+    assert engine.queue_stats()['queued'] == 0
+
+
+def test_throttled_send_is_deferred_not_failed(make_task, monkeypatch):
+    task_id = make_task()
+    failed_before = failed_runs()
+
+    claim, event = run_task(task_id, {'wecom_webhook': throttled()})
+    assert claim is not None
+    assert event is None
+    task, retries, deliveries, execution = load(task_id)
+    assert task.status == NotifyStatus.PENDING
+    assert [(r.status, r.attempt) for r in retries] == [('pending', 0)]
+    assert deliveries == 0
+    assert execution.status == 'deferred'
+    assert failed_runs() == failed_before
+
+    # 延后期间再次触发（如调度窗口重新装载）不会重复发送，也不会按错过执行标记失败
+    assert run_task(task_id) == (None, None)
+    scheduler._on_job_missed(type('Event', (), {
+        'job_id': f'task_{task_id}', 'scheduled_run_time': task.scheduled_time
+    })())
+    assert load(task_id)[0].status == NotifyStatus.PENDING
+
+    # 配额恢复后由重试队列发送
+    assert process_due_retries(monkeypatch, task_id) == [(task_id, 'wecom_webhook')]
+    task, retries, deliveries, _ = load(task_id)
+    assert task.status == NotifyStatus.SENT
+    assert [r.status for r in retries] == ['succeeded']
+    assert deliveries == 1
+
+
+def test_deferred_send_that_fails_marks_task_failed(make_task, monkeypatch):
+    task_id = make_task()
+    run_task(task_id, {'wecom_webhook': throttled()})
+
+    error = DeliveryError('wecom_webhook', 'HTTP 400', status_code=400)
+    assert process_due_retries(monkeypatch, task_id, {'wecom_webhook': error}) == [(task_id, 'wecom_webhook')]
+    task, retries, _, _ = load(task_id)
+    assert task.status == NotifyStatus.FAILED
+    assert [r.status for r in retries] == ['exhausted']
+
+
+def test_still_throttled_retry_keeps_waiting(make_task, monkeypatch):
+    task_id = make_task()
+    run_task(task_id, {'wecom_webhook': throttled()})
+
+    process_due_retries(monkeypatch, task_id, {'wecom_webhook': throttled()})
+    task, retries, deliveries, _ = load(task_id)
+    assert task.status == NotifyStatus.PENDING
+    assert [(r.status, r.attempt) for r in retries] == [('pending', 0)]
+    assert retries[0].next_attempt_at > datetime.now() + timedelta(seconds=20)
+    assert deliveries == 0
+
+
+@pytest.mark.parametrize('sent_channel_fails', [False, True])
+def test_multi_channel_deferral(make_task, sent_channel_fails):
+    task_id = make_task(channels=['wecom_webhook', 'dingtalk_webhook'])
+    errors = {'dingtalk_webhook': throttled('dingtalk_webhook')}
+    if sent_channel_fails:
+        errors['wecom_webhook'] = DeliveryError('wecom_webhook', 'HTTP 400', status_code=400)
+
+    _, event = run_task(task_id, errors)
+    task, _, _, execution = load(task_id)
+    assert task.parsed_send_results['dingtalk_webhook']['status'] == 'deferred'
+    assert '1 个因限流延后发送' in task.error_msg
+    if sent_channel_fails:
+        assert task.status == NotifyStatus.FAILED
+        assert event['status'] == 'failed'
+        assert execution.status == 'partial'
+    else:
+        assert task.status == NotifyStatus.SENT
+        assert event['status'] == 'sent'
+        assert execution.status == 'partial'
+
+
+def test_limiter_cache_evicts_only_idle_buckets(monkeypatch):
+    monkeypatch.setattr(delivery, 'LIMITER_CACHE_SIZE', 3)
+    engine = DeliveryEngine()
+    busy = engine._get_bucket('fake_webhook', 'http://busy', '1/60')
+    busy.waiting = 1
+    for i in range(10):
+        engine._get_bucket('fake_webhook', f'http://target{i}', '1/60')
+    assert len(engine._buckets) <= 3
+    assert engine._buckets[('fake_webhook', 'http://busy')] is busy
+    # 刚用完令牌的桶没有补满，也不会被淘汰
+    spent = engine._get_bucket('fake_webhook', 'http://spent', '1/60')
+    spent.tokens = 0
+    engine._get_bucket('fake_webhook', 'http://other', '1/60')
+    assert engine._buckets[('fake_webhook', 'http://spent')] is spent
@@ -0,0 +1,218 @@
+"""
+按采样记录的耗时追踪（默认关闭）
+
+设置 TRACE_SAMPLE_RATE（0~1）后，按比例对 Web 请求和调度作业记录追踪，每条追踪包含数据库查询、
+JSON 解析、模板处理、加解密和外部 HTTP 请求等片段（span）的耗时。最近的追踪保存在内存环形缓冲区中，
+由 `/api/admin/traces` 查看；设置 TRACE_FILE 时同时以 JSON Lines 写入按大小滚动的文件。
+
+未开启时 span() 只读取一次 ContextVar，数据库查询不注册事件监听。
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from sqlalchemy import event
+
+
+# 采样比例，0 表示关闭追踪
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+# 内存中保留的追踪条数
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '200'))
+# 追踪文件路径（为空时不写文件）、单个文件大小上限与保留的历史文件数
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_FILE_BACKUP_COUNT = int(os.getenv('TRACE_FILE_BACKUP_COUNT', '3'))
+# 单条追踪最多记录的片段数，超出的只计数
+TRACE_MAX_SPANS = 1000
+
+ENABLED = TRACE_SAMPLE_RATE > 0
+
+_current = contextvars.ContextVar('trace', default=None)
+_parent = contextvars.ContextVar('trace_span', default=None)
+_NOOP = nullcontext()
+
+_buffer = deque(maxlen=TRACE_BUFFER_SIZE)
+_file_logger = None
+if ENABLED and TRACE_FILE:
+    _file_logger = logging.getLogger('tracing.file')
+    _file_logger.propagate = False
+    _file_logger.setLevel(logging.INFO)
+    _file_logger.addHandler(RotatingFileHandler(
+        TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUP_COUNT, encoding='utf-8'
+    ))
+
+
+class Trace:
+    """一次请求或作业的追踪"""
+
+    def __init__(self, name, attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now()
+        self.t0 = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, start, duration, attrs=None, parent=None):
+        """记录一个片段，start 为 time.perf_counter() 时间，返回片段编号"""
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return None
+            self.spans.append([name, start, duration, attrs, parent])
+            return len(self.spans) - 1
+
+    def to_dict(self):
+        with self._lock:
+            spans = [list(s) for s in self.spans]
+        summary = {}
+        for name, _, duration, _, _ in spans:
+            item = summary.setdefault(name, {'count': 0, 'total_ms': 0.0})
+            item['count'] += 1
+            item['total_ms'] += (duration or 0) * 1000
+        for item in summary.values():
+            item['total_ms'] = round(item['total_ms'], 3)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'attrs': self.attrs,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'summary': summary,
+            'spans': [{
+                'name': name,
+                'start_ms': round((start - self.t0) * 1000, 3),
+                'duration_ms': round(duration * 1000, 3) if duration is not None else None,
+                'attrs': attrs,
+                'parent': parent
+            } for name, start, duration, attrs, parent in spans],
+            'dropped_spans': self.dropped
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'attrs', 'index', 'start', 'token')
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        # 先占位，子片段通过编号引用父片段
+        self.index = self.trace.add(self.name, self.start, None, self.attrs or None, _parent.get())
+        self.token = _parent.set(self.index)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _parent.reset(self.token)
+        if self.index is not None:
+            self.trace.spans[self.index][2] = time.perf_counter() - self.start
+            if exc_type is not None:
+                self.trace.spans[self.index][3] = {**(self.attrs or {}), 'error': exc_type.__name__}
+        return False
+
+
+def span(name, **attrs):
+    """记录代码块耗时的片段（当前没有追踪时为空操作）"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name, attrs)
+
+
+def start(name, **attrs):
+    """按采样比例开始一条追踪，返回交给 finish() 的句柄（未采样时为 None）"""
+    if not ENABLED or _current.get() is not None or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    trace = Trace(name, attrs)
+    return trace, _current.set(trace), _parent.set(None)
+
+
+def finish(handle, **attrs):
+    """结束追踪并写入缓冲区（及追踪文件）"""
+    if handle is None:
+        return
+    trace, token, parent_token = handle
+    _parent.reset(parent_token)
+    _current.reset(token)
+    trace.duration = time.perf_counter() - trace.t0
+    trace.attrs.update(attrs)
+    _buffer.append(trace)
+    if _file_logger is not None:
+        try:
+            _file_logger.info(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+        except Exception:
+            pass
+
+
+@contextmanager
+def trace(name, **attrs):
+    """在代码块内按采样比例记录追踪"""
+    handle = start(name, **attrs)
+    try:
+        yield
+    finally:
+        finish(handle)
+
+
+def bind(fn):
+    """让提交到线程池的函数继续记录到当前追踪"""
+    if _current.get() is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def bind_coroutine(coro):
+    """让交给后台事件循环执行的协程继续记录到当前追踪"""
+    trace, parent = _current.get(), _parent.get()
+    if trace is None:
+        return coro
+
+    async def run():
+        # 事件循环中的 Task 使用独立的上下文副本，这里的设置不会影响其他任务
+        _current.set(trace)
+        _parent.set(parent)
+        return await coro
+    return run()
+
+
+def instrument_engine(engine):
+    """为数据库引擎注册查询耗时片段（仅在开启追踪时注册）"""
+    if not ENABLED:
+        return
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault('trace_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        trace = _current.get()
+        starts = conn.info.get('trace_query_start')
+        if trace is not None and starts:
+            started = starts.pop()
+            trace.add('db.query', started, time.perf_counter() - started,
+                      {'sql': ' '.join(statement.split())[:200]}, _parent.get())
+
+
+def recent(limit=50, name=None):
+    """最近的追踪（新的在前）"""
+    traces = [t for t in reversed(list(_buffer)) if name is None or t.name == name]
+    return [t.to_dict() for t in traces[:limit]]